@@ -181,6 +181,46 @@ CACHES = {
 
 # Helper: default cache timeout (seconds). Use per-call timeout as needed.
 CACHE_TTL = None
+
+# Print worker: new PrintJobs are announced to every run_printer over UDP multicast, see order/print_notify.py.
+# HOST is the interface the datagrams go over (a LAN address if workers run on other machines).
+PRINT_WORKER_NOTIFY_HOST = config('PRINT_WORKER_NOTIFY_HOST', default='127.0.0.1')
+PRINT_WORKER_NOTIFY_GROUP = config('PRINT_WORKER_NOTIFY_GROUP', default='239.255.91.99')
+PRINT_WORKER_NOTIFY_PORT = config('PRINT_WORKER_NOTIFY_PORT', default=9199, cast=int)
+# Seconds a kitchen ticket waits for more items of the same order before printing (0 = print at once)
+PRINT_COALESCE_SECONDS = config('PRINT_COALESCE_SECONDS', default=0, cast=float)
+# Kitchen tickets still unprinted after this many seconds are expired instead of printed (0 = never)
+PRINT_TICKET_DEADLINE_SECONDS = config('PRINT_TICKET_DEADLINE_SECONDS', default=0, cast=int)
+# purge_print_jobs: finished jobs lose their print data after this many hours and are deleted after this many days
+PRINT_JOB_PAYLOAD_RETENTION_HOURS = config('PRINT_JOB_PAYLOAD_RETENTION_HOURS', default=24, cast=float)
+PRINT_JOB_RETENTION_DAYS = config('PRINT_JOB_RETENTION_DAYS', default=30, cast=float)
+# How often (seconds) each process checks whether another one changed the menu, see order/recipes.py
+RECIPE_CACHE_CHECK_SECONDS = config('RECIPE_CACHE_CHECK_SECONDS', default=5, cast=float)
+# Run collected side effects (tickets, audit rows, totals, availability) as soon as they are
+# collected instead of merged per transaction, see order/unit_of_work.py. Meant for tests.
+SIDE_EFFECTS_SYNC = config('SIDE_EFFECTS_SYNC', default=False, cast=bool)
+# Attempts at an after-commit flush (availability, audit) that hits a locked database, and the first pause between them (doubled each time)
+SIDE_EFFECTS_RETRIES = config('SIDE_EFFECTS_RETRIES', default=5, cast=int)
+SIDE_EFFECTS_RETRY_DELAY = config('SIDE_EFFECTS_RETRY_DELAY', default=0.2, cast=float)
+# Audit rows are written by a background thread in batches, see log/writer.py
+AUDIT_ASYNC = config('AUDIT_ASYNC', default=True, cast=bool)
+AUDIT_QUEUE_SIZE = config('AUDIT_QUEUE_SIZE', default=10000, cast=int)
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_SECONDS = config('AUDIT_FLUSH_SECONDS', default=1, cast=float)
+# What to do when the queue is full: block (up to AUDIT_QUEUE_TIMEOUT, then write inline), sync or drop
+AUDIT_QUEUE_FULL = config('AUDIT_QUEUE_FULL', default='block')
+AUDIT_QUEUE_TIMEOUT = config('AUDIT_QUEUE_TIMEOUT', default=0.5, cast=float)
+# Don't log saves that changed nothing (u_at aside)
+AUDIT_SKIP_NOOP_SAVES = config('AUDIT_SKIP_NOOP_SAVES', default=True, cast=bool)
+# Audit log retention, see log/archive.py: rows older than this many days move to the archive file (0 = keep)
+AUDIT_RETENTION_DAYS = config('AUDIT_RETENTION_DAYS', default=180, cast=float)
+# Per model overrides of AUDIT_RETENTION_DAYS; order lines are most of the log and rarely looked at after a month
+AUDIT_RETENTION_BY_MODEL = {'OrderItem': 30, 'Order': 90}
+AUDIT_ARCHIVE_PATH = config(
+    'AUDIT_ARCHIVE_PATH', default=os.path.join(os.path.dirname(DATABASES['default']['NAME']), 'audit_archive.sqlite3')
+)
+# Archived rows older than this many days are deleted for good (0 = keep forever)
+AUDIT_ARCHIVE_RETENTION_DAYS = config('AUDIT_ARCHIVE_RETENTION_DAYS', default=0, cast=float)
 CORS_ALLOW_CREDENTIALS = True # If you need cookies/sessions sent across domains
 CORS_ALLOW_ALL_ORIGINS = True
 CSRF_TRUSTED_ORIGINS = [
@@ -207,4 +247,8 @@ def configure_sqlite(sender, connection, **kwargs):
         cursor.execute('PRAGMA journal_mode = WAL;')
         cursor.execute('PRAGMA synchronous = NORMAL;')
         cursor.execute('PRAGMA cache_size = -2000;')
-        cursor.execute('PRAGMA busy_timeout = 5000;')
\ No newline at end of file
+        cursor.execute('PRAGMA busy_timeout = 20000;')
+        # BEGIN IMMEDIATE: atomic() takes the write lock when it starts and waits for it (up to
+        # busy_timeout), instead of failing with "database is locked" on its first write.
+        # Django 4.2 has no `transaction_mode` option, so its plain BEGIN is replaced here.
+        connection._start_transaction_under_autocommit = lambda: connection.cursor().execute('BEGIN IMMEDIATE')
\ No newline at end of file
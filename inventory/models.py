@@ -1,11 +1,12 @@
 # c:\Users\User\Desktop\waiter-system\inventory\models.py
 import decimal
 from django.db import models, transaction
-from django.db.models import F
+from django.db.models import Exists, F, OuterRef, Q
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
+from order import unit_of_work
 
 User = settings.AUTH_USER_MODEL
 
@@ -56,6 +57,8 @@ class Inventory(models.Model):
 
         # Refresh the instance's quantity to match the database.
         self.refresh_from_db(fields=['quantity'])
+        # .update() skips post_save, so check the menu ourselves
+        schedule_menu_availability([self.pk])
 
     def increase_quantity(self, quantity_to_increase):
         """Increases the quantity atomically."""
@@ -65,6 +68,7 @@ class Inventory(models.Model):
 
         Inventory.objects.filter(pk=self.pk).update(quantity=F('quantity') + quantity_to_increase)
         self.refresh_from_db(fields=['quantity'])
+        schedule_menu_availability([self.pk])
 
     def is_out_of_stock(self):
         """Checks if quantity is zero or less."""
@@ -96,68 +100,48 @@ class InventoryUsage(models.Model):
         return f"{self.used_quantity} of {inventory_name} used by OrderItem {order_item_id}"
 
 
-@receiver(post_save, sender=Inventory)
-def inventory_post_save_check_menu_item_availability(sender, instance, created, **kwargs):
+def recompute_menu_availability(inventory_ids, menu_item_ids=()):
+    """
+    One UPDATE: every menu item using one of `inventory_ids`, plus the `menu_item_ids`, becomes
+    available iff each of its ingredients has at least the quantity one portion needs.
     """
-    Updates the availability of related MenuItems based on the stock
-    status of ALL their required ingredients.
+    from order.models import MenuItem
+    short = MenuItemIngredient.objects.filter(menu_item=OuterRef('pk'), inventory__quantity__lt=F('quantity'))
+    using = MenuItemIngredient.objects.filter(inventory_id__in=inventory_ids).values('menu_item_id')
+    return MenuItem.objects.filter(Q(pk__in=using) | Q(pk__in=list(menu_item_ids))).update(is_available=~Exists(short))
+
+
+def schedule_menu_availability(inventory_ids):
     """
-    try:
-        from order.models import MenuItem
-    except ImportError:
-        print("Warning: Could not import MenuItem in inventory signal.")
-        return
-
-    # Get links where the SAVED inventory item ('instance') is used
-    related_ingredient_links = MenuItemIngredient.objects.filter(inventory=instance).select_related('menu_item')
-    menu_items_to_check = set(link.menu_item for link in related_ingredient_links if link.menu_item)
-
-    print(f"\nSignal triggered by Inventory: {instance.name} (ID: {instance.pk}), New Qty: {instance.quantity}") # Debug
-    print(f"Checking MenuItems: {[mi.name for mi in menu_items_to_check]}") # Debug
-
-    for menu_item in menu_items_to_check:
-        all_ingredients_available = True
-        print(f"  Checking MenuItem: {menu_item.name} (Current is_available: {menu_item.is_available})") # Debug
-        # Check ALL ingredients required for this menu_item
-        for required_ingredient_link in menu_item.ingredients.all().select_related('inventory'):
-            inventory_item_to_check = required_ingredient_link.inventory
-            required_qty_for_menu_item = required_ingredient_link.quantity # Qty needed for ONE menu item
-
-            # --- Potential Point of Failure ---
-            # Use the 'instance' directly if it's the item being checked,
-            # otherwise refresh the related item. This ensures we use the
-            # most up-to-date quantity for the item that triggered the signal.
-            current_inventory_quantity = decimal.Decimal('0.00')
-            if inventory_item_to_check.pk == instance.pk:
-                current_inventory_quantity = instance.quantity # Use the saved instance's quantity
-                print(f"    Using 'instance' for {inventory_item_to_check.name}: Qty={current_inventory_quantity}") # Debug
-            else:
-                # Refresh other ingredients from DB
-                try:
-                     inventory_item_to_check.refresh_from_db(fields=['quantity'])
-                     current_inventory_quantity = inventory_item_to_check.quantity
-                     print(f"    Refreshed {inventory_item_to_check.name}: Qty={current_inventory_quantity}") # Debug
-                except Exception as e:
-                     print(f"    Warning: Could not refresh inventory item {inventory_item_to_check.pk} in signal: {e}")
-                     all_ingredients_available = False # Assume unavailable if refresh fails
-                     break
-
-            # Check if stock is sufficient for AT LEAST ONE menu item
-            # (is_out_of_stock checks <= 0, but we need >= required_qty_for_menu_item)
-            # FIX: Check if current quantity is less than required quantity
-            if current_inventory_quantity < required_qty_for_menu_item:
-                print(f"    -> {inventory_item_to_check.name} is INSUFFICIENT (Need: {required_qty_for_menu_item}, Have: {current_inventory_quantity})") # Debug
-                all_ingredients_available = False
-                break # No need to check further for this menu item
-            else:
-                 print(f"    -> {inventory_item_to_check.name} is SUFFICIENT (Need: {required_qty_for_menu_item}, Have: {current_inventory_quantity})") # Debug
-
-
-        print(f"  Result for {menu_item.name}: all_ingredients_available = {all_ingredients_available}") # Debug
-        # Update menu_item availability only if it changed
-        if menu_item.is_available != all_ingredients_available:
-            menu_item.is_available = all_ingredients_available
-            menu_item.save(update_fields=['is_available'])
-            print(f"  SAVED MenuItem '{menu_item.name}' availability set to {all_ingredients_available}") # Debug
-        else:
-             print(f"  MenuItem '{menu_item.name}' availability unchanged ({menu_item.is_available}).") # Debug
+    Recomputes availability for `inventory_ids` once the surrounding transaction commits, together
+    with every other id scheduled in the same transaction (right away outside a transaction).
+    """
+    for inventory_id in inventory_ids:
+        unit_of_work.collect('menu_availability', ('inventory', inventory_id), True)
+
+
+def schedule_menu_item_availability(menu_item_ids):
+    """Same for menu items whose recipe changed; a removed ingredient no longer leads to the dish."""
+    for menu_item_id in menu_item_ids:
+        unit_of_work.collect('menu_availability', ('menu_item', menu_item_id), True)
+
+
+def _recompute_scheduled(keys):
+    recompute_menu_availability(
+        [pk for kind, pk in keys if kind == 'inventory'], [pk for kind, pk in keys if kind == 'menu_item']
+    )
+
+
+unit_of_work.register('menu_availability', _recompute_scheduled, order=20)
+
+
+@receiver(post_save, sender=Inventory)
+def inventory_post_save_check_menu_item_availability(sender, instance, created, **kwargs):
+    """Menu items using this ingredient may have become (un)available."""
+    schedule_menu_availability([instance.pk])
+
+
+@receiver(post_save, sender=MenuItemIngredient)
+@receiver(post_delete, sender=MenuItemIngredient)
+def recipe_changed_check_menu_item_availability(sender, instance, **kwargs):
+    schedule_menu_item_availability([instance.menu_item_id])
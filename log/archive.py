@@ -0,0 +1,173 @@
+"""
+AuditLog retention. Rows older than their model's retention period (AUDIT_RETENTION_BY_MODEL,
+else AUDIT_RETENTION_DAYS) move to a separate SQLite file, AUDIT_ARCHIVE_PATH, so the main
+database and its backups and VACUUMs stay small. The file is ATTACHed to the connection as
+`audit_archive` and read through the ArchivedAuditLog model; the audit API queries it too
+when the requested time range reaches back that far.
+
+Rows move in small batches (copy + delete in one transaction) with a pause in between, so the
+waiters' requests never wait long for SQLite's write lock. Ids and timestamps are kept, so
+both stores page together on (timestamp, id).
+"""
+import os
+import gzip
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import AuditLog, ArchivedAuditLog
+
+ALIAS = 'audit_archive'
+COLUMNS = ['id', 'model_name', 'object_id', 'action', 'changes', 'user_id', 'timestamp']
+SCHEMA = [
+    f'''CREATE TABLE IF NOT EXISTS {ALIAS}.log_auditlog (
+        id integer NOT NULL PRIMARY KEY,
+        model_name varchar(100) NOT NULL,
+        object_id varchar(100) NOT NULL,
+        action varchar(10) NOT NULL,
+        changes text NULL,
+        user_id bigint NULL,
+        timestamp datetime NOT NULL
+    )''',
+    f'CREATE INDEX IF NOT EXISTS {ALIAS}.auditlog_archive_object_history ON log_auditlog (model_name, object_id, timestamp)',
+    f'CREATE INDEX IF NOT EXISTS {ALIAS}.auditlog_archive_user_history ON log_auditlog (user_id, timestamp)',
+    f'CREATE INDEX IF NOT EXISTS {ALIAS}.auditlog_archive_timestamp ON log_auditlog (timestamp, id)',
+]
+
+
+def attach_archive(create=False):
+    """
+    Attaches AUDIT_ARCHIVE_PATH to the default connection if it isn't yet. Returns False when
+    there is no archive (not configured, or no file and not `create`). SQLite can't ATTACH
+    inside a transaction, so call this outside of one.
+    """
+    if not settings.AUDIT_ARCHIVE_PATH:
+        return False
+    path = os.path.realpath(settings.AUDIT_ARCHIVE_PATH)
+    if not create and not os.path.exists(path):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA database_list')
+        attached = {name: filename for _, name, filename in cursor.fetchall()}
+        if attached.get(ALIAS) and os.path.realpath(attached[ALIAS]) == path:
+            return True
+        if ALIAS in attached:
+            cursor.execute(f'DETACH DATABASE {ALIAS}')
+        cursor.execute(f'ATTACH DATABASE %s AS {ALIAS}', [path])
+        if create:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+    return True
+
+
+def retention_days():
+    """{model_name: days} of the models with their own policy, and the default for the rest under None."""
+    days = dict(settings.AUDIT_RETENTION_BY_MODEL)
+    days[None] = settings.AUDIT_RETENTION_DAYS
+    return days
+
+
+def expired(now=None):
+    """Q matching the rows past their model's retention, or None if everything is kept."""
+    now = now or timezone.now()
+    policy = retention_days()
+    query = Q()
+    for model_name, days in policy.items():
+        if not days:
+            continue
+        if model_name is None:
+            # Models without a policy of their own
+            others = [name for name in policy if name is not None]
+            query |= Q(timestamp__lt=now - timedelta(days=days)) & ~Q(model_name__in=others)
+        else:
+            query |= Q(model_name=model_name, timestamp__lt=now - timedelta(days=days))
+    return query or None
+
+
+def archive_horizon(now=None):
+    """Rows newer than this are never archived, so a time range starting later needs only the live table."""
+    days = [d for d in retention_days().values() if d]
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=min(days))
+
+
+def _batches(queryset, batch_size):
+    """Yields lists of ids of `queryset`, walking the primary key. The filter is applied to every batch."""
+    last = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def _export(path, rows):
+    # Appending a new gzip member per batch keeps the file readable as one stream
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+
+def archive_rows(now=None, batch_size=500, pause=0.05, export=None, dry_run=False):
+    """
+    Moves the rows past retention to the archive file (or just deletes them when
+    AUDIT_ARCHIVE_PATH is empty). With `export` (a file path) they are also appended to it as
+    gzipped JSON lines. Returns how many rows were moved, or would be with `dry_run`.
+    """
+    now = now or timezone.now()
+    query = expired(now)
+    if query is None:
+        return 0
+    # Ids don't follow timestamps (the audit writer inserts late, with the time of the change),
+    # so every batch is picked by timestamp; the horizon bound also keeps the walk short.
+    rows = AuditLog.objects.filter(query, timestamp__lt=archive_horizon(now))
+    if dry_run:
+        return rows.count()
+
+    archive = attach_archive(create=True)
+    table = AuditLog._meta.db_table
+    columns = ', '.join(COLUMNS)
+    moved = 0
+    for ids in _batches(rows, batch_size):
+        with transaction.atomic():
+            if export:
+                _export(export, AuditLog.objects.filter(pk__in=ids).order_by('pk').values(*COLUMNS))
+            if archive:
+                with connection.cursor() as cursor:
+                    # OR IGNORE: a batch copied before a crash but not deleted is copied again
+                    cursor.execute(
+                        f'INSERT OR IGNORE INTO {ALIAS}.log_auditlog ({columns}) '
+                        f'SELECT {columns} FROM main.{table} WHERE id IN ({", ".join(["%s"] * len(ids))})',
+                        ids,
+                    )
+            count, _ = AuditLog.objects.filter(pk__in=ids).delete()
+        moved += count
+        time.sleep(pause)
+    return moved
+
+
+def purge_archive(days, batch_size=500, pause=0.05, export=None):
+    """Deletes archived rows older than `days` for good, optionally exporting them first. Returns how many."""
+    if not days or not attach_archive():
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(
+            ArchivedAuditLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp', 'id').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            if export:
+                _export(export, ArchivedAuditLog.objects.filter(pk__in=ids).order_by('pk').values(*COLUMNS))
+            count, _ = ArchivedAuditLog.objects.filter(pk__in=ids).delete()
+        deleted += count
+        time.sleep(pause)
+
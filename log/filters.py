@@ -0,0 +1,11 @@
+from django_filters import rest_framework as filters
+from .models import AuditLog
+
+class AuditLogFilter(filters.FilterSet):
+    # ?since=2025-06-01&until=2025-06-02 for a time range
+    since = filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='gte')
+    until = filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='lt')
+    action = filters.BaseInFilter(field_name='action', lookup_expr='in')
+    class Meta:
+        model = AuditLog
+        fields = ['model_name', 'object_id', 'action', 'user', 'since', 'until']
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from log.archive import archive_rows, purge_archive
+
+class Command(BaseCommand):
+    help = 'Moves audit rows past their retention to the archive file, and deletes old archived rows, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archive-days', type=float, default=settings.AUDIT_ARCHIVE_RETENTION_DAYS,
+            help="Delete archived rows older than this for good (0 = keep forever)."
+        )
+        parser.add_argument('--export', default=None, help="Append moved and deleted rows to this .jsonl.gz file too.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that would move.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per write transaction.")
+        parser.add_argument('--pause', type=float, default=0.05, help="Seconds between batches, so requests get the write lock.")
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help="VACUUM the main database afterwards to give the space back to the OS. Locks it, run it off-hours."
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f"{archive_rows(dry_run=True)} audit rows past retention")
+            return
+
+        moved = archive_rows(batch_size=options['batch_size'], pause=options['pause'], export=options['export'])
+        target = settings.AUDIT_ARCHIVE_PATH or "nowhere (no AUDIT_ARCHIVE_PATH), deleted"
+        self.stdout.write(f"Moved {moved} audit rows to {target}")
+
+        if options['archive_days']:
+            deleted = purge_archive(options['archive_days'], options['batch_size'], options['pause'], options['export'])
+            self.stdout.write(f"Deleted {deleted} archived rows")
+
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM main')
+            self.stdout.write("Database vacuumed")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,117 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:33
+
+import ast
+import json
+import datetime
+import decimal
+import django.core.serializers.json
+from django.conf import settings
+from django.db import migrations, models
+
+REPR_CALLS = {
+    'Decimal': decimal.Decimal,
+    'datetime': datetime.datetime,
+    'datetime.datetime': datetime.datetime,
+    'datetime.date': datetime.date,
+    'datetime.time': datetime.time,
+    'datetime.timezone': datetime.timezone,
+    'datetime.timedelta': datetime.timedelta,
+}
+
+
+def _literal(node):
+    """ast.literal_eval plus the Decimal(...)/datetime.datetime(...) calls model_to_dict reprs contain."""
+    if isinstance(node, ast.Call):
+        name = ast.unparse(node.func)
+        if name not in REPR_CALLS:
+            raise ValueError(name)
+        args = [_literal(arg) for arg in node.args]
+        kwargs = {kw.arg: _literal(kw.value) for kw in node.keywords}
+        return REPR_CALLS[name](*args, **kwargs)
+    if isinstance(node, ast.Attribute) and ast.unparse(node) == 'datetime.timezone.utc':
+        return datetime.timezone.utc
+    if isinstance(node, ast.Dict):
+        return {_literal(k): _literal(v) for k, v in zip(node.keys, node.values)}
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_literal(el) for el in node.elts]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_literal(node.operand)
+    return ast.literal_eval(node)
+
+
+def parse_snapshot(text):
+    """Old rows hold str(model_to_dict(...)); returns the {field: value} snapshot with JSON values, or None."""
+    try:
+        value = _literal(ast.parse(text, mode='eval').body)
+    except (SyntaxError, ValueError, TypeError):
+        return None
+    if not isinstance(value, dict):
+        return None
+    return json.loads(json.dumps(value, cls=django.core.serializers.json.DjangoJSONEncoder))
+
+
+def diff(old, new):
+    """{field: [old, new]} like log.signals.diff."""
+    return {
+        name: [old.get(name), new.get(name)]
+        for name in sorted(old.keys() | new.keys())
+        if old.get(name) != new.get(name)
+    }
+
+
+def convert_changes(apps, schema_editor):
+    """
+    Turns the full snapshots into the {field: [old, new]} diffs new rows store: each row of an
+    object is compared with the object's previous row (create: [None, value], delete: [value, None]).
+    """
+    AuditLog = apps.get_model('log', 'AuditLog')
+    rows = AuditLog.objects.exclude(changes=None).order_by('model_name', 'object_id', 'pk')
+    rows = rows.only('pk', 'model_name', 'object_id', 'action', 'changes')
+    previous_key, previous, batch = None, None, []
+    for row in rows.iterator(chunk_size=2000):
+        key = (row.model_name, row.object_id)
+        if key != previous_key:
+            previous_key, previous = key, None
+        snapshot = parse_snapshot(row.changes)
+        if snapshot is None:
+            changes, previous = {'_raw': [None, row.changes]}, None
+        elif row.action == 'delete':
+            changes, previous = diff(snapshot, {}), None
+        else:
+            changes, previous = diff(previous or {}, snapshot), snapshot
+        row.changes = json.dumps(changes, cls=django.core.serializers.json.DjangoJSONEncoder)
+        batch.append(row)
+        if len(batch) >= 1000:
+            AuditLog.objects.bulk_update(batch, ['changes'])
+            batch = []
+    if batch:
+        AuditLog.objects.bulk_update(batch, ['changes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_changes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='changes',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['model_name', 'object_id', 'timestamp'], name='auditlog_object_history'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['user', 'timestamp'], name='auditlog_user_history'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:36
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0003_auditlog_json_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAuditLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100)),
+                ('object_id', models.CharField(max_length=100)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('changes', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'audit_archive"."log_auditlog',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 class AuditLog(models.Model):
     ACTION_CHOICES = [
@@ -10,11 +12,42 @@ class AuditLog(models.Model):
     model_name = models.CharField(max_length=100)
     object_id = models.CharField(max_length=100)
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
-    changes = models.TextField(null=True, blank=True)  # Store JSON as string
+    # {field: [old, new]} of the fields that changed; old is null on create, new is null on delete
+    changes = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the change happened, set by log_change; the row itself is written later by log/writer.py
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # History of one object, and the keyset pagination of the API
+            models.Index(fields=['model_name', 'object_id', 'timestamp'], name='auditlog_object_history'),
+            models.Index(fields=['user', 'timestamp'], name='auditlog_user_history'),
+            models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp'),
+        ]
 
     def __str__(self):
         return f"{self.model_name} {self.object_id} {self.action} at {self.timestamp}"
     
-    
\ No newline at end of file
+
+
+class ArchivedAuditLog(models.Model):
+    """AuditLog rows moved out of the main database; they live in the attached archive file (see log/archive.py)."""
+    model_name = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=100)
+    action = models.CharField(max_length=10, choices=AuditLog.ACTION_CHOICES)
+    changes = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # Another database file: no foreign key constraint, and deleting a user leaves the id
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name='+'
+    )
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        # Quoted as "audit_archive"."log_auditlog"
+        db_table = 'audit_archive"."log_auditlog'
+
+    def __str__(self):
+        return f"{self.model_name} {self.object_id} {self.action} at {self.timestamp} (archived)"
@@ -1,28 +1,98 @@
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_init, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
-from django.forms.models import model_to_dict
-from .models import AuditLog
+from .writer import audit_writer
 from django.conf import settings
+from django.utils import timezone
 
 # List all models you want to track
+from order import unit_of_work
 from order.models import Order, OrderItem, MenuItem
 from inventory.models import Table, Inventory
 
+TRACKED_MODELS = (Order, OrderItem, MenuItem, Table, Inventory)
+# Touched by every save, so never a reason to log one
+IGNORED_FIELDS = ('u_at',)
+
 def get_user_from_instance(instance):
-    # Try to get user from instance if available
-    if hasattr(instance, 'user'):
-        return instance.user
-    return None
+    # The id is enough and doesn't load the user
+    return getattr(instance, 'user_id', None)
+
+def field_values(instance):
+    # __dict__ rather than getattr: reading a deferred field would load it (and recurse into post_init)
+    return {
+        f.name: instance.__dict__[f.attname]
+        for f in instance._meta.concrete_fields
+        if f.attname in instance.__dict__ and f.attname not in IGNORED_FIELDS
+    }
+
+def remember_state(instance):
+    instance.__dict__['_audit_state'] = field_values(instance)
+
+def diff(old, new):
+    """{field: [old, new]} of the fields whose value differs; a missing side counts as None."""
+    return {
+        name: [old.get(name), new.get(name)]
+        for name in sorted(old.keys() | new.keys())
+        if old.get(name) != new.get(name)
+    }
+
+def changed_fields(instance):
+    """What changed since the instance was loaded or last saved; None if it wasn't loaded."""
+    state = instance.__dict__.get('_audit_state')
+    if state is None:
+        return None
+    return diff(state, field_values(instance))
 
 def log_change(instance, action, changes=None):
-    AuditLog.objects.create(
-        model_name=instance.__class__.__name__,
-        object_id=str(instance.pk),
-        action=action,
-        changes=changes,
-        user=get_user_from_instance(instance)
-    )
+    # Written after commit with the other audit rows of the transaction, one row per object
+    key = (instance.__class__.__name__, str(instance.pk))
+    row = {
+        'model_name': key[0],
+        'object_id': key[1],
+        'action': action,
+        'changes': changes,
+        'user_id': get_user_from_instance(instance),
+        'timestamp': timezone.now(),
+    }
+    unit_of_work.collect('audit', key, row, merge=merge_changes)
+
+def merge_changes(old, new):
+    """
+    Several saves of one object in a transaction become one row: each field keeps its first
+    old and last new value, fields that ended where they started are dropped, and
+    created-then-updated stays a 'create'. A delete replaces whatever came before.
+    """
+    if new['action'] == 'delete':
+        return new
+    first = {name: values[0] for name, values in (old['changes'] or {}).items()}
+    last = {name: values[1] for name, values in (old['changes'] or {}).items()}
+    for name, (before, after) in (new['changes'] or {}).items():
+        first.setdefault(name, before)
+        last[name] = after
+    action = 'create' if old['action'] == 'create' else new['action']
+    return dict(new, action=action, changes=diff(first, last))
+
+def write_audit_rows(rows):
+    rows = list(rows.values())
+    if settings.AUDIT_SKIP_NOOP_SAVES:
+        # Updates that were undone within the transaction
+        rows = [row for row in rows if row['action'] != 'update' or row['changes']]
+    # Off the request: the writer thread inserts them in batches
+    audit_writer.submit(rows)
+
+
+unit_of_work.register('audit', write_audit_rows, order=40)
+
+@receiver(post_init, sender=Order)
+@receiver(post_init, sender=OrderItem)
+@receiver(post_init, sender=MenuItem)
+@receiver(post_init, sender=Table)
+@receiver(post_init, sender=Inventory)
+def snapshot_loaded_state(sender, instance, **kwargs):
+    # Only rows read from the database have a pk here; new objects are logged as 'create'
+    if instance.pk is not None:
+        remember_state(instance)
 
 @receiver(post_save, sender=Order)
 @receiver(post_save, sender=OrderItem)
@@ -30,9 +100,16 @@ def log_change(instance, action, changes=None):
 @receiver(post_save, sender=Table)
 @receiver(post_save, sender=Inventory)
 def log_save(sender, instance, created, **kwargs):
-    action = 'create' if created else 'update'
-    changes = model_to_dict(instance)
-    log_change(instance, action, changes)
+    if created:
+        log_change(instance, 'create', diff({}, field_values(instance)))
+    else:
+        changes = changed_fields(instance)
+        if changes is None:
+            # Built by hand with a pk rather than loaded: all we know is the new values
+            changes = diff({}, field_values(instance))
+        if changes or not settings.AUDIT_SKIP_NOOP_SAVES:
+            log_change(instance, 'update', changes)
+    remember_state(instance)
 
 @receiver(pre_delete, sender=Order)
 @receiver(pre_delete, sender=OrderItem)
@@ -40,5 +117,4 @@ def log_save(sender, instance, created, **kwargs):
 @receiver(pre_delete, sender=Table)
 @receiver(pre_delete, sender=Inventory)
 def log_delete(sender, instance, **kwargs):
-    changes = model_to_dict(instance)
-    log_change(instance, 'delete', changes)
\ No newline at end of file
+    log_change(instance, 'delete', diff(field_values(instance), {}))
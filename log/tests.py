@@ -1,3 +1,160 @@
-from django.test import TestCase
+import io
+import os
+import decimal
+import tempfile
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import OperationalError
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from inventory.models import Inventory
+from .archive import archive_rows
+from .models import AuditLog, ArchivedAuditLog
+from .writer import AuditWriter
+
+
+@override_settings(AUDIT_ASYNC=False, SIDE_EFFECTS_SYNC=True)
+class AuditLogSignalTestCase(TestCase):
+    def test_saves_that_change_nothing_are_not_logged(self):
+        flour = Inventory.objects.create(name='Un', quantity=decimal.Decimal('5.00'), unit_of_measure='kg')
+        flour = Inventory.objects.get(pk=flour.pk)
+        flour.save()
+        flour.quantity = decimal.Decimal('4.00')
+        flour.save()
+
+        actions = list(AuditLog.objects.filter(model_name='Inventory').order_by('pk').values_list('action', flat=True))
+        self.assertEqual(actions, ['create', 'update'])
+
+    def test_only_changed_fields_are_stored(self):
+        flour = Inventory.objects.create(name='Un', quantity=decimal.Decimal('5.00'), unit_of_measure='kg')
+        flour = Inventory.objects.get(pk=flour.pk)
+        flour.quantity = decimal.Decimal('4.50')
+        flour.save()
+        flour.delete()
+
+        create, update, delete = AuditLog.objects.filter(model_name='Inventory').order_by('pk')
+        self.assertEqual(create.changes['name'], [None, 'Un'])
+        self.assertEqual(update.changes, {'quantity': ['5.00', '4.50']})
+        self.assertEqual(delete.changes['quantity'], ['4.50', None])
+
+
+@override_settings(AUDIT_ASYNC=False)
+class AuditLogApiTestCase(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(phone_number='998900000099', name='Admin', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        AuditLog.objects.bulk_create([
+            AuditLog(model_name='Order', object_id=str(n % 3), action='update', changes={'amount': [n, n + 1]})
+            for n in range(7)
+        ])
+
+    def test_object_history_is_paginated_by_cursor(self):
+        url = '/api/v1/audit-logs/?model_name=Order&object_id=1&page_size=2'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        expected = AuditLog.objects.filter(object_id='1').order_by('-timestamp', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+
+@override_settings(AUDIT_ASYNC=True, AUDIT_FLUSH_SECONDS=0.05, AUDIT_BATCH_SIZE=10)
+class AuditWriterTestCase(TransactionTestCase):
+    def row(self, n):
+        return {'model_name': 'Order', 'object_id': str(n), 'action': 'update', 'changes': '{}'}
+
+    def test_rows_are_written_in_the_background(self):
+        writer = AuditWriter()
+        writer.submit([self.row(n) for n in range(25)])
+        writer.queue.join()
+        self.assertEqual(AuditLog.objects.count(), 25)
+
+    @override_settings(AUDIT_QUEUE_SIZE=2, AUDIT_QUEUE_FULL='drop', AUDIT_FLUSH_SECONDS=60)
+    def test_full_queue_drops_rows_in_drop_mode(self):
+        writer = AuditWriter()
+        writer._ensure_started()
+        # Keep the writer thread from taking rows off the queue
+        with writer.queue.mutex:
+            writer.queue.queue.extend([self.row(0), self.row(1)])
+            writer.queue.unfinished_tasks += 2
+        writer.submit([self.row(2)])
+        self.assertEqual(writer.dropped, 1)
+
+        writer.flush()
+        self.assertEqual(AuditLog.objects.count(), 2)
+
+    @override_settings(AUDIT_ASYNC=False)
+    def test_locked_batch_is_retried_with_its_own_timestamp(self):
+        writer = AuditWriter()
+        write, locked = writer.write, [True]
+
+        def write_once_locked(rows):
+            if locked:
+                locked.pop()
+                raise OperationalError('database is locked')
+            write(rows)
+
+        writer.write = write_once_locked
+        changed_at = timezone.now() - timedelta(minutes=5)
+        writer.write_with_retry([dict(self.row(1), timestamp=changed_at)])
+        self.assertEqual(AuditLog.objects.get().timestamp, changed_at)
+
+
+@override_settings(AUDIT_RETENTION_DAYS=60, AUDIT_RETENTION_BY_MODEL={'OrderItem': 10})
+class AuditArchiveTestCase(TransactionTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.settings_override = override_settings(AUDIT_ARCHIVE_PATH=os.path.join(tmp, 'archive.sqlite3'))
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        now = timezone.now()
+        ages = [('Order', 90), ('OrderItem', 30), ('Order', 30), ('OrderItem', 5)]  # oldest first, like real ids
+        AuditLog.objects.bulk_create([
+            AuditLog(
+                model_name=name, object_id='1', action='update', changes={'quantity': [n, n + 1]},
+                timestamp=now - timedelta(days=days),
+            )
+            for n, (name, days) in enumerate(ages)
+        ])
+
+    def test_rows_past_retention_move_to_the_archive(self):
+        self.assertEqual(archive_rows(dry_run=True), 2)
+        call_command('archive_audit_log', '--batch-size', '1', '--pause', '0', stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(AuditLog.objects.values_list('model_name', flat=True)), ['Order', 'OrderItem']
+        )
+        self.assertEqual(sorted(ArchivedAuditLog.objects.values_list('model_name', flat=True)), ['Order', 'OrderItem'])
+        self.assertEqual(ArchivedAuditLog.objects.get(model_name='Order').changes, {'quantity': [0, 1]})
+
+    def test_rows_are_picked_by_timestamp_not_id(self):
+        now = timezone.now()
+        # Written late by the audit writer: the newest id for an old change...
+        late = AuditLog.objects.create(
+            model_name='Order', object_id='2', action='update', timestamp=now - timedelta(days=400)
+        )
+        # ...and an old id for a recent one
+        recent = AuditLog.objects.order_by('pk').first()
+        AuditLog.objects.filter(pk=recent.pk).update(timestamp=now)
+
+        self.assertEqual(archive_rows(batch_size=1, pause=0), 2)
+        self.assertEqual(sorted(ArchivedAuditLog.objects.values_list('pk', flat=True)), sorted([late.pk, recent.pk + 1]))
+
+    def test_api_reads_live_and_archived_rows(self):
+        archive_rows(pause=0)
+        user = get_user_model().objects.create_user(phone_number='998900000098', name='Admin', role='admin')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        data = client.get('/api/v1/audit-logs/?object_id=1').json()
+        self.assertEqual([row['changes']['quantity'][0] for row in data['results']], [3, 2, 1, 0])
+        since = (timezone.now() - timedelta(days=7)).isoformat()
+        data = client.get('/api/v1/audit-logs/', {'since': since}).json()
+        self.assertEqual(len(data['results']), 1)
@@ -1,11 +1,113 @@
+import base64
+import logging
+from django.db import DatabaseError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import render
 from .models import AuditLog
 from rest_framework import viewsets
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .archive import archive_horizon, attach_archive
+from .filters import AuditLogFilter
+from .models import ArchivedAuditLog
 from .serializers import AuditLogSerializer
 from rest_framework import permissions
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
+class AuditLogPagination(pagination.BasePagination):
+    """
+    Keyset pagination on (-timestamp, -id): the cursor holds the last row's timestamp and id, so
+    page 1000 costs what page 1 does. Works over several querysets at once (the live table and
+    the archive), each fetching one page past the cursor and the pages merged.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(token.encode()).decode().rsplit('|', 1)
+            timestamp, pk = parse_datetime(timestamp), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            timestamp = None
+        if timestamp is None:
+            raise NotFound('Invalid cursor')
+        return timestamp, pk
+
+    def encode_cursor(self, row):
+        token = base64.urlsafe_b64encode(f"{row.timestamp.isoformat()}|{row.pk}".encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        rows = []
+        for queryset in querysets:
+            if cursor:
+                timestamp, pk = cursor
+                queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+            rows += queryset.order_by('-timestamp', '-id')[:size + 1]
+        rows.sort(key=lambda row: (row.timestamp, row.pk), reverse=True)
+        page = rows[:size]
+        self.next = self.encode_cursor(page[-1]) if len(rows) > size else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.next, 'results': data})
+
 class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = AuditLog.objects.all().order_by('-timestamp')
+    """
+    Audit history, newest first. Filter by model_name + object_id for one object's history, or by
+    user, action, since/until. Archived rows (see log/archive.py) are included when `since` is
+    missing or older than the newest rows that can have been archived.
+    """
+    queryset = AuditLog.objects.all()
     serializer_class = AuditLogSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AuditLogPagination
+    filterset_class = AuditLogFilter
+
+    def archived_queryset(self):
+        filterset = AuditLogFilter(self.request.query_params, queryset=ArchivedAuditLog.objects.all(), request=self.request)
+        if not filterset.is_valid():
+            return None
+        since, horizon = filterset.form.cleaned_data.get('since'), archive_horizon()
+        if since and horizon and since >= horizon:
+            return None
+        try:
+            if not attach_archive():
+                return None
+        except DatabaseError:
+            # e.g. called inside a transaction, where SQLite can't ATTACH
+            logger.warning("Audit archive not attached, showing live rows only", exc_info=True)
+            return None
+        return filterset.qs
+
+    def list(self, request, *args, **kwargs):
+        querysets = [self.filter_queryset(self.get_queryset())]
+        archived = self.archived_queryset()
+        if archived is not None:
+            querysets.append(archived)
+        page = self.paginator.paginate_querysets(querysets, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
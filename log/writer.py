@@ -0,0 +1,145 @@
+"""
+Background writer for audit rows. Committed transactions hand their rows to a bounded
+in-process queue and return; a daemon thread writes them with bulk_create in batches.
+What is still queued at interpreter exit is written by an atexit hook.
+
+A batch that meets a locked database is retried with a growing pause until it is written (a
+few times only at exit); a batch with a row that can't be written at all is written row by row
+and only the bad rows are logged and skipped.
+
+When the queue is full, AUDIT_QUEUE_FULL decides: 'block' waits up to AUDIT_QUEUE_TIMEOUT
+seconds for room and then writes inline, 'sync' writes inline right away, 'drop' discards
+the row (and logs how many were lost).
+"""
+import time
+import queue
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 0.5  # seconds, doubled after each locked attempt
+RETRY_DELAY_MAX = 30
+EXIT_RETRIES = 5
+
+
+class AuditWriter:
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, rows):
+        """Queues AuditLog kwargs dicts; written inline when AUDIT_ASYNC is off."""
+        if not settings.AUDIT_ASYNC:
+            self.write(rows)
+            return
+        self._ensure_started()
+        for row in rows:
+            self._put(row)
+
+    def _put(self, row):
+        mode = settings.AUDIT_QUEUE_FULL
+        try:
+            if mode == 'block':
+                self.queue.put(row, timeout=settings.AUDIT_QUEUE_TIMEOUT)
+            else:
+                self.queue.put_nowait(row)
+            return
+        except queue.Full:
+            pass
+        if mode == 'drop':
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning("Audit queue full, %s rows dropped so far", self.dropped)
+            return
+        self.write_with_retry([row], retries=EXIT_RETRIES)
+
+    def _ensure_started(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+                atexit.register(self.flush)
+            self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.thread.start()
+
+    def _next_batch(self, timeout):
+        """Waits up to `timeout` for the first row, then takes what is queued up to AUDIT_BATCH_SIZE."""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < settings.AUDIT_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(settings.AUDIT_FLUSH_SECONDS)
+            if not batch:
+                continue
+            close_old_connections()
+            try:
+                self.write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, rows):
+        from .models import AuditLog
+        # BEGIN IMMEDIATE (see configure_sqlite in settings): waits for the write lock instead of failing on the INSERT
+        with transaction.atomic():
+            AuditLog.objects.bulk_create([AuditLog(**row) for row in rows], batch_size=settings.AUDIT_BATCH_SIZE)
+
+    def write_with_retry(self, rows, retries=None):
+        """Writes rows, retrying while the database is locked (forever unless `retries` is given)."""
+        delay = RETRY_DELAY
+        attempt = 0
+        while True:
+            try:
+                self.write(rows)
+                return
+            except OperationalError as e:
+                attempt += 1
+                if retries is not None and attempt > retries:
+                    logger.error("Could not write %s audit rows, database locked: %s", len(rows), e)
+                    return
+                logger.warning("Audit rows wait for a locked database (attempt %s): %s", attempt, e)
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_DELAY_MAX)
+            except Exception:
+                break
+        # Some row can't be written: write the others one by one
+        for row in rows:
+            try:
+                self.write([row])
+            except Exception:
+                logger.exception("Could not write audit row %r", row)
+
+    def flush(self):
+        """Writes everything still queued from the calling thread, e.g. at shutdown."""
+        if self.queue is None:
+            return
+        while True:
+            batch = self._next_batch(0.01)
+            if not batch:
+                break
+            try:
+                self.write_with_retry(batch, retries=EXIT_RETRIES)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+audit_writer = AuditWriter()
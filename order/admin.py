@@ -1,32 +1,39 @@
 from django.contrib import admin
-from .models import Order, MenuItem, OrderItem, Reservations, Printer, PrintJob
+from .models import Order, MenuItem, OrderItem, Reservations, Printer, PrinterGroup, PrintJob
 from unfold.admin import ModelAdmin
+@admin.register(PrinterGroup)
+class PrinterGroupAdmin(ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
 @admin.register(Printer)
 class PrinterAdmin(ModelAdmin):
-    list_display = ('name', 'ip_address', 'port', 'is_cashier_printer', 'is_enabled')
+    list_display = ('name', 'ip_address', 'port', 'render_mode', 'group', 'backup_printer', 'unreachable_since', 'is_cashier_printer', 'is_enabled')
+    list_filter = ('group', 'is_enabled')
     search_fields = ('name', 'ip_address')
 @admin.register(PrintJob)
 class PrintJobAdmin(ModelAdmin):
-    list_display = ('id', 'printer', 'status', 'c_at')
-    list_filter = ('status', 'c_at')
+    list_display = ('id', 'printer', 'kind', 'priority', 'order', 'status', 'attempts', 'error_message', 'worker_id', 'c_at')
+    list_filter = ('status', 'kind', 'priority', 'c_at')
     search_fields = ('printer__name',)
 @admin.register(Order)
 class OrderAdmin(ModelAdmin):
-    list_display = ('id', 'user', 'order_status', 'subamount', 'amount', 'c_at')
+    list_display = ('id', 'user', 'order_status', 'subamount', 'amount', 'commission_rate', 'c_at')
     list_filter = ('order_status', 'c_at')
     search_fields = ('user__username',)
+    readonly_fields = ('commission_rate',)
 
 
 @admin.register(MenuItem)
 class MenuItemAdmin(ModelAdmin):
-    list_display = ('name', 'category', 'price', 'is_available', 'is_frequent',"printer")
+    list_display = ('name', 'category', 'price', 'is_available', 'is_frequent',"printer", "printer_group")
     list_filter = ('category', 'is_available', 'is_frequent')
     search_fields = ('name', 'description')
 
 @admin.register(OrderItem)
 class OrderItemAdmin(ModelAdmin):
-    list_display = ('order', 'menu_item', 'quantity')
+    list_display = ('order', 'menu_item', 'quantity', 'unit_price', 'line_total')
     list_filter = ('order', 'menu_item')
+    readonly_fields = ('unit_price', 'line_total')
 
 
 @admin.register(Reservations)
@@ -190,9 +190,7 @@ class AdminReportView(APIView):
 
         # Consolidated summary
         if 'consolidated_summary' in reports:
-            gross_sales = OrderItem.objects.filter(order__in=orders_qs).annotate(
-                line_total=F('quantity') * F('menu_item__price')
-            ).aggregate(total=Sum('line_total'))['total'] or 0
+            gross_sales = OrderItem.objects.filter(order__in=orders_qs).aggregate(total=Sum('line_total'))['total'] or 0
 
             # Commission/profit derived from order.amount - order.subamount
             commission_total = orders_qs.aggregate(total=Sum(F('amount') - F('subamount')))['total'] or 0
@@ -225,7 +223,7 @@ class AdminReportView(APIView):
                 OrderItem.objects
                 .filter(order__in=orders_qs)
                 .values('menu_item__category')
-                .annotate(total_revenue=Sum(F('quantity') * F('menu_item__price')))
+                .annotate(total_revenue=Sum('line_total'))
                 .order_by('menu_item__category')
             )
             response['reports']['revenue_by_category'] = [
@@ -241,7 +239,7 @@ class AdminReportView(APIView):
                 .filter(order__in=orders_qs)
                 .annotate(hour=TruncHour('order__c_at'))
                 .values('hour')
-                .annotate(total=Sum(F('quantity') * F('menu_item__price')))
+                .annotate(total=Sum('line_total'))
                 .order_by('hour')
             )
             response['reports']['hourly_revenue'] = [
@@ -305,7 +303,7 @@ class AdminReportView(APIView):
                 OrderItem.objects
                 .filter(order__in=orders_qs)
                 .values('menu_item__id', 'menu_item__name')
-                .annotate(total_revenue=Sum(F('quantity') * F('menu_item__price')))
+                .annotate(total_revenue=Sum('line_total'))
                 .order_by('-total_revenue')
             )
             response['reports']['dish_sales'] = [
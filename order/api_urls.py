@@ -12,6 +12,7 @@ router.register(r'menuitems', views.MenuItemViewSet, basename='menuitem')
 router.register(r'orderitems', views.OrderItemViewSet, basename='orderitem')
 router.register(r'reservations', views.ReservationsViewSet, basename='reservation')
 router.register(r'printers', views.PrinterViewSet, basename='printer')
+router.register(r'printjobs', views.PrintJobViewSet, basename='printjob')
 
 
 
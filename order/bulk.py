@@ -0,0 +1,90 @@
+"""
+Bulk write path for adding several items to orders at once (POST /orderitems/ with a list).
+Instead of OrderItem.save() per row, the whole submission costs a fixed handful of queries:
+recipes come from the recipe cache, every ingredient is deducted with one conditional UPDATE, and the
+OrderItem and InventoryUsage rows are inserted with bulk_create.
+"""
+import decimal
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.signals import post_save
+from inventory.models import Inventory, InventoryUsage, schedule_menu_availability
+from . import unit_of_work
+from .models import OrderItem, defer_order_total
+from .recipes import recipes_for
+
+
+def required_ingredients(order_items, recipes):
+    """{inventory_id: total quantity} needed for all `order_items`; `recipes` is {menu_item_id: Recipe}."""
+    required = defaultdict(decimal.Decimal)
+    for item in order_items:
+        for inventory_id, per_portion in recipes[item.menu_item_id].ingredients:
+            required[inventory_id] += decimal.Decimal(str(item.quantity)) * per_portion
+    return required
+
+
+def deduct_inventory(required):
+    """
+    Takes the `required` quantities out of stock, one conditional UPDATE per inventory row.
+    If anything is short, raises one ValidationError naming every short ingredient; the caller's
+    transaction then rolls back the deductions that did succeed.
+    """
+    short = []
+    for inventory_id in sorted(required):
+        quantity = required[inventory_id]
+        if quantity <= 0:
+            continue
+        updated = Inventory.objects.filter(pk=inventory_id, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity
+        )
+        if not updated:
+            short.append(inventory_id)
+    if short:
+        available = Inventory.objects.in_bulk(short)
+        raise ValidationError([
+            f"Insufficient stock for {available[pk].name}. Available: {available[pk].quantity}, Required: {required[pk]}"
+            for pk in short
+        ])
+    schedule_menu_availability(required)
+
+
+def restore_inventory(amounts):
+    """Puts {inventory_id: quantity} back into stock."""
+    for inventory_id in sorted(amounts):
+        if amounts[inventory_id] > 0:
+            Inventory.objects.filter(pk=inventory_id).update(quantity=F('quantity') + amounts[inventory_id])
+    schedule_menu_availability(amounts)
+
+
+def create_order_items(rows):
+    """
+    Creates OrderItems from `rows` (dicts with order, menu_item and optional quantity) in one go.
+    Signals still fire per item (kitchen tickets, audit log), and each order's total is
+    moved once by the value of its new lines. Returns the created items.
+    """
+    order_items = [OrderItem(**row) for row in rows]
+    recipes = recipes_for({item.menu_item_id for item in order_items})
+    for item in order_items:
+        item.snapshot_price()
+
+    with unit_of_work.atomic():
+        deduct_inventory(required_ingredients(order_items, recipes))
+        OrderItem.objects.bulk_create(order_items)
+        for item in order_items:
+            item._remember_loaded()
+        InventoryUsage.objects.bulk_create([
+            InventoryUsage(
+                inventory_id=inventory_id,
+                order_item=item,
+                used_quantity=decimal.Decimal(str(item.quantity)) * per_portion,
+            )
+            for item in order_items
+            for inventory_id, per_portion in recipes[item.menu_item_id].ingredients
+        ])
+
+        for item in order_items:
+            post_save.send(sender=OrderItem, instance=item, created=True, update_fields=None, raw=False, using='default')
+            # Merged into one UPDATE per order by the unit of work
+            defer_order_total(item.order_id, item.line_total)
+    return order_items
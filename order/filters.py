@@ -1,6 +1,6 @@
 
 from django_filters import rest_framework as filters
-from .models import Order
+from .models import Order, PrintJob
 
 class OrderFilter(filters.FilterSet):
     order_status = filters.BaseInFilter(field_name='order_status', lookup_expr='in')
@@ -8,4 +8,11 @@ class OrderFilter(filters.FilterSet):
     user = filters.BaseInFilter(field_name='user', lookup_expr='in')
     class Meta:
         model = Order
-        fields = ['order_status', 'table__location', 'user']
\ No newline at end of file
+        fields = ['order_status', 'table__location', 'user']
+
+class PrintJobFilter(filters.FilterSet):
+    # ?table=7: the jobs of that table's orders
+    table = filters.NumberFilter(field_name='order__table')
+    class Meta:
+        model = PrintJob
+        fields = ['order', 'order_item', 'kind', 'status', 'priority', 'printer', 'table']
@@ -0,0 +1,172 @@
+import io
+import os
+import time
+import socket
+import decimal
+import tempfile
+import threading
+from collections import defaultdict
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, OutputWrapper
+from django.db import connection
+from django.test.utils import override_settings
+from inventory.models import Table
+from order import unit_of_work
+from order.models import Order, MenuItem, OrderItem, Printer
+from order.printer_simulator import SimulatedPrinter
+from order.printing import ConcurrentPrintWorker, SerialPrintWorker
+
+WORKERS = {'serial': SerialPrintWorker, 'concurrent': ConcurrentPrintWorker}
+
+
+def _free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Floods a throwaway database with orders and measures ticket latency end to end '
+        '(OrderItem saved -> PrintJob -> ticket out of a simulated printer) per run_printer mode'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=list(WORKERS), default=['serial', 'concurrent'])
+        parser.add_argument('--orders', type=int, default=50, help="Orders to submit per mode.")
+        parser.add_argument('--items', type=int, default=3, help="Items per order, spread over the printers.")
+        parser.add_argument('--printers', type=int, default=3, help="Simulated printers (stations).")
+        parser.add_argument('--render-mode', choices=['image', 'text'], default='image')
+        parser.add_argument('--interval', type=float, default=0, help="Seconds between orders (0 = as fast as possible).")
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds each simulated printer spends per ticket.")
+        parser.add_argument('--throughput', type=int, default=0, help="Printer bytes per second (0 = unlimited).")
+        parser.add_argument('--buffer-size', type=int, default=4096, help="Printer input buffer in bytes (0 = OS default).")
+        parser.add_argument('--drop-rate', type=float, default=0, help="Chance per read that a printer resets the connection.")
+        parser.add_argument(
+            '--hanging', type=int, default=0,
+            help="Printers (of --printers) that stop reading after their first read, like a jammed printer. "
+                 "Their tickets are left out of the results; what counts is how long the others wait.",
+        )
+        parser.add_argument('--batch-size', type=int, default=10, help="Worker --batch-size.")
+        parser.add_argument('--timeout', type=float, default=120, help="Seconds to wait for all tickets of a mode.")
+
+    def handle(self, *args, **options):
+        # Never touch the real database: everything runs in a temporary SQLite file
+        old_name = connection.settings_dict['NAME']
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        self.stdout.write("Creating benchmark database...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(PRINT_WORKER_NOTIFY_PORT=_free_udp_port()):
+                self.user = get_user_model().objects.create_user(
+                    phone_number='+998000000000', name='Benchmark', role='waiter'
+                )
+                results = [self.run_mode(mode, options) for mode in options['modes']]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("")
+        if options['hanging']:
+            self.stdout.write(f"Tickets of the {options['hanging']} hanging printers are not counted.")
+        self.stdout.write(f"{'mode':<12}{'tickets':>8}{'lost':>6}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'tickets/s':>11}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<12}{row['tickets']:>8}{row['lost']:>6}{row['p50']:>9.0f}{row['p95']:>9.0f}"
+                f"{row['max']:>9.0f}{row['rate']:>11.1f}"
+            )
+
+    def run_mode(self, mode, options):
+        self.stdout.write(f"Running {mode}...")
+        received = defaultdict(list)  # {port: [monotonic time of each ticket]}
+        lock = threading.Lock()
+
+        def ticket_printed(simulator, ticket):
+            with lock:
+                received[simulator.port].append(ticket.printed_at)
+
+        simulators, menu_items = [], []
+        hanging = set()
+        for index in range(options['printers']):
+            simulator = SimulatedPrinter(
+                port=0, latency=options['latency'], throughput=options['throughput'],
+                drop_rate=options['drop_rate'], buffer_size=options['buffer_size'],
+                timeout_rate=1 if index < options['hanging'] else 0, hang_seconds=options['timeout'],
+                on_ticket=ticket_printed, seed=index,
+            )
+            simulator.start()
+            simulators.append(simulator)
+            if index < options['hanging']:
+                hanging.add(simulator.port)
+            printer = Printer.objects.create(
+                name=f"bench-{mode}-{index}", ip_address='127.0.0.1', port=simulator.port,
+                render_mode=options['render_mode'],
+            )
+            menu_items.append(MenuItem.objects.create(
+                name=f"bench-{mode}-dish-{index}", price=decimal.Decimal('10000.00'), category='mains', printer=printer
+            ))
+        table = Table.objects.create(name=f"bench-{mode}", capacity=4)
+
+        worker = WORKERS[mode](
+            OutputWrapper(io.StringIO()), self.style,
+            worker_id=f"bench-{mode}",
+            printer_ids=[item.printer_id for item in menu_items],
+            poll_interval=1,
+            batch_size=options['batch_size'],
+        )
+        thread = threading.Thread(target=worker.run, name=f"bench-{mode}", daemon=True)
+        thread.start()
+
+        expected = defaultdict(list)  # {port: [monotonic time each ticket was submitted]}
+        started = time.monotonic()
+        try:
+            for _ in range(options['orders']):
+                order = Order.objects.create(user=self.user, table=table)
+                items = [menu_items[k % len(menu_items)] for k in range(options['items'])]
+                submitted = time.monotonic()
+                # Same path as POST /orderitems/ with a list: one ticket per printer
+                with unit_of_work.atomic():
+                    for menu_item in items:
+                        OrderItem.objects.create(order=order, menu_item=menu_item)
+                for port in {item.printer.port for item in items} - hanging:
+                    expected[port].append(submitted)
+                if options['interval']:
+                    time.sleep(options['interval'])
+
+            total = sum(len(times) for times in expected.values())
+            deadline = time.monotonic() + options['timeout']
+            while time.monotonic() < deadline:
+                with lock:
+                    if sum(len(received[port]) for port in expected) >= total:
+                        break
+                time.sleep(0.01)
+        finally:
+            worker.stop()
+            thread.join(timeout=5)
+            for simulator in simulators:
+                simulator.stop()
+
+        # Each printer's queue is FIFO for same-priority tickets: the n-th received is the n-th submitted
+        latencies, finished = [], started
+        for port, submitted_times in expected.items():
+            for submitted, arrived in zip(submitted_times, received[port]):
+                latencies.append((arrived - submitted) * 1000)
+                finished = max(finished, arrived)
+        if not latencies:
+            latencies = [0]
+        printed = sum(min(len(received[port]), len(times)) for port, times in expected.items())
+        return {
+            'mode': mode,
+            'tickets': printed,
+            'lost': total - printed,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'max': max(latencies),
+            'rate': printed / max(finished - started, 1e-9),
+        }
@@ -0,0 +1,44 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from order.print_retention import purge_jobs, strip_payloads
+
+class Command(BaseCommand):
+    help = 'Strips print data from finished print jobs and deletes (or archives) old ones in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--payload-hours', type=float, default=settings.PRINT_JOB_PAYLOAD_RETENTION_HOURS,
+            help="Clear the image/ESC-POS data of printed, cancelled and expired jobs older than this."
+        )
+        parser.add_argument(
+            '--days', type=float, default=settings.PRINT_JOB_RETENTION_DAYS,
+            help="Delete finished jobs older than this (0 = keep forever)."
+        )
+        parser.add_argument('--archive', default=None, help="Append deleted rows to this .jsonl.gz file first.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per write transaction.")
+        parser.add_argument('--pause', type=float, default=0.05, help="Seconds between batches, so requests get the write lock.")
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help="VACUUM afterwards to give the space back to the OS. Locks the whole database, run it off-hours."
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['payload_hours']:
+            cutoff = now - timedelta(hours=options['payload_hours'])
+            stripped = strip_payloads(cutoff, options['batch_size'], options['pause'])
+            self.stdout.write(f"Stripped print data from {stripped} jobs")
+
+        if options['days']:
+            cutoff = now - timedelta(days=options['days'])
+            deleted = purge_jobs(cutoff, options['batch_size'], options['pause'], options['archive'])
+            self.stdout.write(f"Deleted {deleted} jobs" + (f", archived to {options['archive']}" if options['archive'] else ""))
+
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write("Database vacuumed")
+        self.stdout.write(self.style.SUCCESS("Done"))
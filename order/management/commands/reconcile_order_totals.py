@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from order.models import Order, items_subtotal, order_totals
+
+class Command(BaseCommand):
+    help = 'Checks Order.subamount/amount against the order items and repairs the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report mismatched orders.")
+        parser.add_argument('--status', nargs='+', default=None, help="Only orders with these statuses.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders repaired per UPDATE.")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['status']:
+            orders = orders.filter(order_status__in=options['status'])
+
+        # Expected totals come from the same expressions the incremental updates use
+        expected = order_totals(items_subtotal())
+        mismatched = list(
+            orders.annotate(expected_subamount=expected['subamount'], expected_amount=expected['amount'])
+            .filter(~Q(subamount=F('expected_subamount')) | ~Q(amount=F('expected_amount')))
+            .values_list('pk', 'subamount', 'amount', 'expected_subamount', 'expected_amount')
+        )
+        for pk, subamount, amount, expected_subamount, expected_amount in mismatched:
+            self.stdout.write(
+                f"Order {pk}: subamount {subamount} -> {expected_subamount}, amount {amount} -> {expected_amount}"
+            )
+
+        if options['dry_run'] or not mismatched:
+            self.stdout.write(f"{len(mismatched)} orders with wrong totals")
+            return
+
+        ids = [row[0] for row in mismatched]
+        repaired = 0
+        for start in range(0, len(ids), options['batch_size']):
+            with transaction.atomic():
+                repaired += Order.objects.filter(pk__in=ids[start:start + options['batch_size']]).update(
+                    **order_totals(items_subtotal())
+                )
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} orders"))
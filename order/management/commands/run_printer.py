@@ -1,60 +1,44 @@
-import time
-import socket
-import io
-import base64
-from PIL import Image
 from django.core.management.base import BaseCommand
-from order.models import PrintJob
-from escpos.printer import Network 
+from order.printing import ConcurrentPrintWorker, DEFAULT_LEASE_SECONDS, SerialPrintWorker
 
 class Command(BaseCommand):
     help = 'Process print jobs as high-quality images'
 
-    def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS("Started Image-Based Print Worker..."))
-
-        while True:
-            pending_jobs = PrintJob.objects.filter(status='pending').order_by('c_at')
-
-            for job in pending_jobs:
-                job.refresh_from_db()
-                if job.status != 'pending':
-                    continue
-
-                p = None
-                try:
-                    # 1. Physical Check
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.settimeout(3)
-                    if sock.connect_ex((job.printer.ip_address, int(job.printer.port or 9100))) != 0:
-                        raise ConnectionError("Printer Unreachable")
-                    sock.close()
-
-                    # 2. Decode Base64 Payload to Image
-                    image_bytes = base64.b64decode(job.payload)
-                    img = Image.open(io.BytesIO(image_bytes))
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=['concurrent', 'serial'], default='concurrent',
+            help="concurrent: one independent queue per printer (default). serial: the old single loop."
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=10,
+            help="Seconds between fallback pending-job scans. New jobs normally wake the worker immediately."
+        )
+        parser.add_argument(
+            '--retry-delay', type=float, default=5,
+            help="Backoff after a failed job (doubles per attempt) and the first pause of a printer that keeps failing."
+        )
+        parser.add_argument('--worker-id', default=None, help="Name recorded on claimed jobs (default: host:pid).")
+        parser.add_argument(
+            '--printer', type=int, action='append', dest='printer_ids',
+            help="Only handle jobs of this printer id. Repeat to run one worker per station."
+        )
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs claimed per UPDATE.")
+        parser.add_argument(
+            '--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+            help="Claimed jobs return to the queue if the worker has not finished them within this time."
+        )
 
-                    # 3. Print
-                    p = Network(job.printer.ip_address, port=int(job.printer.port or 9100))
-                    self.stdout.write(f"Printing Image Job {job.id}...")
-                    
-                    # Use bitImageRaster for better compatibility with thermal printers
-                    p.image(img, impl="bitImageRaster")
-                    p.cut()
-
-                    # 4. Success Sync
-                    time.sleep(1.5)
-                    job.status = 'printed'
-                    job.save()
-                    self.stdout.write(self.style.SUCCESS(f"Job {job.id} Success"))
-
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Print Error: {e}"))
-                    break 
-
-                finally:
-                    if p:
-                        try: p.device.close()
-                        except: pass
-
-            time.sleep(2)
\ No newline at end of file
+    def handle(self, *args, **options):
+        mode = options['mode']
+        worker_class = SerialPrintWorker if mode == 'serial' else ConcurrentPrintWorker
+        self.stdout.write(self.style.SUCCESS(f"Started Image-Based Print Worker ({mode})..."))
+        worker = worker_class(
+            self.stdout, self.style,
+            worker_id=options['worker_id'],
+            printer_ids=options['printer_ids'],
+            poll_interval=options['poll_interval'],
+            retry_delay=options['retry_delay'],
+            batch_size=options['batch_size'],
+            lease_seconds=options['lease_seconds'],
+        )
+        worker.run()
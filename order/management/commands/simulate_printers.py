@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from order.printer_simulator import SimulatedPrinter
+
+class Command(BaseCommand):
+    help = 'Run fake raw-TCP ESC/POS printers that decode received tickets into text/PNG files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9100, help="Port of the first printer; the others use the next ports.")
+        parser.add_argument('--count', type=int, default=1, help="Number of printers.")
+        parser.add_argument('--output-dir', default=None, help="Write every ticket as <port>-<n>.txt / .png here.")
+        parser.add_argument('--latency', type=float, default=0, help="Seconds each ticket takes to print.")
+        parser.add_argument('--throughput', type=int, default=0, help="Bytes per second accepted (0 = unlimited).")
+        parser.add_argument('--drop-rate', type=float, default=0, help="Chance per read that the connection is reset.")
+        parser.add_argument('--timeout-rate', type=float, default=0, help="Chance per read that the printer hangs.")
+        parser.add_argument('--hang-seconds', type=float, default=30, help="How long a hanging printer stops reading.")
+        parser.add_argument('--paper-out', action='store_true', help="Swallow tickets and report paper end on DLE EOT.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed for repeatable faults.")
+
+    def handle(self, *args, **options):
+        printers = []
+        for index in range(options['count']):
+            printer = SimulatedPrinter(
+                host=options['host'],
+                port=options['port'] + index,
+                latency=options['latency'],
+                throughput=options['throughput'],
+                drop_rate=options['drop_rate'],
+                timeout_rate=options['timeout_rate'],
+                hang_seconds=options['hang_seconds'],
+                paper_out=options['paper_out'],
+                output_dir=options['output_dir'],
+                on_ticket=self.ticket_printed,
+                seed=None if options['seed'] is None else options['seed'] + index,
+            )
+            printer.start()
+            printers.append(printer)
+            self.stdout.write(self.style.SUCCESS(f"Simulated printer listening on {printer}"))
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for printer in printers:
+                printer.stop()
+
+    def ticket_printed(self, printer, ticket):
+        lines = [line for line in ticket.decoded_text().splitlines() if line.strip()]
+        kind = f"{len(ticket.bands)} raster bands" if ticket.bands else f"{len(lines)} text lines"
+        self.stdout.write(f"[{printer}] ticket {len(printer.tickets)}: {ticket.size} bytes, {kind}")
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_alter_printjob_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0005_printjob_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        # Jobs that already exist hold a base64 PNG in `payload`
+        migrations.AddField(
+            model_name='printjob',
+            name='payload_format',
+            field=models.CharField(choices=[('png_base64', 'Base64 PNG (legacy)'), ('escpos', 'ESC/POS bytes')], default='png_base64', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='printjob',
+            name='payload_format',
+            field=models.CharField(choices=[('png_base64', 'Base64 PNG (legacy)'), ('escpos', 'ESC/POS bytes')], default='escpos', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='printjob',
+            name='payload',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
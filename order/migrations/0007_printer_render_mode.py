@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0006_printjob_binary_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='render_mode',
+            field=models.CharField(choices=[('image', 'Image'), ('text', 'Text')], default='image', max_length=10),
+        ),
+    ]
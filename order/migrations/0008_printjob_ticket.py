@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0007_printer_render_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='ticket',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='printjob',
+            name='payload_format',
+            field=models.CharField(choices=[('png_base64', 'Base64 PNG (legacy)'), ('escpos', 'ESC/POS bytes'), ('ticket', 'Ticket description')], default='escpos', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_printjob_ticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
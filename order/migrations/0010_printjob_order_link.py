@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0009_printjob_not_before'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='kind',
+            field=models.CharField(blank=True, choices=[('new', 'New items'), ('cancel', 'Cancellation'), ('reduce', 'Reduction'), ('cashier', 'Cashier receipt')], max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='print_jobs', to='order.order'),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='order_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='print_jobs', to='order.orderitem'),
+        ),
+        migrations.AddIndex(
+            model_name='printjob',
+            index=models.Index(fields=['order', 'kind', 'status'], name='printjob_order_kind_status'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0010_printjob_order_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='backup_printer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='backup_for', to='order.printer'),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=5),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='rerouted_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='order.printer'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:11
+
+from django.db import migrations, models
+
+
+def set_priority_from_kind(apps, schema_editor):
+    PrintJob = apps.get_model('order', 'PrintJob')
+    PrintJob.objects.filter(kind__in=['cancel', 'reduce']).update(priority=0)
+    PrintJob.objects.filter(kind='cashier').update(priority=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0011_printjob_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Cancellation'), (1, 'Cashier receipt'), (2, 'New items')], default=2),
+        ),
+        migrations.AlterField(
+            model_name='printjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('printing', 'Printing'), ('printed', 'Printed'), ('failed', 'Failed'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='printjob',
+            index=models.Index(fields=['status', 'priority', 'c_at'], name='printjob_queue'),
+        ),
+        migrations.RunPython(set_priority_from_kind, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0013_printer_group'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='printjob',
+            name='printjob_queue',
+        ),
+        migrations.AddIndex(
+            model_name='printjob',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'printing'])), fields=['printer', 'priority', 'c_at'], name='printjob_active'),
+        ),
+    ]
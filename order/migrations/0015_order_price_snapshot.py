@@ -0,0 +1,48 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:23
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_snapshots(apps, schema_editor):
+    # Old lines only know today's menu price, which is also what their totals were computed from
+    OrderItem = apps.get_model('order', 'OrderItem')
+    MenuItem = apps.get_model('order', 'MenuItem')
+    Order = apps.get_model('order', 'Order')
+    Table = apps.get_model('inventory', 'Table')
+    OrderItem.objects.update(unit_price=Subquery(MenuItem.objects.filter(pk=OuterRef('menu_item_id')).values('price')[:1]))
+    OrderItem.objects.update(line_total=F('quantity') * F('unit_price'))
+    Order.objects.update(commission_rate=Coalesce(
+        Subquery(Table.objects.filter(pk=OuterRef('table_id')).values('commission')[:1]),
+        Value(Decimal('0.00')),
+        output_field=models.DecimalField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0014_printjob_active_index'),
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='commission_rate',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
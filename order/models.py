@@ -4,17 +4,22 @@ import decimal # Import decimal
 import logging
 from django.db import models, transaction
 # Ensure all necessary models are imported
-from inventory.models import Table, Inventory, InventoryUsage, MenuItemIngredient
+from inventory.models import Table, Inventory, InventoryUsage, MenuItemIngredient, schedule_menu_availability
 from django.core.exceptions import ValidationError
-from django.db.models import F
-from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.conf import settings
+from . import unit_of_work
+from .recipes import invalidate_recipes, recipe_for
 
 User = settings.AUTH_USER_MODEL
 
 logger = logging.getLogger(__name__)
 
+USAGE_PRECISION = decimal.Decimal('0.001')  # InventoryUsage.used_quantity's decimal places
+
 PRINTER_STATUS_CHOICES = [
     ('done', 'Done'),
     ('pending', 'Pending'),
@@ -36,6 +41,11 @@ MENU_CATEGORY_CHOICES = [
     ('appetizers', 'Appetizers'),
 ]
 
+PRINTER_RENDER_MODE_CHOICES = [
+    ('image', 'Image'),
+    ('text', 'Text'),
+]
+
 RESERVATION_STATUS_CHOICES = [
     ('pending', 'Pending'),
     ('confirmed', 'Confirmed'),
@@ -52,36 +62,83 @@ class Order(models.Model):
     c_at = models.DateTimeField(auto_now_add=True)
     u_at = models.DateTimeField(auto_now=True)
     table = models.ForeignKey(Table, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    # Table commission (%) when the order was opened; later changes to the table don't touch old orders
+    commission_rate = models.DecimalField(max_digits=5, decimal_places=2, default=decimal.Decimal('0.00'))
 
     def __str__(self):
         return f"Order ID: {self.id}, Status: {self.order_status}"
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.table:
+            self.commission_rate = self.table.commission
+        super().save(*args, **kwargs)
     def diff(self):
         """Returns the difference between amount and subamount."""
         difference = self.amount - self.subamount
         return difference
 
     def calculate_order_total(self):
-        """Calculates subamount (without commission) and amount (with commission) based on associated order items."""
-        subtotal = decimal.Decimal('0.00')
-        for item in self.order_items.all():
-             subtotal += item.get_total_item_amount()
-
-        final_total = subtotal
-        commission_percentage = decimal.Decimal('0.00')
-
-        if self.table and self.table.commission:
-            commission_percentage = self.table.commission
-            commission_amount = subtotal * (commission_percentage / decimal.Decimal('100.00'))
-            final_total += commission_amount
-
-        # Update fields only if they have changed
-        if self.subamount != subtotal or self.amount != final_total:
-            self.subamount = subtotal
-            self.amount = final_total
-            self.save(update_fields=['subamount', 'amount'])
+        """Recalculates subamount and amount from all items with one SUM inside a single UPDATE."""
+        Order.objects.filter(pk=self.pk).update(**order_totals(items_subtotal()))
+        self.refresh_from_db(fields=['subamount', 'amount'])
         return self.amount
 
 
+
+def defer_order_total(order_id, delta=None):
+    """
+    Adds `delta` (the change in value of the order's lines) to its totals, or with delta=None
+    recalculates them from all items, before the unit_of_work.atomic() block commits. All
+    changes to one order in the block end up in a single UPDATE.
+    """
+    unit_of_work.collect('order_total', order_id, delta, merge=_merge_total_changes)
+
+
+def _merge_total_changes(old, new):
+    if old is None or new is None:
+        return None
+    return old + new
+
+
+def update_order_totals(changes):
+    """Flusher for {order_id: delta or None}; the delta path re-applies commission in the same UPDATE."""
+    recalculate = [order_id for order_id, delta in changes.items() if delta is None]
+    if recalculate:
+        Order.objects.filter(pk__in=recalculate).update(**order_totals(items_subtotal()))
+    for order_id, delta in changes.items():
+        if delta:
+            Order.objects.filter(pk=order_id).update(**order_totals(F('subamount') + delta))
+
+
+unit_of_work.register('order_total', update_order_totals, order=10, required=True)
+
+
+def items_subtotal():
+    """Subquery with SUM(line_total) of the outer order's items (0 without items)."""
+    line_sum = (
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum('line_total'))
+        .values('total')
+    )
+    return Coalesce(Subquery(line_sum), Value(decimal.Decimal('0.00')), output_field=models.DecimalField())
+
+
+def order_totals(subamount):
+    """
+    update() kwargs setting subamount and amount (subamount plus the order's commission).
+    SET expressions all see the old row, so amount is computed from `subamount` again, not from the column.
+    """
+    commission = F('commission_rate')
+    # Multiplying by 0.01 rather than dividing by 100: SQLite keeps whole-number decimals as
+    # integers, and 10 / 100 would be integer division
+    amount = subamount + subamount * commission * Value(decimal.Decimal('0.01'))
+    return {
+        'subamount': Round(subamount, 2),
+        'amount': Round(ExpressionWrapper(amount, output_field=models.DecimalField()), 2),
+    }
+
+
 class CompletedOrderManager(models.Manager):
     """A custom manager that returns only completed orders."""
     def get_queryset(self):
@@ -106,6 +163,8 @@ class MenuItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=100, choices=MENU_CATEGORY_CHOICES)
     printer = models.ForeignKey('Printer', on_delete=models.SET_NULL, null=True, blank=True, related_name='menu_items')
+    # When set, tickets go to the least busy healthy printer of the group instead of `printer`
+    printer_group = models.ForeignKey('PrinterGroup', on_delete=models.SET_NULL, null=True, blank=True, related_name='menu_items')
     is_available = models.BooleanField(default=True)
     is_frequent = models.BooleanField(default=False)
     c_at = models.DateTimeField(auto_now_add=True)
@@ -118,15 +177,58 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items')
     menu_item = models.ForeignKey(MenuItem, on_delete=models.PROTECT, related_name='order_items')
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=decimal.Decimal('1.00'))
+    # Menu price at the time of sale and quantity * unit_price, so totals and reports don't
+    # join menu items and later price changes don't rewrite old sales
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=decimal.Decimal('0.00'))
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, default=decimal.Decimal('0.00'))
     c_at = models.DateTimeField(auto_now_add=True)
     u_at = models.DateTimeField(auto_now=True)
 
+    # Fields remembered as loaded from the database, to compare against on save
+    TRACKED_FIELDS = ('quantity', 'menu_item_id', 'order_id', 'line_total')
+
     def __str__(self):
         return f"{self.quantity} x {self.menu_item.name} (Order: {self.order.id})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded()
+        return instance
+
+    def _remember_loaded(self):
+        self._loaded = {name: self.__dict__.get(name) for name in self.TRACKED_FIELDS}
+
+    def original(self, name):
+        """Value of a tracked field as last loaded or saved, without a query when the item came from the database."""
+        if not hasattr(self, '_loaded'):
+            # Built by hand with an existing pk: read it once
+            row = OrderItem.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first() or {}
+            self._loaded = {name: row.get(name) for name in self.TRACKED_FIELDS}
+        return self._loaded[name]
+
     def get_total_item_amount(self):
         """Calculates the total price for this line item."""
-        return self.quantity * self.menu_item.price
+        return self.quantity * self.unit_price
+
+    def snapshot_price(self):
+        """Takes the current menu price as this line's unit price."""
+        self.unit_price = recipe_for(self.menu_item_id).price
+        self.line_total = self.get_total_item_amount()
+
+    def _update_order_total(self, is_new):
+        """Moves the order total by this line's change; falls back to a full recalculation when the line moved."""
+        if is_new:
+            defer_order_total(self.order_id, self.line_total)
+            return
+        original_line_total = self.original('line_total')
+        original_order_id = self.original('order_id')
+        if original_line_total is None or original_order_id != self.order_id:
+            defer_order_total(self.order_id)
+            if original_order_id and original_order_id != self.order_id:
+                defer_order_total(original_order_id)
+            return
+        defer_order_total(self.order_id, self.line_total - original_line_total)
 
     def clean(self):
         """Ensure menu item is available before adding."""
@@ -135,59 +237,46 @@ class OrderItem(models.Model):
             raise ValidationError(f"'{self.menu_item.name}' is currently not available.")
 
     def _manage_inventory_on_save(self, is_new):
-        if not self.menu_item: return
+        if not self.menu_item_id: return
 
         if is_new:
             _reduce_inventory(self)
+        elif self.original('menu_item_id') != self.menu_item_id:
+            # Another dish: give back what the old one used and take the new one's ingredients
+            _increase_inventory(self)
+            _reduce_inventory(self)
         else:
-            for ingredient_link in self.menu_item.ingredients.all().select_related('inventory'):
-                try:
-                    inventory_item = ingredient_link.inventory
-                    required_ingredient_qty_per_menu_item = ingredient_link.quantity
-                    new_total_required_qty = decimal.Decimal(str(self.quantity)) * required_ingredient_qty_per_menu_item
-
-                    usage_record, usage_created = InventoryUsage.objects.get_or_create(
-                        inventory=inventory_item,
-                        order_item=self,
-                        defaults={'used_quantity': decimal.Decimal('0.00')}
-                    )
-
-                    adjustment_qty = new_total_required_qty - usage_record.used_quantity
-
-                    if adjustment_qty != 0:
-                        if adjustment_qty > 0:
-                            inventory_item.reduce_quantity(adjustment_qty)
-                        elif adjustment_qty < 0:
-                            inventory_item.increase_quantity(abs(adjustment_qty))
-
-                        if new_total_required_qty <= 0 and not usage_created:
-                            usage_record.delete()
-                        elif new_total_required_qty > 0:
-                            usage_record.used_quantity = new_total_required_qty
-                            usage_record.save(update_fields=['used_quantity'])
-
-                except Inventory.DoesNotExist:
-                    print(f"Warning: Inventory item not found for ingredient link {ingredient_link.pk} during update.")
-                except ValidationError as e:
-                    raise ValidationError(f"Failed adjusting OrderItem {self.pk}: {e}")
-                except Exception as e:
-                    print(f"Error adjusting inventory for OrderItem {self.pk}: {e}")
+            original_quantity = self.original('quantity')
+            if original_quantity is None or original_quantity == self.quantity:
+                return
+            _rescale_inventory(self, original_quantity)
 
     def save(self, *args, **kwargs):
         is_new = self._state.adding
-        with transaction.atomic():
+        if is_new or self.original('menu_item_id') != self.menu_item_id:
+            # New line, or switched to another dish: sold at that dish's current price
+            self.snapshot_price()
+            priced = ('unit_price', 'line_total')
+        else:
+            self.line_total = self.get_total_item_amount()
+            priced = ('line_total',)
+        if kwargs.get('update_fields') is not None:
+            # The order total moves by the new line_total, so it has to be stored too
+            kwargs['update_fields'] = {*kwargs['update_fields'], *priced}
+        with unit_of_work.atomic():
             super().save(*args, **kwargs)
             self._manage_inventory_on_save(is_new)
             if self.order:
-                self.order.calculate_order_total()
+                self._update_order_total(is_new)
+        self._remember_loaded()
 
     def delete(self, *args, **kwargs):
         order = self.order
-        with transaction.atomic():
+        with unit_of_work.atomic():
             _increase_inventory(self)
             super().delete(*args, **kwargs)
-        if order:
-            order.calculate_order_total()
+            if order:
+                defer_order_total(order.pk, -self.line_total)
 
 
 class Reservations(models.Model):
@@ -205,52 +294,203 @@ class Reservations(models.Model):
     def clean(self):
         super().clean()
 
+class PrinterGroup(models.Model):
+    """Several printers of one station (e.g. two grill printers) that share its tickets."""
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    def least_busy_printer(self, exclude=None):
+        """
+        The enabled, reachable member with the fewest unprinted jobs. Falls back to any enabled
+        member when all of them are marked unreachable, so the tickets still queue somewhere.
+        """
+        members = self.printers.filter(is_enabled=True)
+        if exclude is not None:
+            members = members.exclude(pk=exclude)
+        members = members.annotate(
+            outstanding=models.Count('printjob', filter=models.Q(printjob__status__in=PrintJob.ACTIVE_STATUSES))
+        ).order_by('outstanding', 'pk')
+        return members.filter(unreachable_since__isnull=True).first() or members.first()
+
 class Printer(models.Model):
     name = models.CharField(max_length=255, unique=True)
     ip_address = models.GenericIPAddressField()
     port = models.IntegerField(default=9100) # Added port
     is_cashier_printer = models.BooleanField(default=False)
     is_enabled = models.BooleanField(default=True)
+    # 'text' prints with the printer's built-in font: far less data and much faster than a bitmap
+    render_mode = models.CharField(max_length=10, choices=PRINTER_RENDER_MODE_CHOICES, default='image')
+    # Takes over this printer's jobs while it is down (e.g. the second printer of the same station)
+    backup_printer = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='backup_for'
+    )
+    group = models.ForeignKey(PrinterGroup, on_delete=models.SET_NULL, null=True, blank=True, related_name='printers')
+    # Set by the print worker while the printer's circuit breaker is open
+    unreachable_since = models.DateTimeField(blank=True, null=True)
     
     def __str__(self):
         return f"{self.name} ({self.ip_address})"
 
+@models.CharField.register_lookup
+class LiteralIn(models.Lookup):
+    """
+    `field__literal_in=[...]`: like __in, but the values are written into the SQL instead of
+    bound as parameters. SQLite only uses a partial index when it can see the values.
+    Only for constant lists from our own code, never for user input.
+    """
+    lookup_name = 'literal_in'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        values = ', '.join("'%s'" % str(value).replace("'", "''") for value in self.rhs)
+        return f'{lhs} IN ({values})', params
+
+class PrintJobQuerySet(models.QuerySet):
+    def active(self):
+        """Jobs still in the queue, filtered so that the partial index printjob_active is used."""
+        return self.filter(status__literal_in=PrintJob.ACTIVE_STATUSES)
+
 class PrintJob(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('printing', 'Printing'),
         ('printed', 'Printed'),
         ('failed', 'Failed'),
+        ('expired', 'Expired'),
         ('cancelled', 'Cancelled'),
     )
 
+    # Jobs still in the queue; use PrintJob.objects.active() to filter on them
+    ACTIVE_STATUSES = ['pending', 'printing']
+
+    # Lower prints first: a cancellation must reach the kitchen before the dish is cooked,
+    # and a guest waiting to pay should not wait behind a burst of kitchen tickets.
+    PRIORITY_CANCEL = 0
+    PRIORITY_CASHIER = 1
+    PRIORITY_NEW = 2
+    PRIORITY_CHOICES = (
+        (PRIORITY_CANCEL, 'Cancellation'),
+        (PRIORITY_CASHIER, 'Cashier receipt'),
+        (PRIORITY_NEW, 'New items'),
+    )
+
+    PAYLOAD_FORMAT_CHOICES = (
+        ('png_base64', 'Base64 PNG (legacy)'),
+        ('escpos', 'ESC/POS bytes'),
+        ('ticket', 'Ticket description'),
+    )
+
+    KIND_CHOICES = (
+        ('new', 'New items'),
+        ('cancel', 'Cancellation'),
+        ('reduce', 'Reduction'),
+        ('cashier', 'Cashier receipt'),
+    )
+
     printer = models.ForeignKey(Printer, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    payload = models.TextField() # Stores the actual text to print
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NEW)
+    # Not printed after this any more ('expired'); a late kitchen ticket only confuses the cooks
+    deadline = models.DateTimeField(blank=True, null=True)
+    # What the job prints and for which order, for dedupe, reprints and per-table history
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True, null=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='print_jobs')
+    order_item = models.ForeignKey(OrderItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='print_jobs')
+    payload_format = models.CharField(max_length=20, choices=PAYLOAD_FORMAT_CHOICES, default='escpos')
+    payload = models.TextField(blank=True, default='') # Legacy base64 PNG of old jobs
+    data = models.BinaryField(blank=True, null=True) # Ready-to-send ESC/POS stream ('escpos' format)
+    ticket = models.JSONField(blank=True, null=True) # What to print ('ticket' format), rendered by the worker
     error_message = models.TextField(blank=True, null=True)
+    # Failed sends so far; after max_attempts the job goes to the backup printer or to 'failed'
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # Set when the job was moved here from a dead printer; a job is only moved once
+    rerouted_from = models.ForeignKey(
+        Printer, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Set when a worker claims the job ('printing'); an expired lease means the worker died
+    worker_id = models.CharField(max_length=100, blank=True, null=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    # Held back until then so later items of the same order can join the ticket
+    not_before = models.DateTimeField(blank=True, null=True)
     c_at = models.DateTimeField(auto_now_add=True)
     u_at = models.DateTimeField(auto_now=True)
 
+    objects = PrintJobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'kind', 'status'], name='printjob_order_kind_status'),
+            # Only covers queued jobs, so claiming stays fast however much history piles up
+            models.Index(
+                fields=['printer', 'priority', 'c_at'], name='printjob_active',
+                condition=models.Q(status__in=['pending', 'printing']),
+            ),
+        ]
+
     def __str__(self):
         return f"Job {self.id} -> {self.printer.name} ({self.status})"
+
+@receiver(post_save, sender=PrintJob)
+def printjob_post_save_notify_worker(sender, instance, created, **kwargs):
+    """Wakes the print worker as soon as the new job is committed."""
+    if created:
+        from .print_notify import notify_print_worker
+        printer_id = instance.printer_id
+        transaction.on_commit(lambda: notify_print_worker(printer_id))
+
 def _reduce_inventory(order_item):
-    if not order_item.menu_item: return
-    for ingredient_link in order_item.menu_item.ingredients.all().select_related('inventory'):
-        try:
-            inventory_item = ingredient_link.inventory
-            required_qty = decimal.Decimal(str(order_item.quantity)) * ingredient_link.quantity
-            inventory_item.reduce_quantity(required_qty)
-            InventoryUsage.objects.create(
-                inventory=inventory_item,
-                order_item=order_item,
-                used_quantity=required_qty
-            )
-        except Inventory.DoesNotExist:
-             print(f"Warning: Inventory item not found for ingredient link {ingredient_link.pk} during reduction.")
-        except ValidationError as e:
-            raise ValidationError(f"Failed OrderItem {order_item.pk}: {e}")
-        except Exception as e:
-             print(f"Error reducing inventory for OrderItem {order_item.pk}: {e}")
+    if not order_item.menu_item_id: return
+    from .bulk import deduct_inventory
+    quantity = decimal.Decimal(str(order_item.quantity))
+    required = {
+        inventory_id: quantity * per_portion
+        for inventory_id, per_portion in recipe_for(order_item.menu_item_id).ingredients
+    }
+    try:
+        deduct_inventory(required)
+    except ValidationError as e:
+        raise ValidationError(f"Failed OrderItem {order_item.pk}: {'; '.join(e.messages)}")
+    InventoryUsage.objects.bulk_create([
+        InventoryUsage(inventory_id=inventory_id, order_item=order_item, used_quantity=used)
+        for inventory_id, used in required.items()
+    ])
+
+def _rescale_inventory(order_item, original_quantity):
+    """
+    Moves stock by a quantity change. The line's own usage rows are scaled by new/old quantity,
+    not re-read from the recipe: it may have changed since the line was sold.
+    """
+    from .bulk import deduct_inventory, restore_inventory
+    quantity = decimal.Decimal(str(order_item.quantity))
+    original = decimal.Decimal(str(original_quantity))
+    if original <= 0:
+        # Nothing was taken for it (its usage rows went when it dropped to 0)
+        if quantity > 0:
+            _reduce_inventory(order_item)
+        return
+    usage = list(InventoryUsage.objects.filter(order_item=order_item))
+    deduct, restore = {}, {}
+    for row in usage:
+        used = (row.used_quantity * quantity / original).quantize(USAGE_PRECISION) if quantity > 0 else 0
+        change = used - row.used_quantity
+        if change > 0:
+            deduct[row.inventory_id] = deduct.get(row.inventory_id, 0) + change
+        elif change < 0:
+            restore[row.inventory_id] = restore.get(row.inventory_id, 0) - change
+        row.used_quantity = used
+    try:
+        deduct_inventory(deduct)
+    except ValidationError as e:
+        raise ValidationError(f"Failed adjusting OrderItem {order_item.pk}: {'; '.join(e.messages)}")
+    restore_inventory(restore)
+    if quantity <= 0:
+        InventoryUsage.objects.filter(order_item=order_item).delete()
+    else:
+        InventoryUsage.objects.bulk_update(usage, ['used_quantity'])
 
 def _increase_inventory(order_item):
     """Restores inventory based on usage records using direct DB update."""
@@ -278,6 +518,8 @@ def _increase_inventory(order_item):
                      print(f"Warning: Inventory ID {inventory_id} not found during update for restore.")
 
 
+        schedule_menu_availability(items_to_update)
+
         # Delete usage records after attempting restoration
         deleted_count, _ = usage_records.delete()
         print(f"Deleted {deleted_count} usage records for OrderItem {order_item.pk}.") # Debug print
@@ -294,14 +536,11 @@ def order_post_save_trigger_printer(sender, instance, created, **kwargs):
     
     if instance.order_status in TRIGGER_STATUSES:
         try:
-            from .utils import cashier_receipt
+            from .tickets import describe_ticket, enqueue_ticket
             
-            # 1. Check if a job for this status already exists to avoid double-printing
+            # 1. Check if a receipt for this order is already queued to avoid double-printing
             # Optional: Remove this check if you want it to print every time they hit save
-            already_exists = PrintJob.objects.filter(
-                payload__icontains=f"ID: {instance.id}", # A way to identify the order in the image string
-                status='pending'
-            ).exists()
+            already_exists = PrintJob.objects.active().filter(order=instance, kind='cashier').exists()
             
             if already_exists:
                 return
@@ -313,29 +552,13 @@ def order_post_save_trigger_printer(sender, instance, created, **kwargs):
                 print(f"DEBUG: No enabled Cashier Printer found for Order {instance.id}")
                 return
 
-            # 3. Generate Image Content (Base64 string from your new utils.py)
-            content = cashier_receipt(instance.id)
-            
-            # 4. Create Job
-            PrintJob.objects.create(
-                printer=printer, 
-                payload=content, 
-                status='pending'
-            )
-            print(f"DEBUG: PrintJob created successfully for Order {instance.id}")
+            # 3. Queue the receipt; the print worker renders it after the transaction commits
+            enqueue_ticket(printer, describe_ticket('cashier', instance.id))
+            print(f"DEBUG: PrintJob queued for Order {instance.id}")
 
         except Exception as e:
             # Use print() here temporarily to see errors in your terminal if logger isn't configured
             print(f"ERROR creating cashier receipt for Order {instance.pk}: {str(e)}")
-@receiver(pre_save, sender=OrderItem)
-def store_original_quantity(sender, instance, **kwargs):
-    """Before saving, store the original quantity if the item already exists."""
-    if not instance._state.adding:
-        try:
-            instance._original_quantity = OrderItem.objects.get(pk=instance.pk).quantity
-        except OrderItem.DoesNotExist:
-            instance._original_quantity = None
-
 @receiver(post_save, sender=OrderItem)
 def orderitem_post_save_trigger_printer(sender, instance, created, **kwargs):
     """
@@ -343,21 +566,20 @@ def orderitem_post_save_trigger_printer(sender, instance, created, **kwargs):
     - Prints a reduction ticket if quantity is decreased.
     """
     try:
-        from .utils import orderitem_receipt, reduced_orderitem_receipt
-        target_printer = instance.menu_item.printer 
-        if not target_printer or not target_printer.is_enabled:
+        from .tickets import describe_ticket, enqueue_ticket, route_for, ticket_line
+        target_printer = route_for(instance.menu_item_id)
+        if target_printer is None:
             return
 
         if created:
-            content = orderitem_receipt([instance])
-            PrintJob.objects.create(printer=target_printer, payload=content, status='pending')
+            enqueue_ticket(target_printer, describe_ticket('new', instance.order_id, [ticket_line(instance)]))
         
         else: # If updated
-            original_quantity = getattr(instance, '_original_quantity', None)
+            original_quantity = instance.original('quantity')
             if original_quantity is not None and instance.quantity < original_quantity:
                 reduced_by = original_quantity - instance.quantity
-                content = reduced_orderitem_receipt(instance, reduced_by)
-                PrintJob.objects.create(printer=target_printer, payload=content, status='pending')
+                ticket = describe_ticket('reduce', instance.order_id, [ticket_line(instance, reduced_by)])
+                enqueue_ticket(target_printer, ticket)
 
     except Exception as e:
         logger.exception(f"Error in orderitem_post_save_trigger_printer: {e}")
@@ -366,14 +588,25 @@ def orderitem_post_save_trigger_printer(sender, instance, created, **kwargs):
 def orderitem_post_delete_trigger_printer(sender, instance, **kwargs):
     """Prints cancellation ticket when item is deleted."""
     try:
-        from .utils import cancelled_orderitem_receipt
+        from .tickets import describe_ticket, enqueue_ticket, route_for, ticket_line
         
-        target_printer = instance.menu_item.printer 
+        target_printer = route_for(instance.menu_item_id)
 
-        if target_printer and target_printer.is_enabled:
-            content = cancelled_orderitem_receipt([instance])
-            PrintJob.objects.create(printer=target_printer, payload=content, status='pending')
+        if target_printer is not None:
+            enqueue_ticket(target_printer, describe_ticket('cancel', instance.order_id, [ticket_line(instance)]))
 
     except Exception as e:
         logger.exception(f"Error creating cancel receipt: {e}")
 
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=MenuItemIngredient)
+@receiver(post_delete, sender=MenuItemIngredient)
+@receiver(post_save, sender=Printer)
+@receiver(post_delete, sender=Printer)
+@receiver(post_save, sender=PrinterGroup)
+@receiver(post_delete, sender=PrinterGroup)
+def menu_changed_invalidate_recipes(sender, **kwargs):
+    """Names, prices, recipes and printers are cached by order.recipes."""
+    invalidate_recipes()
@@ -0,0 +1,91 @@
+"""
+New PrintJobs are announced to the print workers with a UDP datagram to a multicast group, so
+every listening worker gets it: one run_printer for all printers, or one per station
+(`run_printer --printer N`), each wakes up for its own printers within milliseconds. The
+datagrams go over the PRINT_WORKER_NOTIFY_HOST interface (loopback by default: web process and
+workers on the same machine). A lost datagram only costs a worker's fallback poll.
+"""
+import time
+import socket
+import select
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _group():
+    return (settings.PRINT_WORKER_NOTIFY_GROUP, settings.PRINT_WORKER_NOTIFY_PORT)
+
+
+def notify_print_worker(printer_id):
+    """Tells the waiting print workers that `printer_id` has a new job. Fire-and-forget UDP datagram."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(settings.PRINT_WORKER_NOTIFY_HOST))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.sendto(str(printer_id).encode(), _group())
+    except OSError as e:
+        # No worker listening is fine, it will find the job on its fallback poll.
+        logger.debug("Could not notify print worker: %s", e)
+    finally:
+        sock.close()
+
+
+class PrintJobListener:
+    """Receives notify_print_worker() datagrams inside a print worker; any number of workers can listen."""
+
+    def __init__(self):
+        self.sock = None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            # Several workers share the port; each member of the group gets every datagram
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', settings.PRINT_WORKER_NOTIFY_PORT))
+            membership = socket.inet_aton(settings.PRINT_WORKER_NOTIFY_GROUP) + socket.inet_aton(settings.PRINT_WORKER_NOTIFY_HOST)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setblocking(False)
+            self.sock = sock
+        except OSError as e:
+            # No multicast here (or the port is taken by something else); this worker only polls.
+            sock.close()
+            logger.warning("Print job notifications disabled (%s:%s): %s", *_group(), e)
+
+    @property
+    def enabled(self):
+        return self.sock is not None
+
+    def wait(self, timeout):
+        """
+        Blocks until at least one notification arrives or `timeout` passes.
+        Returns the set of notified printer ids (empty on timeout).
+        """
+        if self.sock is None:
+            time.sleep(timeout)
+            return set()
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return set()
+        return self._drain()
+
+    def _drain(self):
+        printer_ids = set()
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except OSError:
+                # BlockingIOError: nothing left to read
+                break
+            try:
+                printer_ids.add(int(data))
+            except ValueError:
+                continue
+        return printer_ids
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,80 @@
+"""
+PrintJob retention: finished jobs lose their print data after a few hours and the rows
+themselves are deleted (optionally archived to a gzipped JSON-lines file) after some days.
+Everything runs in small batches with a pause in between, so the waiters' requests never
+wait long for SQLite's write lock.
+"""
+import gzip
+import json
+import time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from .models import PrintJob
+
+# Finished jobs whose print data is no longer needed. 'failed' keeps it for a reprint.
+STRIPPABLE_STATUSES = ['printed', 'cancelled', 'expired']
+DELETABLE_STATUSES = ['printed', 'cancelled', 'expired', 'failed']
+ARCHIVE_FIELDS = [
+    'id', 'printer_id', 'status', 'kind', 'priority', 'order_id', 'order_item_id', 'payload_format',
+    'ticket', 'attempts', 'error_message', 'c_at', 'u_at',
+]
+
+
+def last_pk_before(cutoff):
+    """
+    Highest id of a job created before `cutoff`, or None. Ids grow with c_at, so the batches
+    below can walk the primary key instead of scanning an unindexed c_at.
+    """
+    return PrintJob.objects.filter(c_at__lt=cutoff).order_by('-pk').values_list('pk', flat=True).first()
+
+
+def _batches(queryset, max_pk, batch_size):
+    """Yields lists of ids of `queryset` up to `max_pk`, walking the primary key."""
+    last = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last, pk__lte=max_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def strip_payloads(cutoff, batch_size=500, pause=0.05):
+    """Clears `payload` and `data` of finished jobs created before `cutoff`. Returns how many."""
+    max_pk = last_pk_before(cutoff)
+    if max_pk is None:
+        return 0
+    with_data = PrintJob.objects.filter(status__in=STRIPPABLE_STATUSES).filter(~Q(payload='') | Q(data__isnull=False))
+    stripped = 0
+    for ids in _batches(with_data, max_pk, batch_size):
+        # `ticket` stays: it is small and enough to reprint the job
+        stripped += PrintJob.objects.filter(pk__in=ids).update(payload='', data=None)
+        time.sleep(pause)
+    return stripped
+
+
+def purge_jobs(cutoff, batch_size=500, pause=0.05, archive=None):
+    """
+    Deletes finished jobs created before `cutoff`. With `archive` (a file path) the rows are
+    first appended to it as gzipped JSON lines, without the print data. Returns how many.
+    """
+    max_pk = last_pk_before(cutoff)
+    if max_pk is None:
+        return 0
+    finished = PrintJob.objects.filter(status__in=DELETABLE_STATUSES)
+    deleted = 0
+    for ids in _batches(finished, max_pk, batch_size):
+        with transaction.atomic():
+            if archive:
+                rows = PrintJob.objects.filter(pk__in=ids).values(*ARCHIVE_FIELDS)
+                # Appending a new gzip member per batch keeps the file readable as one stream
+                with gzip.open(archive, 'at', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            count, _ = PrintJob.objects.filter(pk__in=ids).delete()
+        deleted += count
+        time.sleep(pause)
+    return deleted
@@ -0,0 +1,144 @@
+import time
+import socket
+import select
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PrinterConnection:
+    """
+    One persistent raw TCP (port 9100) socket to an ESC/POS printer.
+    The send buffer is kept small (the OS default can grow to megabytes), so send() returns
+    about when the printer has taken the ticket. A stalled printer then runs into send_timeout
+    instead of its tickets counting as printed while they sit in the kernel.
+    """
+
+    def __init__(self, host, port, connect_timeout=3, send_timeout=10, send_buffer=8192,
+                 backoff_base=1, backoff_max=30):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.send_buffer = send_buffer
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sock = None
+        self.failures = 0
+        self.retry_at = 0
+        self.last_used = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+    def _is_alive(self):
+        """A socket the printer has closed becomes readable and returns b'' on recv."""
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                # Printers may push status bytes on their own; anything but EOF is fine.
+                return self.sock.recv(1024, socket.MSG_PEEK) != b''
+            return True
+        except OSError:
+            return False
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self.retry_at:
+            raise ConnectionError(f"Printer {self} unreachable, retrying in {self.retry_at - now:.1f}s")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError as e:
+            self.failures += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (self.failures - 1)))
+            self.retry_at = time.monotonic() + delay
+            raise ConnectionError(f"Printer {self} unreachable: {e}") from e
+        sock.settimeout(self.send_timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if self.send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        self.sock = sock
+        self.failures = 0
+        self.retry_at = 0
+
+    def close(self):
+        if self.sock is not None:
+            try: self.sock.close()
+            except OSError: pass
+        self.sock = None
+
+    def check(self):
+        """Opens the connection if it is not open already. Raises ConnectionError if the printer is unreachable."""
+        with self.lock:
+            if not self._is_alive():
+                self.close()
+                self._connect()
+            self.last_used = time.monotonic()
+
+    def send(self, data):
+        """Sends raw bytes, reconnecting once if the kept-open socket turned out to be dead."""
+        with self.lock:
+            for attempt in (1, 2):
+                if not self._is_alive():
+                    self.close()
+                    self._connect()
+                try:
+                    self.sock.sendall(data)
+                    self.last_used = time.monotonic()
+                    return
+                except OSError as e:
+                    self.close()
+                    if attempt == 2:
+                        raise ConnectionError(f"Sending to printer {self} failed: {e}") from e
+                    logger.info("Connection to %s dropped, reconnecting", self)
+
+
+class PrinterConnectionPool:
+    """Keeps printer sockets open between jobs, keyed by (ip_address, port)."""
+
+    def __init__(self, idle_timeout=60, **connection_options):
+        self.idle_timeout = idle_timeout
+        self.connection_options = connection_options
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, port):
+        key = (host, int(port or 9100))
+        with self.lock:
+            conn = self.connections.get(key)
+            if conn is None:
+                conn = PrinterConnection(key[0], key[1], **self.connection_options)
+                self.connections[key] = conn
+            return conn
+
+    def send(self, host, port, data):
+        self.get(host, port).send(data)
+
+    def check(self, host, port):
+        self.get(host, port).check()
+
+    def close_idle(self):
+        """Closes sockets unused for idle_timeout so other clients can reach the printer."""
+        now = time.monotonic()
+        with self.lock:
+            connections = list(self.connections.values())
+        for conn in connections:
+            if conn.sock is not None and now - conn.last_used > self.idle_timeout:
+                if conn.lock.acquire(blocking=False):
+                    try: conn.close()
+                    finally: conn.lock.release()
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+        for conn in connections:
+            with conn.lock:
+                conn.close()
+
+
+# Shared by every printer thread of the worker process.
+pool = PrinterConnectionPool()
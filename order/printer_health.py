@@ -0,0 +1,58 @@
+import time
+import threading
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Health of one printer inside the worker.
+
+    closed: jobs are printed normally. After `failure_threshold` failures in a row it opens.
+    open: no jobs are claimed for the printer until the open period is over.
+    half_open: a single job is tried. Success closes the breaker, failure opens it again
+    for twice as long as last time (up to `max_open_seconds`).
+    """
+
+    def __init__(self, failure_threshold=3, open_seconds=5, max_open_seconds=300):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a job may be sent now. Moves an expired 'open' breaker to 'half_open'."""
+        with self.lock:
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+            return self.state != OPEN
+
+    def seconds_until_retry(self):
+        if self.state != OPEN:
+            return 0
+        return max(0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trips = 0
+
+    def record_failure(self):
+        """Counts a failure. Returns True if this failure opened the breaker."""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.trips += 1
+                delay = min(self.max_open_seconds, self.open_seconds * 2 ** (self.trips - 1))
+                self.state = OPEN
+                self.open_until = time.monotonic() + delay
+                self.failures = 0
+                return True
+            return False
@@ -0,0 +1,242 @@
+"""
+Fake raw-TCP (port 9100) ESC/POS printers for reproducing print problems without hardware.
+Used by the simulate_printers and benchmark_printing commands.
+"""
+import os
+import time
+import random
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+ESC = 0x1b
+GS = 0x1d
+DLE = 0x10
+# Real-time status replies to DLE EOT n (Epson): bit 1 and bit 4 are always set
+STATUS_OK = b'\x12'
+STATUS_PAPER_OUT = b'\x72'  # paper end sensor bits 5 and 6 set
+# ESC commands with one parameter byte: ESC t n, ESC a n, ESC E n, ESC d n, ESC ! n, ESC - n, ESC M n, ESC J n, ESC G n, ESC { n
+ESC_ONE_ARG = b'taEd!-MJG{'
+
+
+class Ticket:
+    """One printed ticket: everything received up to a cut command."""
+
+    def __init__(self):
+        self.size = 0
+        self.text = bytearray()
+        self.bands = []  # [(width_bytes, height, rows)] of 'GS v 0' raster images
+        self.received_at = None  # when its cut command arrived
+        self.printed_at = None  # when it came out of the printer, `latency` later
+
+    def decoded_text(self, encoding='cp866'):
+        return self.text.decode(encoding, errors='replace')
+
+    def image(self):
+        """The raster bands stacked into one black-on-white image, or None for text tickets."""
+        if not self.bands:
+            return None
+        width = max(band[0] for band in self.bands) * 8
+        height = sum(band[1] for band in self.bands)
+        img = Image.new('1', (width, height), 0)
+        top = 0
+        for width_bytes, band_height, rows in self.bands:
+            img.paste(Image.frombytes('1', (width_bytes * 8, band_height), bytes(rows)), (0, top))
+            top += band_height
+        # Set bits are black dots on paper
+        return ImageOps.invert(img.convert('L'))
+
+
+class EscPosDecoder:
+    """
+    Incremental parser for the ESC/POS subset our receipts use. feed() returns the tickets
+    completed by a cut; a command split over two reads waits for the rest.
+    """
+
+    def __init__(self, on_status_request=None):
+        self.buffer = bytearray()
+        self.ticket = Ticket()
+        self.on_status_request = on_status_request
+
+    def feed(self, data):
+        self.buffer += data
+        done = []
+        buf = self.buffer
+        i = start = 0
+        while i < len(buf):
+            byte = buf[i]
+            if byte == ESC:
+                if i + 1 >= len(buf):
+                    break
+                command = buf[i + 1]
+                if command in ESC_ONE_ARG:
+                    if i + 2 >= len(buf):
+                        break
+                    if command == ord('d'):
+                        self.ticket.text += b'\n' * buf[i + 2]
+                    i += 3
+                else:
+                    i += 2  # ESC @ and anything unknown
+            elif byte == GS:
+                if i + 2 >= len(buf):
+                    break
+                command = buf[i + 1]
+                if command == ord('v') and buf[i + 2] == ord('0'):
+                    if i + 8 > len(buf):
+                        break
+                    width_bytes = buf[i + 4] | buf[i + 5] << 8
+                    height = buf[i + 6] | buf[i + 7] << 8
+                    end = i + 8 + width_bytes * height
+                    if end > len(buf):
+                        break
+                    self.ticket.bands.append((width_bytes, height, buf[i + 8:end]))
+                    i = end
+                elif command == ord('V'):
+                    # GS V m, plus a feed byte for m = 65/66
+                    length = 4 if buf[i + 2] in (65, 66) else 3
+                    if i + length > len(buf):
+                        break
+                    i += length
+                    self.ticket.size += i - start
+                    start = i
+                    done.append(self._finish_ticket())
+                else:
+                    i += 3  # GS ! n and other one-parameter commands
+            elif byte == DLE:
+                if i + 2 >= len(buf):
+                    break
+                if buf[i + 1] == 0x04 and self.on_status_request:
+                    self.on_status_request(buf[i + 2])
+                i += 3
+            else:
+                self.ticket.text.append(byte)
+                i += 1
+        self.ticket.size += i - start
+        del buf[:i]
+        return done
+
+    def _finish_ticket(self):
+        ticket = self.ticket
+        ticket.received_at = time.monotonic()
+        self.ticket = Ticket()
+        return ticket
+
+
+class SimulatedPrinter:
+    """
+    A fake network printer. Faults:
+      latency       seconds spent "printing" each ticket before reading more
+      throughput    bytes per second accepted (0 = unlimited)
+      drop_rate     chance per read that the connection is reset
+      timeout_rate  chance per read that the printer stops reading for hang_seconds
+      paper_out     tickets are swallowed and DLE EOT status requests report paper end
+    buffer_size is the receive buffer in bytes, like a printer's small input buffer
+    (0 = OS default, which is far larger than any printer's). The printer reads no more than
+    that at a time and nothing while a ticket prints, so a slow printer pushes back on the
+    sender once the buffers are full, like the real ones.
+    """
+
+    def __init__(self, host='127.0.0.1', port=9100, name=None, latency=0, throughput=0, drop_rate=0,
+                 timeout_rate=0, hang_seconds=30, paper_out=False, buffer_size=0, output_dir=None, on_ticket=None,
+                 seed=None):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.latency = latency
+        self.throughput = throughput
+        self.drop_rate = drop_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.paper_out = paper_out
+        self.buffer_size = buffer_size
+        self.output_dir = output_dir
+        self.on_ticket = on_ticket
+        self.random = random.Random(seed)
+        self.tickets = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def __str__(self):
+        return self.name or f"{self.host}:{self.port}"
+
+    def start(self):
+        """Starts serving in a background thread. Returns the port (useful with port=0)."""
+        printer = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                printer.handle_connection(self.request)
+
+        server = socketserver.ThreadingTCPServer((self.host, self.port), Handler, bind_and_activate=False)
+        server.allow_reuse_address = True
+        server.daemon_threads = True
+        if self.buffer_size:
+            # Set before listen() so accepted sockets advertise the small window
+            server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buffer_size)
+        server.server_bind()
+        server.server_activate()
+        self.server = server
+        self.port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, name=f"simulator-{self.port}", daemon=True).start()
+        return self.port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def handle_connection(self, sock):
+        def reply_status(n):
+            sock.sendall(STATUS_PAPER_OUT if self.paper_out else STATUS_OK)
+
+        decoder = EscPosDecoder(on_status_request=reply_status)
+        read_size = self.buffer_size or 65536
+        while True:
+            try:
+                data = sock.recv(read_size)
+            except OSError:
+                return
+            if not data:
+                return
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                logger.info("%s: dropping connection", self)
+                # Linger 0 makes close() send a RST, like a printer that reboots
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                sock.close()
+                return
+            if self.timeout_rate and self.random.random() < self.timeout_rate:
+                logger.info("%s: hanging for %ss", self, self.hang_seconds)
+                time.sleep(self.hang_seconds)
+            if self.throughput:
+                time.sleep(len(data) / self.throughput)
+            for ticket in decoder.feed(data):
+                if self.latency:
+                    time.sleep(self.latency)
+                if not self.paper_out:
+                    self._printed(ticket)
+
+    def _printed(self, ticket):
+        ticket.printed_at = time.monotonic()
+        with self.lock:
+            self.tickets.append(ticket)
+            number = len(self.tickets)
+        if self.output_dir:
+            self.save(ticket, number)
+        if self.on_ticket:
+            self.on_ticket(self, ticket)
+
+    def save(self, ticket, number):
+        """Writes <port>-<n>.txt with the decoded text and <port>-<n>.png for raster tickets."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.port}-{number:04d}")
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(ticket.decoded_text())
+        img = ticket.image()
+        if img is not None:
+            img.save(base + '.png')
@@ -0,0 +1,576 @@
+import io
+import os
+import time
+import base64
+import socket
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from PIL import Image
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+from escpos.printer import Dummy
+from .models import Printer, PrintJob
+from .printer_connections import pool
+from .printer_health import CircuitBreaker, CLOSED, HALF_OPEN
+from .print_notify import PrintJobListener, notify_print_worker
+from .tickets import render_ticket
+
+logger = logging.getLogger(__name__)
+
+# Short, so a crashed worker's jobs are picked up again within seconds; a live worker keeps
+# extending the leases of its claimed jobs while it prints (LeaseHeartbeat).
+DEFAULT_LEASE_SECONDS = 5
+RETRY_BACKOFF_MAX = 300  # seconds
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Most urgent first, then oldest first
+QUEUE_ORDER = ('priority', 'c_at')
+
+
+def _claimable(now):
+    """
+    Pending jobs that are not held back, plus jobs whose worker let the lease expire (crashed or hung).
+    Jobs past their deadline are never claimed.
+    """
+    return (
+        (Q(status='pending') & (Q(not_before__isnull=True) | Q(not_before__lte=now)))
+        | Q(status='printing', lease_expires_at__lt=now)
+    ) & (Q(deadline__isnull=True) | Q(deadline__gt=now))
+
+
+def expire_jobs(printer_ids=None):
+    """Moves unprinted jobs past their deadline to 'expired'. Returns how many."""
+    now = timezone.now()
+    stale = PrintJob.objects.active().filter(
+        Q(status='pending') | Q(status='printing', lease_expires_at__lt=now), deadline__lte=now
+    )
+    if printer_ids is not None:
+        stale = stale.filter(printer_id__in=printer_ids)
+    return stale.update(
+        status='expired', worker_id=None, lease_expires_at=None, error_message='Deadline passed before printing', u_at=now
+    )
+
+
+def next_held_job_at(printer_ids=None):
+    """When the earliest held-back (coalescing) pending job becomes claimable, or None."""
+    held = PrintJob.objects.active().filter(status='pending', not_before__gt=timezone.now())
+    if printer_ids is not None:
+        held = held.filter(printer_id__in=printer_ids)
+    return held.order_by('not_before').values_list('not_before', flat=True).first()
+
+
+def claim_jobs(worker_id, printer_ids=None, limit=10, lease_seconds=DEFAULT_LEASE_SECONDS,
+               exclude_printer_ids=()):
+    """
+    Moves up to `limit` claimable jobs to 'printing' for this worker in one conditional UPDATE
+    and returns them by priority, then oldest first. Two workers can never claim the same job.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=lease_seconds)
+    candidates = PrintJob.objects.active().filter(_claimable(now))
+    if printer_ids is not None:
+        candidates = candidates.filter(printer_id__in=printer_ids)
+    if exclude_printer_ids:
+        candidates = candidates.exclude(printer_id__in=exclude_printer_ids)
+    candidate_ids = list(candidates.order_by(*QUEUE_ORDER).values_list('pk', flat=True)[:limit])
+    if not candidate_ids:
+        return []
+
+    claimed = PrintJob.objects.filter(_claimable(now), pk__in=candidate_ids).update(
+        status='printing', worker_id=worker_id, lease_expires_at=lease, u_at=now
+    )
+    if not claimed:
+        return []
+    # Only among the candidates: the printer threads of one worker share its id, and two of
+    # them can claim within the same clock tick
+    return list(
+        PrintJob.objects.filter(pk__in=candidate_ids, status='printing', worker_id=worker_id, lease_expires_at=lease)
+        .select_related('printer__backup_printer', 'printer__group').order_by(*QUEUE_ORDER)
+    )
+
+
+def renew_lease(job, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extends the lease right before printing. False if another worker has taken the job over."""
+    lease = timezone.now() + timedelta(seconds=lease_seconds)
+    renewed = PrintJob.objects.filter(pk=job.pk, status='printing', worker_id=worker_id).update(lease_expires_at=lease)
+    return renewed == 1
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Extends the leases of a worker's claimed, unfinished jobs every third of the lease until stopped."""
+
+    def __init__(self, jobs, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        super().__init__(name=f"lease-{worker_id}", daemon=True)
+        self.job_ids = [job.pk for job in jobs]
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stop_event = threading.Event()
+
+    def beat(self):
+        lease = timezone.now() + timedelta(seconds=self.lease_seconds)
+        return PrintJob.objects.filter(pk__in=self.job_ids, status='printing', worker_id=self.worker_id).update(
+            lease_expires_at=lease
+        )
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        try:
+            while not self.stop_event.wait(self.lease_seconds / 3):
+                try:
+                    self.beat()
+                except Exception:
+                    # Retried on the next beat; the lease is three beats long
+                    logger.warning("Could not extend the leases of jobs %s", self.job_ids, exc_info=True)
+        finally:
+            connection.close()
+
+
+def mark_printed(job, worker_id):
+    PrintJob.objects.filter(pk=job.pk, status='printing', worker_id=worker_id).update(
+        status='printed', lease_expires_at=None, u_at=timezone.now()
+    )
+
+
+def release_jobs(jobs, worker_id):
+    """Hands claimed but unprinted jobs back to the queue."""
+    PrintJob.objects.filter(pk__in=[job.pk for job in jobs], status='printing', worker_id=worker_id).update(
+        status='pending', worker_id=None, lease_expires_at=None, u_at=timezone.now()
+    )
+
+
+class PrintFailed(Exception):
+    """Raised by print_claimed_jobs with the job whose send failed."""
+
+    def __init__(self, job, error):
+        super().__init__(str(error))
+        self.job = job
+
+
+def retry_backoff(attempts, retry_delay=5):
+    """Seconds to hold a job back after its `attempts`-th failure: retry_delay, 2x, 4x ... capped."""
+    return min(RETRY_BACKOFF_MAX, retry_delay * 2 ** (attempts - 1))
+
+
+def backup_for(printer):
+    """
+    Where a dead printer's jobs go: its backup printer if that one is enabled and reachable,
+    else the least busy healthy printer of its group, else None.
+    """
+    backup = printer.backup_printer
+    if backup is not None and backup.pk != printer.pk and backup.is_enabled and backup.unreachable_since is None:
+        return backup
+    if printer.group_id:
+        backup = printer.group.least_busy_printer(exclude=printer.pk)
+        if backup is not None and backup.unreachable_since is None:
+            return backup
+    return None
+
+
+def mark_printer_down(printer_id):
+    """Recorded so group routing skips the printer while its breaker is open."""
+    Printer.objects.filter(pk=printer_id, unreachable_since__isnull=True).update(unreachable_since=timezone.now())
+
+
+def mark_printer_up(printer_id):
+    Printer.objects.filter(pk=printer_id, unreachable_since__isnull=False).update(unreachable_since=None)
+
+
+def reset_printer_health(printer_ids=None):
+    """Health marks of a previous worker run are stale; a new worker starts with closed breakers."""
+    printers = Printer.objects.all()
+    if printer_ids is not None:
+        printers = printers.filter(pk__in=printer_ids)
+    printers.update(unreachable_since=None)
+
+
+def record_failure(job, worker_id, error, retry_delay=5):
+    """
+    Counts a failed send of a claimed job. Below max_attempts the job goes back to 'pending',
+    held for an exponential backoff. After that it moves to the backup printer once, and
+    otherwise ends up 'failed' with the error kept in error_message. Returns the new status.
+    """
+    now = timezone.now()
+    attempts = job.attempts + 1
+    message = f"Attempt {attempts}/{job.max_attempts}: {error}"
+    fields = {'attempts': attempts, 'error_message': message, 'worker_id': None, 'lease_expires_at': None, 'u_at': now}
+    backup = backup_for(job.printer) if job.rerouted_from_id is None else None
+
+    if attempts < job.max_attempts:
+        fields.update(status='pending', not_before=now + timedelta(seconds=retry_backoff(attempts, retry_delay)))
+    elif backup is not None:
+        fields.update(status='pending', not_before=None, attempts=0, printer=backup, rerouted_from=job.printer)
+    else:
+        fields.update(status='failed')
+
+    updated = PrintJob.objects.filter(pk=job.pk, status='printing', worker_id=worker_id).update(**fields)
+    if updated and 'printer' in fields:
+        notify_print_worker(backup.pk)
+    return fields['status']
+
+
+def fail_over_pending_jobs(printer):
+    """Moves the pending jobs of a dead printer to its backup. Returns how many were moved."""
+    backup = backup_for(printer)
+    if backup is None:
+        return 0
+    moved = PrintJob.objects.active().filter(
+        printer=printer, status='pending', rerouted_from__isnull=True
+    ).update(
+        printer=backup, rerouted_from=printer, not_before=None, u_at=timezone.now()
+    )
+    if moved:
+        notify_print_worker(backup.pk)
+    return moved
+
+
+def job_to_escpos(job):
+    """Returns the raw ESC/POS byte stream for the printer."""
+    if job.payload_format == 'ticket':
+        # Rendered here, in the worker, instead of inside the waiter's request
+        return render_ticket(job)
+    if job.payload_format == 'escpos':
+        # Already rendered, goes straight to the socket
+        return bytes(job.data)
+
+    # Legacy jobs: decode Base64 Payload to Image
+    image_bytes = base64.b64decode(job.payload)
+    img = Image.open(io.BytesIO(image_bytes))
+
+    # Dummy only records the commands, nothing is opened here.
+    p = Dummy()
+    # Use bitImageRaster for better compatibility with thermal printers
+    p.image(img, impl="bitImageRaster")
+    p.cut()
+    return p.output
+
+
+def send_job_to_printer(job, data):
+    """Sends a rendered PrintJob to its printer over a pooled connection. Raises on any failure."""
+    printer = job.printer
+    pool.send(printer.ip_address, printer.port, data)
+
+
+def mark_unprintable(job, worker_id, error):
+    """
+    A job that can't be rendered (its order is gone, no print data left...) fails at once:
+    retrying won't help and the printer is not to blame, so its breaker isn't touched.
+    """
+    PrintJob.objects.filter(pk=job.pk, status='printing', worker_id=worker_id).update(
+        status='failed', worker_id=None, lease_expires_at=None,
+        error_message=f"Could not render: {error}", u_at=timezone.now()
+    )
+
+
+def print_claimed_jobs(jobs, worker_id, stdout, style, lease_seconds=DEFAULT_LEASE_SECONDS, retry_delay=5):
+    """
+    Prints claimed jobs in order. On the first failure that job's attempt is recorded,
+    the rest are released back to 'pending' and the exception is re-raised.
+    The jobs' leases are kept extended meanwhile, however long the printers take.
+    """
+    if not jobs:
+        return
+    heartbeat = LeaseHeartbeat(jobs, worker_id, lease_seconds)
+    heartbeat.start()
+    try:
+        _print_jobs(jobs, worker_id, stdout, style, lease_seconds, retry_delay)
+    finally:
+        heartbeat.stop()
+
+
+def _print_jobs(jobs, worker_id, stdout, style, lease_seconds, retry_delay):
+    for index, job in enumerate(jobs):
+        if not renew_lease(job, worker_id, lease_seconds):
+            continue
+        # Rendered outside the try below: only transport errors count against the printer
+        try:
+            data = job_to_escpos(job)
+        except Exception as e:
+            logger.exception("Could not render print job %s", job.pk)
+            mark_unprintable(job, worker_id, e)
+            stdout.write(style.ERROR(f"Job {job.id} could not be rendered: {e}"))
+            continue
+        try:
+            stdout.write(f"Printing Image Job {job.id} on {job.printer.name}...")
+            send_job_to_printer(job, data)
+        except Exception as e:
+            status = record_failure(job, worker_id, e, retry_delay)
+            if status == 'failed':
+                stdout.write(style.ERROR(f"Job {job.id} failed after {job.max_attempts} attempts"))
+            release_jobs(jobs[index + 1:], worker_id)
+            raise PrintFailed(job, e) from e
+        mark_printed(job, worker_id)
+        stdout.write(style.SUCCESS(f"Job {job.id} Success"))
+
+
+class PrinterQueue(threading.Thread):
+    """
+    Claims and drains the jobs of exactly one printer, in order.
+    A failing printer opens its circuit breaker and stops claiming for a while (its jobs move to
+    the backup printer if it has one) without touching other printers.
+    """
+
+    def __init__(self, printer_id, worker_id, stdout, style, retry_delay=5, poll_interval=10,
+                 batch_size=10, lease_seconds=DEFAULT_LEASE_SECONDS):
+        super().__init__(name=f"printer-{printer_id}", daemon=True)
+        self.printer_id = printer_id
+        self.worker_id = worker_id
+        self.stdout = stdout
+        self.style = style
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.breaker = CircuitBreaker(open_seconds=retry_delay)
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    def wake(self):
+        self.wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def run(self):
+        timeout = self.poll_interval
+        try:
+            while not self.stop_event.is_set():
+                self.wake_event.wait(timeout)
+                self.wake_event.clear()
+                self._drain()
+                timeout = self._next_timeout()
+        finally:
+            connection.close()
+
+    def _next_timeout(self):
+        """Sleeps until a held-back ticket is due, but never longer than the poll interval."""
+        timeout = self.poll_interval
+        if not self.breaker.allow():
+            return min(timeout, self.breaker.seconds_until_retry())
+        held_until = next_held_job_at([self.printer_id])
+        if held_until is None:
+            return timeout
+        return max(0, min(timeout, (held_until - timezone.now()).total_seconds()))
+
+    def _record_success(self):
+        recovered = self.breaker.state == HALF_OPEN
+        self.breaker.record_success()
+        if recovered:
+            mark_printer_up(self.printer_id)
+            self.stdout.write(self.style.SUCCESS(f"Printer {self.printer_id} is back"))
+
+    def _probe(self):
+        """A half-open printer with nothing to print is checked with a bare connect."""
+        printer = Printer.objects.get(pk=self.printer_id)
+        try:
+            pool.check(printer.ip_address, printer.port)
+        except Exception:
+            self.breaker.record_failure()
+        else:
+            self._record_success()
+
+    def _fail_over(self, printer):
+        moved = fail_over_pending_jobs(printer)
+        if moved:
+            self.stdout.write(self.style.WARNING(f"Moved {moved} jobs from {printer.name} to its backup printer"))
+
+    def _drain(self):
+        while not self.stop_event.is_set():
+            close_old_connections()
+            if not self.breaker.allow():
+                # Still down: jobs that arrived meanwhile go straight to the backup printer
+                printer = Printer.objects.select_related('backup_printer', 'group').get(pk=self.printer_id)
+                self._fail_over(printer)
+                return
+            # A half-open breaker only risks one job on the printer
+            half_open = self.breaker.state == HALF_OPEN
+            jobs = claim_jobs(self.worker_id, [self.printer_id], 1 if half_open else self.batch_size, self.lease_seconds)
+            if not jobs:
+                if half_open:
+                    self._probe()
+                return
+            try:
+                print_claimed_jobs(jobs, self.worker_id, self.stdout, self.style, self.lease_seconds, self.retry_delay)
+            except PrintFailed as e:
+                # Only this printer backs off; the others keep draining their own queues.
+                printer = e.job.printer
+                self.stdout.write(self.style.ERROR(f"Print Error on {printer.name}: {e}"))
+                if self.breaker.record_failure():
+                    self.stdout.write(self.style.WARNING(
+                        f"{printer.name} is down, pausing it for {self.breaker.seconds_until_retry():.0f}s"
+                    ))
+                    mark_printer_down(printer.pk)
+                    self._fail_over(printer)
+            except Exception as e:
+                # Not the printer's fault (e.g. the database is locked): its breaker is left alone
+                logger.exception("Printing on printer %s failed", self.printer_id)
+                self.stdout.write(self.style.ERROR(f"Print Error: {e}"))
+                release_jobs(jobs, self.worker_id)
+                self.stop_event.wait(self.retry_delay)
+                return
+            else:
+                self._record_success()
+
+
+class ConcurrentPrintWorker:
+    """Watches for claimable jobs and wakes one PrinterQueue thread per printer."""
+
+    def __init__(self, stdout, style, worker_id=None, printer_ids=None, poll_interval=10, retry_delay=5,
+                 batch_size=10, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.stdout = stdout
+        self.style = style
+        self.worker_id = worker_id or default_worker_id()
+        self.printer_ids = printer_ids
+        self.poll_interval = poll_interval
+        self.queue_options = {
+            'retry_delay': retry_delay,
+            'poll_interval': poll_interval,
+            'batch_size': batch_size,
+            'lease_seconds': lease_seconds,
+        }
+        self.queues = {}  # {printer_id: PrinterQueue}
+        self.stop_event = threading.Event()
+
+    def _queue_for(self, printer_id):
+        printer_queue = self.queues.get(printer_id)
+        if printer_queue is None or not printer_queue.is_alive():
+            printer_queue = PrinterQueue(printer_id, self.worker_id, self.stdout, self.style, **self.queue_options)
+            printer_queue.start()
+            self.queues[printer_id] = printer_queue
+        return printer_queue
+
+    def dispatch_pending(self):
+        """Wakes the queue of every printer that has claimable jobs. Returns the printer ids woken."""
+        waiting = PrintJob.objects.active().filter(_claimable(timezone.now()))
+        if self.printer_ids is not None:
+            waiting = waiting.filter(printer_id__in=self.printer_ids)
+        printer_ids = set(waiting.values_list('printer_id', flat=True).distinct())
+        for printer_id in printer_ids:
+            self._queue_for(printer_id).wake()
+        return printer_ids
+
+    def stop(self):
+        """Stops the printer threads; run() returns after its current wait."""
+        self.stop_event.set()
+        for printer_queue in list(self.queues.values()):
+            printer_queue.stop()
+
+    def wake(self, printer_ids):
+        for printer_id in printer_ids:
+            if self.printer_ids is None or printer_id in self.printer_ids:
+                self._queue_for(printer_id).wake()
+
+    def run(self):
+        self.stdout.write(f"Worker id: {self.worker_id}")
+        reset_printer_health(self.printer_ids)
+        listener = PrintJobListener()
+        if not listener.enabled:
+            self.stdout.write(self.style.WARNING(f"No job notifications, polling every {self.poll_interval}s"))
+        last_scan = 0
+        try:
+            while not self.stop_event.is_set():
+                # Notified printers are woken right away; the full scan is only the slow fallback
+                # (missed datagrams, expired leases, jobs created by another host).
+                printer_ids = listener.wait(self.poll_interval)
+                close_old_connections()
+                self.wake(printer_ids)
+                if time.monotonic() - last_scan >= self.poll_interval:
+                    expired = expire_jobs(self.printer_ids)
+                    if expired:
+                        self.stdout.write(self.style.WARNING(f"{expired} jobs expired before printing"))
+                    self.dispatch_pending()
+                    last_scan = time.monotonic()
+                pool.close_idle()
+        finally:
+            listener.close()
+            self.stop()
+            pool.close_all()
+
+
+class SerialPrintWorker:
+    """
+    The single-loop worker: claims batches across all its printers and prints them one by one.
+    Printers whose breaker is open are skipped so they don't hold up the cashier and the other stations.
+    """
+
+    def __init__(self, stdout, style, worker_id=None, printer_ids=None, poll_interval=10, retry_delay=5,
+                 batch_size=10, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.stdout = stdout
+        self.style = style
+        self.worker_id = worker_id or default_worker_id()
+        self.printer_ids = printer_ids
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.breakers = defaultdict(lambda: CircuitBreaker(open_seconds=retry_delay))
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        self.stdout.write(f"Worker id: {self.worker_id}")
+        reset_printer_health(self.printer_ids)
+        listener = PrintJobListener()
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                if self._run_once() < self.batch_size:
+                    listener.wait(self._next_timeout())
+        finally:
+            listener.close()
+            connection.close()
+            pool.close_all()
+
+    def _next_timeout(self):
+        timeout = self.poll_interval
+        held_until = next_held_job_at(self.printer_ids)
+        if held_until is not None:
+            timeout = max(0, min(timeout, (held_until - timezone.now()).total_seconds()))
+        for breaker in self.breakers.values():
+            if not breaker.allow():
+                timeout = min(timeout, breaker.seconds_until_retry())
+        return timeout
+
+    def _run_once(self):
+        """Claims and prints one batch. Returns the number of jobs claimed, or batch_size after a failure."""
+        expired = expire_jobs(self.printer_ids)
+        if expired:
+            self.stdout.write(self.style.WARNING(f"{expired} jobs expired before printing"))
+        paused = [printer_id for printer_id, breaker in self.breakers.items() if not breaker.allow()]
+        jobs = claim_jobs(
+            self.worker_id, self.printer_ids, self.batch_size, self.lease_seconds, exclude_printer_ids=paused
+        )
+        try:
+            print_claimed_jobs(jobs, self.worker_id, self.stdout, self.style, self.lease_seconds, self.retry_delay)
+        except PrintFailed as e:
+            printer = e.job.printer
+            self.stdout.write(self.style.ERROR(f"Print Error on {printer.name}: {e}"))
+            if self.breakers[printer.pk].record_failure():
+                self.stdout.write(self.style.WARNING(f"{printer.name} is down, pausing it"))
+                mark_printer_down(printer.pk)
+                fail_over_pending_jobs(printer)
+            return self.batch_size
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Print Error: {e}"))
+            release_jobs(jobs, self.worker_id)
+            self.stop_event.wait(self.retry_delay)
+            return self.batch_size
+        finally:
+            pool.close_idle()
+
+        for printer_id in {job.printer_id for job in jobs}:
+            if self.breakers[printer_id].state != CLOSED:
+                mark_printer_up(printer_id)
+            self.breakers[printer_id].record_success()
+        return len(jobs)
@@ -0,0 +1,115 @@
+"""
+In-process cache of what the order write path needs to know about a menu item: name, price,
+where its tickets print and its recipe. Menus change maybe once a week while items are saved
+thousands of times a night, so this is read from memory instead of a few queries per line.
+
+Saving or deleting a menu item, ingredient, printer or printer group bumps a version number in
+the shared Django cache (the database cache, so every process sees it). Each process checks
+that number at most every RECIPE_CACHE_CHECK_SECONDS and drops its copy when it changed;
+the process that made the change drops its copy right away.
+"""
+import time
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'order:recipes:version'
+
+# ingredients is ((inventory_id, quantity per portion), ...)
+Recipe = namedtuple('Recipe', 'name price printer printer_group ingredients')
+
+_lock = threading.Lock()
+_recipes = {}
+_version = None
+_checked_at = 0.0
+
+
+def shared_version():
+    try:
+        return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+    except DatabaseError:
+        # No cache table (createcachetable not run): only this process' own changes invalidate
+        logger.warning("Recipe cache version unavailable, run createcachetable", exc_info=True)
+        return 0
+
+
+def _check_version():
+    global _version, _checked_at
+    now = time.monotonic()
+    if _version is not None and now - _checked_at < settings.RECIPE_CACHE_CHECK_SECONDS:
+        return
+    version = shared_version()
+    with _lock:
+        if version != _version:
+            _recipes.clear()
+            _version = version
+        _checked_at = now
+
+
+def _load(menu_item_ids):
+    from inventory.models import MenuItemIngredient
+    from .models import MenuItem
+
+    ingredients = defaultdict(list)
+    rows = MenuItemIngredient.objects.filter(menu_item_id__in=menu_item_ids).order_by('inventory_id')
+    for menu_item_id, inventory_id, quantity in rows.values_list('menu_item_id', 'inventory_id', 'quantity'):
+        ingredients[menu_item_id].append((inventory_id, quantity))
+    return {
+        item.pk: Recipe(item.name, item.price, item.printer, item.printer_group, tuple(ingredients[item.pk]))
+        for item in MenuItem.objects.filter(pk__in=menu_item_ids).select_related('printer', 'printer_group')
+    }
+
+
+def recipes_for(menu_item_ids):
+    """{menu_item_id: Recipe} for the given ids; missing ones are loaded with two queries in total."""
+    _check_version()
+    found, missing = {}, set()
+    for pk in menu_item_ids:
+        recipe = _recipes.get(pk)
+        if recipe is None:
+            missing.add(pk)
+        else:
+            found[pk] = recipe
+    if missing:
+        version = _version
+        loaded = _load(missing)
+        found.update(loaded)
+        with _lock:
+            # Don't keep what was read while another change invalidated the cache
+            if version == _version:
+                _recipes.update(loaded)
+    return found
+
+
+def recipe_for(menu_item_id):
+    """The menu item's Recipe, or None if it doesn't exist."""
+    return recipes_for([menu_item_id]).get(menu_item_id)
+
+
+def _bump_shared_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key expired or never set: any new value differs from what the processes have seen
+        cache.set(VERSION_KEY, int(time.time()), timeout=None)
+    except DatabaseError:
+        logger.warning("Could not bump recipe cache version", exc_info=True)
+    clear_local()
+
+
+def clear_local():
+    global _version
+    with _lock:
+        _recipes.clear()
+        _version = None
+
+
+def invalidate_recipes():
+    """Drops this process' copy now and every process' copy once the transaction commits."""
+    clear_local()
+    transaction.on_commit(_bump_shared_version)
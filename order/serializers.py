@@ -1,8 +1,10 @@
 # order/serializers.py
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
 from rest_framework import serializers
 # Import all relevant models from this app
-from .models import Order, OrderItem, MenuItem, Reservations, InventoryUsage, Printer
+from .models import Order, OrderItem, MenuItem, Reservations, InventoryUsage, Printer, PrintJob
+from .bulk import create_order_items
 # Import serializers from other apps
 from inventory.serializers import (
     TableSerializer,
@@ -22,6 +24,19 @@ class PrinterSerializer(serializers.ModelSerializer):
         model = Printer
         fields = ['id', 'name', 'ip_address', 'port']
 
+class PrintJobSerializer(serializers.ModelSerializer):
+    printer_name = serializers.CharField(source='printer.name', read_only=True)
+    table = serializers.PrimaryKeyRelatedField(source='order.table', read_only=True)
+
+    class Meta:
+        model = PrintJob
+        # The raw ESC/POS bytes (`data`) and legacy image `payload` are left out on purpose
+        fields = [
+            'id', 'printer', 'printer_name', 'status', 'priority', 'deadline', 'kind', 'order', 'order_item', 'table',
+            'payload_format', 'ticket', 'attempts', 'max_attempts', 'rerouted_from', 'error_message', 'c_at', 'u_at'
+        ]
+        read_only_fields = fields
+
 # --- MenuItem Serializer ---
 class MenuItemSerializer(serializers.ModelSerializer):
     # Nest the ingredients using the serializer we defined in inventory.serializers
@@ -39,6 +54,7 @@ class MenuItemSerializer(serializers.ModelSerializer):
             'category',
             'printer',
             'printer_details',
+            'printer_group',
             'is_available',
             'is_frequent',
             'ingredients',
@@ -49,13 +65,25 @@ class MenuItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['is_available', 'c_at', 'u_at']
 
 
+class OrderItemListSerializer(serializers.ListSerializer):
+    """POST /orderitems/ with a list: all items are written in one go, see order/bulk.py."""
+
+    def create(self, validated_data):
+        try:
+            return create_order_items(validated_data)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     item_name = serializers.CharField(source='menu_item.name', read_only=True)
-    item_price = serializers.DecimalField(source='menu_item.price', read_only=True, max_digits=10, decimal_places=2)
+    item_price = serializers.DecimalField(source='unit_price', read_only=True, max_digits=10, decimal_places=2)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'order', 'menu_item', 'item_name', 'item_price', 'quantity', 'c_at', 'u_at']
+        fields = ['id', 'order', 'menu_item', 'item_name', 'item_price', 'quantity', 'line_total', 'c_at', 'u_at']
+        read_only_fields = ['line_total']
+        list_serializer_class = OrderItemListSerializer
         # The inventory validation and reduction logic has been moved to a post_save signal
         # on the OrderItem model (order/models.py). This ensures the logic is applied
         # consistently for both creates and updates, from any source (API, admin, etc.).
@@ -83,9 +111,20 @@ class OrderSerializer(serializers.ModelSerializer):
             'items',          # Read-only nested items
             'subamount',      # Read-only calculated subtotal
             'amount',         # Read-only calculated total with commission
+            'commission_rate',  # Read-only, table commission (%) when the order was opened
         ]
         # Fields managed by backend or derived
-        read_only_fields = ['user', 'c_at', 'u_at', 'subamount', 'amount']
+        read_only_fields = ['user', 'c_at', 'u_at', 'subamount', 'amount', 'commission_rate']
+
+    def update(self, instance, validated_data):
+        # Moving the order to another table takes that table's commission
+        new_table = validated_data.get('table', instance.table)
+        if new_table != instance.table:
+            instance.commission_rate = new_table.commission if new_table else 0
+            instance = super().update(instance, validated_data)
+            instance.calculate_order_total()
+            return instance
+        return super().update(instance, validated_data)
 
 
 # --- Reservations Serializer ---
@@ -1,14 +1,42 @@
+import io
+import time
+import socket
 import decimal
-from django.test import TestCase
+from unittest import mock
+from datetime import timedelta
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.color import no_style
 from django.core.exceptions import ValidationError
+from rest_framework.test import APIClient
 
-from inventory.models import Table, Inventory, MenuItemIngredient
-from order.models import Order, MenuItem, OrderItem
+from inventory.models import Table, Inventory, InventoryUsage, MenuItemIngredient
+from log.models import AuditLog
+from order.models import Order, MenuItem, OrderItem, Printer, PrinterGroup, PrintJob
+from order import unit_of_work
+from order.printer_health import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from order.printer_connections import PrinterConnectionPool
+from order.printing import (
+    DEFAULT_LEASE_SECONDS, LeaseHeartbeat, PrinterQueue, backup_for, claim_jobs, expire_jobs, print_claimed_jobs,
+    record_failure, release_jobs,
+)
+from order.print_notify import PrintJobListener, notify_print_worker
+from order.print_retention import purge_jobs, strip_payloads
+from order.printer_simulator import EscPosDecoder, SimulatedPrinter
+from order.tickets import render_ticket
+from order.utils import PRINTER_WIDTH, _load_fonts, image_to_escpos, orderitem_receipt
 
 User = get_user_model()
+# Every class writes audit rows inline (AUDIT_ASYNC=False): the writer thread would use its own
+# connection, outside the test transaction.
 
 
+@override_settings(AUDIT_ASYNC=False)
 class OrderItemInventoryTestCase(TestCase):
     def setUp(self):
         # Create a user
@@ -98,3 +126,712 @@ class OrderItemInventoryTestCase(TestCase):
         self.inventory_patty.refresh_from_db()
         self.assertEqual(self.inventory_bun.quantity, initial_bun_quantity)
         self.assertEqual(self.inventory_patty.quantity, initial_patty_quantity)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PrintJobClaimTestCase(TestCase):
+    def setUp(self):
+        self.printer = Printer.objects.create(name='Kitchen', ip_address='127.0.0.1')
+        self.jobs = [PrintJob.objects.create(printer=self.printer, payload='') for _ in range(3)]
+
+    def test_workers_never_claim_the_same_job(self):
+        first = claim_jobs('worker-a', limit=2)
+        second = claim_jobs('worker-b', limit=2)
+
+        self.assertEqual([job.pk for job in first], [self.jobs[0].pk, self.jobs[1].pk])
+        self.assertEqual([job.pk for job in second], [self.jobs[2].pk])
+        self.assertEqual(claim_jobs('worker-c'), [])
+
+    def test_printer_threads_of_one_worker_get_only_their_own_jobs(self):
+        bar = Printer.objects.create(name='Bar', ip_address='127.0.0.2')
+        bar_job = PrintJob.objects.create(printer=bar, payload='')
+        # Both claims in the same clock tick, with the worker id the printer threads share
+        with mock.patch('order.printing.timezone.now', return_value=timezone.now()):
+            kitchen = claim_jobs('worker-a', [self.printer.pk])
+            bar_claim = claim_jobs('worker-a', [bar.pk])
+
+        self.assertEqual(len(kitchen), 3)
+        self.assertEqual([job.pk for job in bar_claim], [bar_job.pk])
+
+    def test_expired_lease_is_reclaimed(self):
+        claim_jobs('crashed-worker', limit=3)
+        PrintJob.objects.filter(pk=self.jobs[0].pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = claim_jobs('worker-b')
+
+        self.assertEqual([job.pk for job in reclaimed], [self.jobs[0].pk])
+        self.assertEqual(reclaimed[0].worker_id, 'worker-b')
+
+    def test_crashed_worker_jobs_come_back_within_seconds_unless_kept_alive(self):
+        crashed = claim_jobs('crashed-worker', limit=1)
+        live = claim_jobs('live-worker', limit=1)
+        soon = timezone.now() + timedelta(seconds=DEFAULT_LEASE_SECONDS - 1)
+        with mock.patch('order.printing.timezone.now', return_value=soon):
+            LeaseHeartbeat(live, 'live-worker').beat()
+
+        with mock.patch('order.printing.timezone.now', return_value=soon + timedelta(seconds=2)):
+            reclaimed = claim_jobs('worker-b')
+
+        reclaimed = {job.pk for job in reclaimed}
+        self.assertIn(crashed[0].pk, reclaimed)
+        self.assertNotIn(live[0].pk, reclaimed)
+
+    def test_released_jobs_go_back_to_pending(self):
+        claimed = claim_jobs('worker-a')
+        release_jobs(claimed[1:], 'worker-a')
+
+        statuses = dict(PrintJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.jobs[0].pk], 'printing')
+        self.assertEqual(statuses[self.jobs[1].pk], 'pending')
+        self.assertEqual(statuses[self.jobs[2].pk], 'pending')
+
+    def test_urgent_jobs_are_claimed_first_and_stale_ones_expire(self):
+        cancel = PrintJob.objects.create(printer=self.printer, priority=PrintJob.PRIORITY_CANCEL)
+        cashier = PrintJob.objects.create(printer=self.printer, priority=PrintJob.PRIORITY_CASHIER)
+        PrintJob.objects.filter(pk=self.jobs[2].pk).update(deadline=timezone.now() - timedelta(seconds=1))
+
+        claimed = claim_jobs('worker-a')
+
+        self.assertEqual([job.pk for job in claimed], [cancel.pk, cashier.pk, self.jobs[0].pk, self.jobs[1].pk])
+        self.assertEqual(expire_jobs(), 1)
+        self.assertEqual(PrintJob.objects.get(pk=self.jobs[2].pk).status, 'expired')
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class PrintNotifyTestCase(TestCase):
+    def test_every_listening_worker_is_woken(self):
+        with override_settings(PRINT_WORKER_NOTIFY_PORT=free_port()):
+            # e.g. two `run_printer --printer N` workers
+            listeners = [PrintJobListener(), PrintJobListener()]
+            self.addCleanup(lambda: [listener.close() for listener in listeners])
+            self.assertTrue(all(listener.enabled for listener in listeners))
+
+            notify_print_worker(7)
+            for listener in listeners:
+                started = time.monotonic()
+                self.assertEqual(listener.wait(2), {7})
+                self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_wait_times_out_without_notifications(self):
+        with override_settings(PRINT_WORKER_NOTIFY_PORT=free_port()):
+            listener = PrintJobListener()
+            self.addCleanup(listener.close)
+            self.assertEqual(listener.wait(0.05), set())
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PrintJobRetentionTestCase(TestCase):
+    def setUp(self):
+        printer = Printer.objects.create(name='Kitchen', ip_address='127.0.0.1')
+        self.old = PrintJob.objects.create(printer=printer, data=b'x' * 100, status='printed', ticket={'kind': 'new'})
+        self.failed = PrintJob.objects.create(printer=printer, data=b'x', status='failed')
+        self.queued = PrintJob.objects.create(printer=printer, data=b'x')
+        PrintJob.objects.update(c_at=timezone.now() - timedelta(days=40))
+        self.recent = PrintJob.objects.create(printer=printer, data=b'x', status='printed')
+
+    def test_stripped_job_is_reprinted_from_its_ticket_or_refused(self):
+        stripped = PrintJob.objects.create(printer=self.old.printer, data=b'x', status='printed')
+        PrintJob.objects.update(c_at=timezone.now() - timedelta(days=2))
+        strip_payloads(timezone.now() - timedelta(hours=24), pause=0)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(phone_number='+998900000010', name='Kassir', role='admin'))
+
+        response = client.post(f'/api/v1/printjobs/{self.old.pk}/reprint/')
+        self.assertEqual(response.status_code, 201)
+        copy = PrintJob.objects.get(pk=response.data['id'])
+        self.assertEqual((copy.payload_format, copy.ticket), ('ticket', {'kind': 'new'}))
+
+        response = client.post(f'/api/v1/printjobs/{stripped.pk}/reprint/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_old_finished_jobs_lose_their_data_then_their_rows(self):
+        self.assertEqual(strip_payloads(timezone.now() - timedelta(hours=24), batch_size=1, pause=0), 1)
+        self.old.refresh_from_db()
+        self.assertIsNone(self.old.data)
+        self.assertEqual(self.old.ticket, {'kind': 'new'})
+
+        self.assertEqual(purge_jobs(timezone.now() - timedelta(days=30), batch_size=1, pause=0), 2)
+        self.assertEqual(set(PrintJob.objects.values_list('pk', flat=True)), {self.queued.pk, self.recent.pk})
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PrintJobFailureTestCase(TestCase):
+    def setUp(self):
+        self.printer = Printer.objects.create(name='Grill', ip_address='127.0.0.2')
+
+    def _claim_and_fail(self, worker='worker-a'):
+        PrintJob.objects.update(not_before=None)  # skip the backoff
+        job = claim_jobs(worker, limit=1)[0]
+        return record_failure(job, worker, ConnectionError('unreachable'))
+
+    def test_job_is_retried_with_backoff_then_dead_lettered(self):
+        job = PrintJob.objects.create(printer=self.printer, data=b'x', max_attempts=2)
+
+        self.assertEqual(self._claim_and_fail(), 'pending')
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.worker_id)
+
+        self.assertEqual(self._claim_and_fail(), 'failed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('unreachable', job.error_message)
+        self.assertEqual(claim_jobs('worker-a'), [])
+
+    def test_failed_job_moves_to_backup_printer_once(self):
+        backup = Printer.objects.create(name='Grill 2', ip_address='127.0.0.3')
+        self.printer.backup_printer = backup
+        self.printer.save()
+        job = PrintJob.objects.create(printer=self.printer, data=b'x', max_attempts=1)
+
+        self.assertEqual(self._claim_and_fail(), 'pending')
+        job.refresh_from_db()
+        self.assertEqual((job.printer_id, job.rerouted_from_id, job.attempts), (backup.pk, self.printer.pk, 0))
+
+        self.assertEqual(self._claim_and_fail(), 'failed')
+
+    def test_job_that_cannot_be_rendered_fails_without_blaming_the_printer(self):
+        job = PrintJob.objects.create(
+            printer=self.printer, payload_format='ticket', ticket={'kind': 'cashier', 'order_id': 999999}
+        )
+        jobs = claim_jobs('worker-a')
+        print_claimed_jobs(jobs, 'worker-a', io.StringIO(), no_style())  # no PrintFailed
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 0))
+        self.assertIn('Could not render', job.error_message)
+
+    def test_circuit_breaker_opens_and_half_opens(self):
+        breaker = CircuitBreaker(failure_threshold=2, open_seconds=0)
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(breaker.allow())  # open period of 0s is over
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PrinterQueueIsolationTestCase(TestCase):
+    def setUp(self):
+        self.simulator = SimulatedPrinter(port=0)
+        self.addCleanup(self.simulator.stop)
+        pool = PrinterConnectionPool(connect_timeout=1)
+        self.addCleanup(pool.close_all)
+        patcher = mock.patch('order.printing.pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.bar = Printer.objects.create(name='Bar', ip_address='127.0.0.1', port=self.simulator.start())
+        # Nothing listens there: every connect is refused
+        self.grill = Printer.objects.create(name='Grill', ip_address='127.0.0.1', port=free_port(socket.SOCK_STREAM))
+        ticket = image_to_escpos(Image.new('1', (PRINTER_WIDTH, 8), 1))
+        for printer in (self.grill, self.bar):
+            for _ in range(3):
+                PrintJob.objects.create(printer=printer, data=ticket)
+
+    def _queue(self, printer):
+        return PrinterQueue(printer.pk, 'worker-a', io.StringIO(), no_style(), retry_delay=60)
+
+    def test_dead_printer_does_not_hold_up_the_others(self):
+        grill_queue, bar_queue = self._queue(self.grill), self._queue(self.bar)
+        # The steps the two threads take, interleaved
+        for _ in range(3):
+            grill_queue._drain()
+            bar_queue._drain()
+
+        self.assertEqual(grill_queue.breaker.state, OPEN)
+        self.assertEqual(bar_queue.breaker.state, CLOSED)
+        self.assertTrue(wait_for(lambda: len(self.simulator.tickets) == 3))
+        self.assertEqual(PrintJob.objects.filter(printer=self.bar, status='printed').count(), 3)
+        # The grill's jobs wait for it, each charged a single attempt
+        self.assertEqual(
+            list(PrintJob.objects.filter(printer=self.grill).values_list('status', 'attempts')), [('pending', 1)] * 3
+        )
+
+        # While its breaker is open the grill queue doesn't even try
+        with mock.patch('order.printing.claim_jobs') as claim:
+            grill_queue._drain()
+        claim.assert_not_called()
+
+
+    def test_database_errors_release_the_jobs_without_blaming_the_printer(self):
+        bar_queue = self._queue(self.bar)
+        bar_queue.retry_delay = 0
+        locked = mock.patch('order.printing.mark_printed', side_effect=OperationalError('database is locked'))
+        with locked, self.assertLogs('order.printing', 'ERROR'):
+            for _ in range(3):
+                bar_queue._drain()
+
+        self.assertEqual(bar_queue.breaker.state, CLOSED)
+        self.bar.refresh_from_db()
+        self.assertIsNone(self.bar.unreachable_since)
+        self.assertEqual(PrintJob.objects.filter(printer=self.bar, status='pending', worker_id=None).count(), 3)
+
+class PrinterConnectionPoolTestCase(TestCase):
+    def test_pool_reconnects_after_the_printer_drops_the_socket(self):
+        simulator = SimulatedPrinter(port=0, drop_rate=1)
+        port = simulator.start()
+        self.addCleanup(simulator.stop)
+        pool = PrinterConnectionPool()
+        self.addCleanup(pool.close_all)
+        ticket = image_to_escpos(Image.new('1', (PRINTER_WIDTH, 8), 1))
+
+        # The printer resets the connection on the first read, like one that rebooted
+        pool.send('127.0.0.1', port, ticket)
+        conn = pool.get('127.0.0.1', port)
+        dropped = conn.sock
+        self.assertTrue(wait_for(lambda: not conn._is_alive()))
+        self.assertEqual(simulator.tickets, [])
+
+        simulator.drop_rate = 0
+        pool.send('127.0.0.1', port, ticket)
+
+        self.assertIsNot(conn.sock, dropped)
+        self.assertTrue(wait_for(lambda: len(simulator.tickets) == 1))
+        self.assertIs(pool.get('127.0.0.1', port), conn)
+
+    def test_slow_printer_holds_up_the_sender(self):
+        simulator = SimulatedPrinter(port=0, latency=0.2, buffer_size=4096)
+        port = simulator.start()
+        self.addCleanup(simulator.stop)
+        pool = PrinterConnectionPool()
+        self.addCleanup(pool.close_all)
+        ticket = image_to_escpos(Image.new('1', (PRINTER_WIDTH, 400), 1))  # ~25 KB
+
+        started = time.monotonic()
+        for _ in range(3):
+            pool.send('127.0.0.1', port, ticket)
+        # Only about one ticket fits in the buffers: each send waits for the one before to print
+        self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class ReceiptRasterTestCase(TestCase):
+    def test_image_is_packed_as_escpos_raster(self):
+        img = Image.new('1', (PRINTER_WIDTH, 300), 1)
+        img.putpixel((0, 0), 0)  # one black dot, top left
+
+        data = image_to_escpos(img)
+
+        self.assertTrue(data.startswith(b'\x1b@\x1dv0\x00'))
+        # 64 bytes per row, first band of 256 rows, then a 44-row band
+        self.assertEqual(data[6:10], (64).to_bytes(2, 'little') + (256).to_bytes(2, 'little'))
+        self.assertEqual(data[10], 0x80)
+        self.assertEqual(sum(data[11:10 + 64 * 256]), 0)
+        self.assertIn(b'\x1dv0\x00' + (64).to_bytes(2, 'little') + (44).to_bytes(2, 'little'), data)
+        self.assertTrue(data.endswith(b'\x1dV\x00'))
+
+        # The simulated printer gets the same picture back
+        decoded = EscPosDecoder().feed(data)[0].image()
+        self.assertEqual(decoded.size, (PRINTER_WIDTH, 300))
+        self.assertEqual(decoded.getpixel((0, 0)), 0)
+        self.assertEqual(decoded.getpixel((1, 0)), 255)
+
+    def test_fonts_are_loaded_once_and_the_canvas_fits_the_ticket(self):
+        _load_fonts.cache_clear()
+        now = timezone.now()
+        short = orderitem_receipt(None, [('Osh', 1)], now)
+        long = orderitem_receipt(None, [('Osh', 1), ('Non', 2), ('Choy', 1)], now)
+
+        self.assertEqual(_load_fonts.cache_info().misses, 1)
+        # Header, 60px per line and the bottom margin, nothing more
+        heights = [EscPosDecoder().feed(data)[0].image().height for data in (short, long)]
+        self.assertEqual(heights, [340, 460])
+
+
+@override_settings(AUDIT_ASYNC=False)
+class TextReceiptTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+998900000001', name='Dilshod')
+        self.table = Table.objects.create(name='Stol 3', location="Yozgi bogʻ", capacity=4)
+        self.order = Order.objects.create(user=self.user, table=self.table)
+        self.printer = Printer.objects.create(name='Oshxona', ip_address='127.0.0.1', render_mode='text')
+        self.menu_item = MenuItem.objects.create(
+            name='Moʻsh kichiri', price=decimal.Decimal('25000.00'), category='mains', printer=self.printer
+        )
+
+    def test_new_item_prints_a_text_ticket(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=decimal.Decimal('2.00'))
+
+        # Only the ticket description is queued; the worker renders it
+        job = PrintJob.objects.get(printer=self.printer)
+        self.assertEqual(job.payload_format, 'ticket')
+        self.assertEqual(job.ticket['kind'], 'new')
+        data = render_ticket(job)
+        self.assertTrue(data.startswith(b'\x1b@\x1bt\x11'))
+        self.assertIn(b"Mo'sh kichiri", data)
+        self.assertIn(b"Yozgi bog'", data)
+        self.assertNotIn(b'\x1dv0', data)  # no raster image
+        self.assertTrue(data.endswith(b'\x1dV\x00'))
+
+        # Split over two reads, as a printer may receive it
+        decoder = EscPosDecoder()
+        tickets = decoder.feed(data[:7]) + decoder.feed(data[7:])
+        self.assertEqual(len(tickets), 1)
+        self.assertIn("Mo'sh kichiri", tickets[0].decoded_text())
+        self.assertEqual(tickets[0].size, len(data))
+
+
+@override_settings(AUDIT_ASYNC=False)
+class KitchenTicketCoalescingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+998900000002', name='Aziza', role='waiter')
+        self.table = Table.objects.create(name='Stol 5', capacity=4)
+        self.order = Order.objects.create(user=self.user, table=self.table)
+        self.grill = Printer.objects.create(name='Grill', ip_address='127.0.0.2')
+        self.bar = Printer.objects.create(name='Bar', ip_address='127.0.0.3')
+        self.steak = MenuItem.objects.create(name='Steak', price=decimal.Decimal('90000.00'), category='mains', printer=self.grill)
+        self.kebab = MenuItem.objects.create(name='Kabob', price=decimal.Decimal('40000.00'), category='mains', printer=self.grill)
+        self.tea = MenuItem.objects.create(name='Choy', price=decimal.Decimal('5000.00'), category='drinks', printer=self.bar)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_order_gets_one_cashier_receipt(self):
+        Printer.objects.create(name='Kassa', ip_address='127.0.0.4', is_cashier_printer=True)
+        self.order.order_status = 'pending'
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            self.order.save()
+            self.order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+        self.assertEqual(PrintJob.objects.filter(order=self.order, kind='cashier').count(), 1)
+
+    def test_bulk_submission_prints_one_ticket_per_printer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orderitems/', [
+                {'order': self.order.pk, 'menu_item': self.steak.pk, 'quantity': '1.00'},
+                {'order': self.order.pk, 'menu_item': self.tea.pk, 'quantity': '2.00'},
+                {'order': self.order.pk, 'menu_item': self.kebab.pk, 'quantity': '3.00'},
+            ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        grill_job = PrintJob.objects.get(printer=self.grill)
+        self.assertEqual([line['name'] for line in grill_job.ticket['lines']], ['Steak', 'Kabob'])
+        bar_job = PrintJob.objects.get(printer=self.bar)
+        self.assertEqual([line['name'] for line in bar_job.ticket['lines']], ['Choy'])
+
+    @override_settings(PRINT_COALESCE_SECONDS=30)
+    def test_items_within_window_join_the_held_ticket(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, menu_item=self.steak)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, menu_item=self.kebab)
+
+        job = PrintJob.objects.get(printer=self.grill)
+        self.assertEqual([line['name'] for line in job.ticket['lines']], ['Steak', 'Kabob'])
+        # Held back until the window closes
+        self.assertEqual(claim_jobs('worker-a'), [])
+
+    def test_print_history_is_filtered_by_order(self):
+        other = Order.objects.create(user=self.user, table=self.table)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = OrderItem.objects.create(order=self.order, menu_item=self.steak)
+            OrderItem.objects.create(order=other, menu_item=self.tea)
+
+        job = PrintJob.objects.get(order=self.order)
+        self.assertEqual((job.kind, job.order_item_id), ('new', item.pk))
+        response = self.client.get('/api/v1/printjobs/', {'order': self.order.pk})
+        self.assertEqual([row['id'] for row in response.data['results']], [job.pk])
+        response = self.client.get('/api/v1/printjobs/', {'table': self.table.pk})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(self.client.get('/api/v1/printjobs/', {'table': 'abc'}).status_code, 400)
+
+        response = self.client.post(f'/api/v1/printjobs/{job.pk}/reprint/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PrintJob.objects.filter(order=self.order, kind='new').count(), 2)
+
+        response = self.client.get('/api/v1/printjobs/queue/')
+        depth = {(row['printer_name'], row['priority_name']): row['pending'] for row in response.data}
+        self.assertEqual(depth, {('Grill', 'New items'): 2, ('Bar', 'New items'): 1})
+
+
+@override_settings(AUDIT_ASYNC=False)
+class BulkOrderItemTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+998900000006', name='Sardor', role='waiter')
+        self.order = Order.objects.create(user=self.user, table=Table.objects.create(name='Stol 9', capacity=4))
+        self.flour = Inventory.objects.create(name='Un', quantity=decimal.Decimal('1.00'), unit_of_measure='kg', price=0)
+        self.meat = Inventory.objects.create(name="Go'sht", quantity=decimal.Decimal('2.00'), unit_of_measure='kg', price=0)
+        self.somsa = MenuItem.objects.create(name='Somsa', price=decimal.Decimal('8000.00'), category='food')
+        self.manti = MenuItem.objects.create(name='Manti', price=decimal.Decimal('25000.00'), category='food')
+        MenuItemIngredient.objects.create(menu_item=self.somsa, inventory=self.flour, quantity=decimal.Decimal('0.10'))
+        MenuItemIngredient.objects.create(menu_item=self.somsa, inventory=self.meat, quantity=decimal.Decimal('0.20'))
+        MenuItemIngredient.objects.create(menu_item=self.manti, inventory=self.flour, quantity=decimal.Decimal('0.25'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_submission_deducts_stock_once_per_ingredient(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orderitems/', [
+                {'order': self.order.pk, 'menu_item': self.somsa.pk, 'quantity': '3.00'},
+                {'order': self.order.pk, 'menu_item': self.manti.pk, 'quantity': '2.00'},
+            ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.flour.refresh_from_db()
+        self.meat.refresh_from_db()
+        self.assertEqual(self.flour.quantity, decimal.Decimal('0.20'))
+        self.assertEqual(self.meat.quantity, decimal.Decimal('1.40'))
+        self.assertEqual(InventoryUsage.objects.filter(order_item__order=self.order).count(), 3)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.subamount, decimal.Decimal('74000.00'))
+
+    def test_quantity_change_adjusts_stock_without_rereading_the_item(self):
+        OrderItem.objects.create(order=self.order, menu_item=self.somsa, quantity=decimal.Decimal('2.00'))
+        item = OrderItem.objects.get(order=self.order)
+        item.quantity = decimal.Decimal('4.00')
+        with CaptureQueriesContext(connection) as ctx:
+            item.save()
+
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "order_orderitem"' in q['sql']])
+        self.flour.refresh_from_db()
+        self.meat.refresh_from_db()
+        self.assertEqual((self.flour.quantity, self.meat.quantity), (decimal.Decimal('0.60'), decimal.Decimal('1.20')))
+        usage = dict(InventoryUsage.objects.filter(order_item=item).values_list('inventory__name', 'used_quantity'))
+        self.assertEqual(usage, {'Un': decimal.Decimal('0.40'), "Go'sht": decimal.Decimal('0.80')})
+
+    def test_quantity_change_follows_the_recipe_the_line_was_sold_with(self):
+        item = OrderItem.objects.create(order=self.order, menu_item=self.somsa, quantity=decimal.Decimal('2.00'))
+        # The recipe changes after the sale: meat leaves it, onion joins it
+        MenuItemIngredient.objects.filter(menu_item=self.somsa, inventory=self.meat).delete()
+        onion = Inventory.objects.create(name='Piyoz', quantity=decimal.Decimal('1.00'), unit_of_measure='kg', price=0)
+        MenuItemIngredient.objects.create(menu_item=self.somsa, inventory=onion, quantity=decimal.Decimal('0.05'))
+
+        item.quantity = decimal.Decimal('3.00')
+        item.save()
+        self.meat.refresh_from_db()
+        self.assertEqual(self.meat.quantity, decimal.Decimal('1.40'))
+        self.assertEqual(
+            dict(InventoryUsage.objects.filter(order_item=item).values_list('inventory_id', 'used_quantity')),
+            {self.flour.pk: decimal.Decimal('0.300'), self.meat.pk: decimal.Decimal('0.600')},
+        )
+
+        item.quantity = decimal.Decimal('1.00')
+        item.save()
+        for inventory, left in ((self.flour, '0.90'), (self.meat, '1.80'), (onion, '1.00')):
+            inventory.refresh_from_db()
+            self.assertEqual(inventory.quantity, decimal.Decimal(left))
+
+    def test_availability_is_recomputed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.reduce_quantity(decimal.Decimal('0.80'))
+            self.meat.reduce_quantity(decimal.Decimal('1.00'))
+        self.somsa.refresh_from_db()
+        self.manti.refresh_from_db()
+        self.assertEqual((self.somsa.is_available, self.manti.is_available), (True, False))
+
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            for inventory in (self.flour, self.meat):
+                inventory.quantity = decimal.Decimal('5.00')
+                inventory.save()
+        self.manti.refresh_from_db()
+        self.assertTrue(self.manti.is_available)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "order_menuitem"')]), 1)
+
+    def test_dish_is_available_again_when_the_short_ingredient_leaves_its_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.meat.reduce_quantity(decimal.Decimal('1.90'))
+        self.somsa.refresh_from_db()
+        self.assertFalse(self.somsa.is_available)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItemIngredient.objects.get(menu_item=self.somsa, inventory=self.meat).delete()
+        self.somsa.refresh_from_db()
+        self.assertTrue(self.somsa.is_available)
+
+    def test_recipes_are_cached_until_the_menu_changes(self):
+        OrderItem.objects.create(order=self.order, menu_item=self.manti)
+        with CaptureQueriesContext(connection) as ctx:
+            OrderItem.objects.create(order=self.order, menu_item=self.manti)
+        self.assertFalse([q for q in ctx.captured_queries if 'menuitemingredient' in q['sql']])
+
+        MenuItemIngredient.objects.create(menu_item=self.manti, inventory=self.meat, quantity=decimal.Decimal('0.50'))
+        OrderItem.objects.create(order=self.order, menu_item=self.manti)
+        self.meat.refresh_from_db()
+        self.assertEqual(self.meat.quantity, decimal.Decimal('1.50'))
+
+    def test_insufficient_stock_rejects_the_whole_submission(self):
+        response = self.client.post('/api/v1/orderitems/', [
+            {'order': self.order.pk, 'menu_item': self.somsa.pk, 'quantity': '11.00'},
+            {'order': self.order.pk, 'menu_item': self.manti.pk, 'quantity': '1.00'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Insufficient stock for Un', response.data[0])
+        self.assertIn("Insufficient stock for Go'sht", response.data[1])
+        self.assertFalse(OrderItem.objects.filter(order=self.order).exists())
+        self.meat.refresh_from_db()
+        self.assertEqual(self.meat.quantity, decimal.Decimal('2.00'))
+
+
+@override_settings(AUDIT_ASYNC=False, SIDE_EFFECTS_SYNC=True)
+class OrderTotalsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+998900000007', name='Nodira', role='waiter')
+        self.order = Order.objects.create(user=self.user, table=Table.objects.create(name='Stol 10', capacity=4))
+        self.plov = MenuItem.objects.create(name='Osh', price=decimal.Decimal('35000.00'), category='mains')
+        self.tea = MenuItem.objects.create(name='Choy', price=decimal.Decimal('5000.00'), category='drinks')
+
+    def assertTotals(self, subamount, amount):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.subamount, self.order.amount), (decimal.Decimal(subamount), decimal.Decimal(amount)))
+
+    def test_totals_follow_item_changes(self):
+        plov = OrderItem.objects.create(order=self.order, menu_item=self.plov, quantity=decimal.Decimal('2.00'))
+        OrderItem.objects.create(order=self.order, menu_item=self.tea)
+        self.assertTotals('75000.00', '82500.00')
+
+        plov.quantity = decimal.Decimal('1.00')
+        plov.save()
+        self.assertTotals('40000.00', '44000.00')
+
+        plov.delete()
+        self.assertTotals('5000.00', '5500.00')
+
+    def test_saving_only_the_quantity_stores_the_new_line_total(self):
+        plov = OrderItem.objects.create(order=self.order, menu_item=self.plov)
+        plov.quantity = decimal.Decimal('3.00')
+        plov.save(update_fields=['quantity'])
+
+        plov.refresh_from_db()
+        self.assertEqual(plov.line_total, decimal.Decimal('105000.00'))
+        self.assertTotals('105000.00', '115500.00')
+
+    def test_price_and_commission_changes_dont_touch_existing_lines(self):
+        item = OrderItem.objects.create(order=self.order, menu_item=self.plov)
+        MenuItem.objects.filter(pk=self.plov.pk).update(price=decimal.Decimal('50000.00'))
+        Table.objects.filter(pk=self.order.table_id).update(commission=decimal.Decimal('15.00'))
+
+        item.refresh_from_db()
+        item.quantity = decimal.Decimal('2.00')
+        item.save()
+        self.assertEqual((item.unit_price, item.line_total), (decimal.Decimal('35000.00'), decimal.Decimal('70000.00')))
+        self.assertTotals('70000.00', '77000.00')
+
+        self.order.refresh_from_db()
+        self.order.calculate_order_total()
+        self.assertTotals('70000.00', '77000.00')
+
+    @override_settings(SIDE_EFFECTS_SYNC=False)
+    def test_side_effects_are_merged_per_unit_of_work(self):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            with unit_of_work.atomic():
+                plov = OrderItem.objects.create(order=self.order, menu_item=self.plov)
+                OrderItem.objects.create(order=self.order, menu_item=self.tea)
+                plov.quantity = decimal.Decimal('3.00')
+                plov.save()
+                self.assertFalse(AuditLog.objects.filter(model_name='OrderItem').exists())
+            # The total is part of the write: it is updated before the commit
+            self.assertTotals('110000.00', '121000.00')
+
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "order_order"')]), 1)
+        plov_log = AuditLog.objects.get(model_name='OrderItem', object_id=str(plov.pk))
+        self.assertEqual(plov_log.action, 'create')
+        self.assertEqual(plov_log.changes['quantity'], [None, '3.00'])
+
+    @override_settings(SIDE_EFFECTS_SYNC=False)
+    def test_required_effects_roll_back_with_the_write(self):
+        with self.assertRaises(ValueError):
+            with unit_of_work.atomic():
+                OrderItem.objects.create(order=self.order, menu_item=self.plov)
+                raise ValueError
+        with unit_of_work.atomic():
+            OrderItem.objects.create(order=self.order, menu_item=self.tea)
+
+        self.assertTotals('5000.00', '5500.00')
+
+    def test_reconcile_repairs_drifted_totals(self):
+        OrderItem.objects.create(order=self.order, menu_item=self.plov)
+        Order.objects.filter(pk=self.order.pk).update(subamount=1, amount=1)
+
+        out = io.StringIO()
+        call_command('reconcile_order_totals', stdout=out)
+        self.assertIn('Repaired 1 orders', out.getvalue())
+        self.assertTotals('35000.00', '38500.00')
+
+
+class SqliteWriteLockTestCase(TransactionTestCase):
+    def test_transactions_take_the_write_lock_up_front(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Printer.objects.exists()
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+@override_settings(AUDIT_ASYNC=False, SIDE_EFFECTS_RETRIES=3, SIDE_EFFECTS_RETRY_DELAY=0)
+class UnitOfWorkRetryTestCase(TestCase):
+    def setUp(self):
+        self.applied = []
+        self.failures = 0
+        unit_of_work.register('test_flaky', self.flaky)
+        self.addCleanup(unit_of_work._flushers.pop, 'test_flaky')
+
+    def flaky(self, effects):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError('database is locked')
+        self.applied.extend(effects)
+
+    def test_locked_flush_is_retried(self):
+        self.failures = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            unit_of_work.collect('test_flaky', 1, 'x')
+        self.assertEqual(self.applied, [1])
+
+    def test_effects_are_kept_when_retries_run_out(self):
+        self.failures = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            unit_of_work.collect('test_flaky', 1, 'x')
+        self.assertEqual(self.applied, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            unit_of_work.collect('test_flaky', 2, 'y')
+        self.assertEqual(self.applied, [1, 2])
+
+
+@override_settings(AUDIT_ASYNC=False)
+class PrinterGroupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+998900000003', name='Sardor', role='waiter')
+        self.order = Order.objects.create(user=self.user, table=Table.objects.create(name='Stol 9', capacity=2))
+        self.group = PrinterGroup.objects.create(name='Grill')
+        self.first = Printer.objects.create(name='Grill 1', ip_address='127.0.0.2', group=self.group)
+        self.second = Printer.objects.create(name='Grill 2', ip_address='127.0.0.3', group=self.group)
+        self.steak = MenuItem.objects.create(
+            name='Steak', price=decimal.Decimal('90000.00'), category='mains', printer_group=self.group
+        )
+
+    def test_ticket_goes_to_least_busy_healthy_member(self):
+        PrintJob.objects.create(printer=self.first, data=b'x')
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, menu_item=self.steak)
+        self.assertEqual(PrintJob.objects.get(order=self.order).printer, self.second)
+
+        self.second.unreachable_since = timezone.now()
+        self.second.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, menu_item=self.steak)
+        self.assertEqual(PrintJob.objects.filter(order=self.order, printer=self.first).count(), 1)
+
+    def test_dead_member_fails_over_within_group(self):
+        self.assertEqual(backup_for(self.first), self.second)
+        self.second.is_enabled = False
+        self.second.save()
+        self.assertIsNone(backup_for(self.first))
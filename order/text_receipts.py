@@ -0,0 +1,152 @@
+"""
+Text-mode receipts: the same tickets as utils.py, but sent as ESC/POS text commands
+printed with the printer's built-in font instead of a raster image.
+"""
+from .utils import ESC_INIT, FEED_AND_CUT, _format_qty, group_order_items, order_labels
+
+# --- CONFIGURATION ---
+LINE_WIDTH = 48  # Font A characters per line on 80mm paper
+CODE_PAGE = 17  # ESC t 17 = PC866 on Epson-compatible printers (Latin + Cyrillic)
+ENCODING = 'cp866'
+
+# Uzbek Latin uses modifier letters for oʻ/gʻ and ʼ that no printer code page has
+UZBEK_CHARS = str.maketrans({
+    'ʻ': "'",  # ʻ modifier letter turned comma (oʻ, gʻ)
+    'ʼ': "'",  # ʼ modifier letter apostrophe
+    '‘': "'",
+    '’': "'",
+    '`': "'",
+    # Uzbek Cyrillic letters missing from PC866
+    'Қ': 'К', 'қ': 'к',
+    'Ғ': 'Г', 'ғ': 'г',
+    'Ҳ': 'Х', 'ҳ': 'х',
+})
+
+# --- ESC/POS COMMANDS ---
+SIZES = {
+    'normal': b'\x1d!\x00',
+    'tall': b'\x1d!\x01',  # double height, still LINE_WIDTH characters per line
+    'big': b'\x1d!\x11',  # double width and height, LINE_WIDTH // 2 characters
+}
+ALIGN = {'left': b'\x1ba\x00', 'center': b'\x1ba\x01', 'right': b'\x1ba\x02'}
+BOLD_ON = b'\x1bE\x01'
+BOLD_OFF = b'\x1bE\x00'
+
+
+def encode_text(text):
+    return str(text).translate(UZBEK_CHARS).encode(ENCODING, errors='replace')
+
+
+class TextTicket:
+    """Collects ESC/POS text commands for one ticket."""
+
+    def __init__(self):
+        self.out = bytearray(ESC_INIT)
+        self.out += b'\x1bt' + bytes([CODE_PAGE])
+
+    def line(self, text='', size='normal', bold=False, align='left'):
+        self.out += SIZES[size] + ALIGN[align]
+        if bold:
+            self.out += BOLD_ON
+        self.out += encode_text(text) + b'\n'
+        if bold:
+            self.out += BOLD_OFF
+        return self
+
+    def rule(self, char='-'):
+        return self.line(char * LINE_WIDTH)
+
+    def columns(self, name, qty, price=None, size='tall'):
+        """'Name Left | Qty Center | Price Right', like utils._draw_columns."""
+        if price is None:
+            price_str = ''
+        elif isinstance(price, str):
+            price_str = price
+        else:
+            price_str = f"{int(price):,}".replace(",", " ")
+        qty_str = qty if isinstance(qty, str) else _format_qty(qty)
+        name_width = LINE_WIDTH - 20
+        display_name = (name[:name_width - 2] + '..') if len(name) > name_width else name
+        text = f"{display_name:<{name_width}}{qty_str:^8}{price_str:>12}"
+        return self.line(text, size=size)
+
+    def build(self):
+        self.out += SIZES['normal'] + ALIGN['left'] + FEED_AND_CUT
+        return bytes(self.out)
+
+
+# --- INDIVIDUAL RECEIPT FUNCTIONS ---
+
+def cashier_receipt(order_id):
+    from .models import Order
+    order = Order.objects.select_related('user', 'table').get(id=order_id)
+    ticket = TextTicket()
+
+    waiter = order.user.name if order.user else "N/A"
+    ticket.line(f"Ofitsant: {waiter}", size='tall', bold=True)
+    ticket.line(f"Stol: {order.table.name}, {order.table.location}")
+    ticket.line(f"ochilgan vaqt: {order.c_at.strftime('%d/%m/%y %H:%M')}")
+    ticket.line(f"yopilgan vaqt: {order.u_at.strftime('%d/%m/%y %H:%M')}")
+    ticket.rule('=')
+
+    ticket.columns("Nomi", "Soni", "Narxi", size='normal')
+    for name, data in group_order_items(order).items():
+        ticket.columns(name, data['qty'], data['total'])
+        ticket.rule()
+
+    ticket.rule('=')
+    ticket.line(f"Jami: {order.subamount}")
+    ticket.line(f"xizmat haqi: {order.commission_rate}% = {order.amount - order.subamount}")
+    ticket.rule('=')
+    ticket.line(f"TO'LOV: {order.amount} UZS", size='big', bold=True)
+    return ticket.build()
+
+def orderitem_receipt(order, lines, printed_at):
+    """Kitchen ticket. `lines` is a list of (name, quantity)."""
+    if not lines: return b""
+    waiter, table = order_labels(order)
+    ticket = TextTicket()
+
+    ticket.line(f"Ofitsant: {waiter}", size='tall', bold=True)
+    ticket.line(f"Stol: {table}", size='tall', bold=True)
+    ticket.line(f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}")
+    ticket.rule('=')
+    ticket.line("BUYURTMALAR:", bold=True)
+    ticket.rule('=')
+
+    for name, quantity in lines:
+        ticket.columns(name, quantity)
+        ticket.rule()
+
+    return ticket.build()
+
+def cancelled_orderitem_receipt(order, lines, printed_at):
+    if not lines: return b""
+    waiter, table = order_labels(order)
+    ticket = TextTicket()
+
+    ticket.line("!!! BEKOR QILINDI !!!", size='big', bold=True, align='center')
+    ticket.rule('=')
+    ticket.line(f"Stol: {table}", size='tall', bold=True)
+    ticket.line(f"ofitsant: {waiter}", size='tall')
+    ticket.line(f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}", size='tall')
+    ticket.rule('=')
+
+    for name, quantity in lines:
+        ticket.columns(name, quantity)
+
+    return ticket.build()
+
+def reduced_orderitem_receipt(order, name, reduced_quantity, printed_at):
+    waiter, table = order_labels(order)
+    ticket = TextTicket()
+
+    ticket.line("bekor qilindi", size='big', bold=True, align='center')
+    ticket.rule('=')
+    ticket.line(f"Stol: {table}", size='tall', bold=True)
+    ticket.line(f"ofitsant: {waiter}", size='tall')
+    ticket.line(f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}", size='tall')
+    ticket.rule('=')
+
+    ticket.columns(name, f"-{_format_qty(reduced_quantity)}")
+    return ticket.build()
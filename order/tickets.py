@@ -0,0 +1,204 @@
+"""
+Print tickets are queued as a small description of what to print (kind, order, lines)
+and rendered into ESC/POS bytes by the print worker, off the HTTP request path.
+"""
+import decimal
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import unit_of_work
+from .recipes import recipe_for
+
+TICKET_KINDS = ('new', 'cancel', 'reduce', 'cashier')
+# Kinds whose lines can be printed together on one ticket
+MERGEABLE_KINDS = ('new', 'cancel')
+# Only new items are held back for PRINT_COALESCE_SECONDS; cancellations go out right away
+HELD_KINDS = ('new',)
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_line(order_item, quantity=None):
+    """Snapshot of one order line; the row may be changed or deleted before the ticket prints."""
+    return {
+        'order_item_id': order_item.pk,
+        'menu_item_id': order_item.menu_item_id,
+        'name': recipe_for(order_item.menu_item_id).name,
+        'quantity': str(order_item.quantity if quantity is None else quantity),
+    }
+
+
+def describe_ticket(kind, order_id, lines=()):
+    return {
+        'kind': kind,
+        'order_id': order_id,
+        'lines': list(lines),
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+def route_for(menu_item_id):
+    """Where the menu item's kitchen tickets go: its printer group, else its enabled printer, else None."""
+    recipe = recipe_for(menu_item_id)
+    if recipe is None:
+        return None
+    if recipe.printer_group is not None:
+        return recipe.printer_group
+    printer = recipe.printer
+    if printer is None or not printer.is_enabled:
+        return None
+    return printer
+
+
+def enqueue_ticket(target, ticket):
+    """
+    Queues the ticket for a Printer or PrinterGroup at the end of the surrounding
+    unit_of_work.atomic() block, in its transaction: nothing is queued on rollback. Mergeable
+    tickets of one block for the same printer, order and kind become one ticket, and an order
+    gets one cashier receipt per block.
+    """
+    unit_of_work.collect('ticket', ticket_key(target, ticket), (target, ticket), merge=_merge_ticket)
+
+
+def ticket_key(target, ticket):
+    """Tickets with the same key can be printed as one; non-mergeable kinds get a key of their own."""
+    if ticket['kind'] in MERGEABLE_KINDS:
+        return (target._meta.model_name, target.pk, ticket['order_id'], ticket['kind'])
+    if ticket['kind'] == 'cashier':
+        # One receipt per order, however often the order is saved in the transaction
+        return ('cashier', ticket['order_id'])
+    return object()
+
+
+def _merge_ticket(old, new):
+    target, ticket = old
+    return target, dict(ticket, lines=ticket['lines'] + new[1]['lines'])
+
+
+def queue_tickets(tickets):
+    """Flusher for {key: (target, ticket)}."""
+    for target, ticket in tickets.values():
+        queue_ticket(target, ticket)
+
+
+def queue_ticket(target, ticket):
+    """
+    Creates the PrintJob. A PrinterGroup target picks its least busy healthy printer.
+    With PRINT_COALESCE_SECONDS set, a new-items ticket is held back that long and
+    later tickets for the same printer (or group), order and kind are folded into it.
+    """
+    from .models import PrintJob, PrinterGroup
+
+    if ticket['kind'] == 'cashier' and PrintJob.objects.active().filter(order_id=ticket['order_id'], kind='cashier').exists():
+        # Queued by another transaction after this one checked in the order's post_save
+        return None
+
+    links = job_links(ticket)
+    window = settings.PRINT_COALESCE_SECONDS
+    held_kind = window and ticket['kind'] in HELD_KINDS
+    if isinstance(target, PrinterGroup):
+        printer = target.least_busy_printer()
+        if printer is None:
+            logger.warning("Printer group %s has no enabled printer, ticket dropped", target)
+            return None
+        same_station = {'printer__group': target}
+    else:
+        printer = target
+        same_station = {'printer': target}
+
+    if not held_kind:
+        return PrintJob.objects.create(
+            printer=printer, payload_format='ticket', ticket=ticket, status='pending', **links
+        )
+
+    now = timezone.now()
+    open_job = PrintJob.objects.active().filter(
+        status='pending', payload_format='ticket',
+        order_id=ticket['order_id'], kind=ticket['kind'],
+        not_before__gt=now, **same_station
+    ).order_by('-c_at').first()
+    if open_job is not None:
+        merged = dict(open_job.ticket, lines=open_job.ticket['lines'] + ticket['lines'])
+        # u_at guards against a concurrent merge or claim between the read and this write
+        updated = PrintJob.objects.filter(pk=open_job.pk, status='pending', u_at=open_job.u_at).update(
+            ticket=merged, order_item=None, u_at=now
+        )
+        if updated:
+            return open_job
+
+    return PrintJob.objects.create(
+        printer=printer, payload_format='ticket', ticket=ticket, status='pending',
+        not_before=now + timedelta(seconds=window), **links
+    )
+
+
+def job_priority(kind):
+    from .models import PrintJob
+
+    if kind in ('cancel', 'reduce'):
+        return PrintJob.PRIORITY_CANCEL
+    if kind == 'cashier':
+        return PrintJob.PRIORITY_CASHIER
+    return PrintJob.PRIORITY_NEW
+
+
+def job_deadline(kind):
+    """Kitchen tickets expire after PRINT_TICKET_DEADLINE_SECONDS (0: never). Cashier receipts never do."""
+    seconds = settings.PRINT_TICKET_DEADLINE_SECONDS
+    if not seconds or kind == 'cashier':
+        return None
+    return timezone.now() + timedelta(seconds=seconds)
+
+
+def job_links(ticket):
+    """
+    The kind, priority, deadline, order and (single-line tickets only) order item
+    columns of the ticket's PrintJob.
+    """
+    from .models import Order, OrderItem
+
+    order_id = ticket['order_id']
+    order_item_id = ticket['lines'][0]['order_item_id'] if len(ticket['lines']) == 1 else None
+    if ticket['kind'] == 'cancel':
+        # The line is deleted already, and with it maybe the whole order
+        order_item_id = None
+        if not Order.objects.filter(pk=order_id).exists():
+            order_id = None
+    elif order_item_id is not None and not OrderItem.objects.filter(pk=order_item_id).exists():
+        order_item_id = None
+    return {
+        'kind': ticket['kind'],
+        'priority': job_priority(ticket['kind']),
+        'deadline': job_deadline(ticket['kind']),
+        'order_id': order_id,
+        'order_item_id': order_item_id,
+    }
+
+
+def render_ticket(job):
+    """Renders a 'ticket' PrintJob into ESC/POS bytes in its printer's render mode."""
+    from .models import Order
+    from .utils import receipts_for
+
+    ticket = job.ticket
+    receipts = receipts_for(job.printer)
+    if ticket['kind'] == 'cashier':
+        return receipts.cashier_receipt(ticket['order_id'])
+
+    order = Order.objects.select_related('user', 'table').filter(pk=ticket['order_id']).first()
+    printed_at = timezone.localtime(parse_datetime(ticket['created_at']))
+    lines = [(line['name'], decimal.Decimal(line['quantity'])) for line in ticket['lines']]
+
+    if ticket['kind'] == 'new':
+        return receipts.orderitem_receipt(order, lines, printed_at)
+    if ticket['kind'] == 'cancel':
+        return receipts.cancelled_orderitem_receipt(order, lines, printed_at)
+    if ticket['kind'] == 'reduce':
+        name, quantity = lines[0]
+        return receipts.reduced_orderitem_receipt(order, name, quantity, printed_at)
+    raise ValueError(f"Unknown ticket kind: {ticket['kind']}")
+
+
+unit_of_work.register('ticket', queue_tickets, order=30, required=True)
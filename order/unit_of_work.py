@@ -0,0 +1,165 @@
+"""
+Side effects of writes (order total changes, menu availability, kitchen tickets, audit rows)
+are collected per transaction and merged per object, so e.g. a bulk submission updates its
+order total once and prints one ticket per printer.
+
+Each kind of effect has a flusher, registered by the app that owns it:
+
+    unit_of_work.register('audit', write_audit_rows, order=40)
+    unit_of_work.collect('audit', ('Order', 5), row, merge=merge_audit_rows)
+
+Kinds registered with required=True (order totals, kitchen tickets) are part of the write:
+they are carried out at the end of the outermost unit_of_work.atomic() block, inside its
+transaction, so they commit or roll back together with it. Outside such a block they run at
+once, in whatever transaction is open.
+
+The other kinds (availability, audit) run after commit, in one BEGIN IMMEDIATE transaction
+(see configure_sqlite in settings). If the database is still locked it is retried
+SIDE_EFFECTS_RETRIES times; after that the effects are kept and retried before the next flush
+of this process. Errors of a kind are logged and the other kinds still run.
+
+With SIDE_EFFECTS_SYNC (for tests) every effect runs as soon as it is collected.
+Known limit: effects collected inside a savepoint that is rolled back still run if the outer
+transaction commits; the order paths roll back the whole request on errors anyway.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+logger = logging.getLogger(__name__)
+
+_flushers = {}  # {kind: (order, func, required)}
+_local = threading.local()
+_unflushed_lock = threading.Lock()
+_unflushed = []  # optional effects of flushes that gave up, retried before the next flush
+
+
+def register(kind, func, order=100, required=False):
+    """
+    func({key: value}) carries out the collected effects of `kind`; lower `order` runs first.
+    A `required` kind runs inside the transaction that collected it (see atomic()).
+    """
+    _flushers[kind] = (order, func, required)
+
+
+def _by_order(kinds):
+    return sorted(kinds, key=lambda kind: _flushers[kind][0])
+
+
+class UnitOfWork:
+    def __init__(self, hooks):
+        # The connection's on_commit list; Django replaces it when the transaction ends
+        self.hooks = hooks
+        self.effects = {}  # {kind: {key: value}}
+
+    def collect(self, kind, key, value, merge=None):
+        pending = self.effects.setdefault(kind, {})
+        if key in pending and merge is not None:
+            value = merge(pending[key], value)
+        pending[key] = value
+
+    def flush_required(self):
+        """Carries out the required effects now, in the current transaction. Errors propagate."""
+        for kind in _by_order(kind for kind in self.effects if _flushers[kind][2]):
+            _flushers[kind][1](self.effects.pop(kind))
+
+    def discard_required(self):
+        for kind in [kind for kind in self.effects if _flushers[kind][2]]:
+            del self.effects[kind]
+
+    def flush(self):
+        self.flush_required()
+        effects, self.effects = self.effects, {}
+        with _unflushed_lock:
+            pending = _unflushed[:]
+            del _unflushed[:]
+        for batch in pending + ([effects] if effects else []):
+            flush_effects(batch)
+
+
+def _apply(effects):
+    # One write transaction for everything
+    with transaction.atomic():
+        for kind in _by_order(effects):
+            try:
+                with transaction.atomic():
+                    _flushers[kind][1](effects[kind])
+            except OperationalError:
+                # Locked: the whole flush is retried
+                raise
+            except Exception:
+                logger.exception("Deferred %s side effects failed", kind)
+
+
+def flush_effects(effects):
+    """Carries out {kind: {key: value}}, retrying while the database is locked. Never raises."""
+    delay = settings.SIDE_EFFECTS_RETRY_DELAY
+    for attempt in range(1, settings.SIDE_EFFECTS_RETRIES + 1):
+        try:
+            _apply(effects)
+            return True
+        except OperationalError as e:
+            if attempt == settings.SIDE_EFFECTS_RETRIES:
+                error = e
+                break
+            logger.warning("Deferred side effects hit a locked database (attempt %s): %s", attempt, e)
+            time.sleep(delay)
+            delay *= 2
+    with _unflushed_lock:
+        _unflushed.append(effects)
+    logger.error(
+        "Deferred side effects (%s) failed, keeping them for the next flush: %s",
+        ', '.join(sorted(effects)), error, exc_info=error,
+    )
+    return False
+
+
+@contextmanager
+def atomic():
+    """
+    transaction.atomic() that carries out the required effects collected in it before it
+    commits. Nested blocks leave them to the outermost one, so they merge across the block.
+    """
+    depth = getattr(_local, 'depth', 0)
+    with transaction.atomic():
+        _local.depth = depth + 1
+        try:
+            yield
+            if depth == 0:
+                current().flush_required()
+        except BaseException:
+            if depth == 0:
+                # Rolled back with the block (even when an outer transaction goes on)
+                current().discard_required()
+            raise
+        finally:
+            _local.depth = depth
+
+
+def current():
+    """The unit of work of the current transaction."""
+    hooks = transaction.get_connection().run_on_commit
+    uow = getattr(_local, 'uow', None)
+    if uow is None or uow.hooks is not hooks:
+        uow = _local.uow = UnitOfWork(hooks)
+    return uow
+
+
+def collect(kind, key, value, merge=None):
+    """
+    Adds an effect of `kind` for `key` (usually the object it is about). A second effect for
+    the same key replaces the first, or is combined with it by merge(old, new).
+    """
+    uow = current()
+    uow.collect(kind, key, value, merge)
+    if settings.SIDE_EFFECTS_SYNC:
+        uow.flush()
+    elif _flushers[kind][2]:
+        if not getattr(_local, 'depth', 0):
+            uow.flush_required()
+    else:
+        # Registered every time, so callbacks captured in tests flush too; later ones find nothing
+        transaction.on_commit(uow.flush)
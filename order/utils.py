@@ -1,17 +1,21 @@
-import io
-import base64
-from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
+import sys
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
 # --- CONFIGURATION ---
 PRINTER_WIDTH = 512  # Standard 80mm
 FONT_PATH = "arial.ttf"
 
-def _get_draw_obj():
-    img = Image.new('RGB', (PRINTER_WIDTH, 2000), color=(255, 255, 255))
-    draw = ImageDraw.Draw(img)
+# --- ESC/POS COMMANDS ---
+ESC_INIT = b'\x1b@'
+FEED_AND_CUT = b'\x1bd\x06\x1dV\x00'  # feed 6 lines, full cut (same as python-escpos cut())
+RASTER_BAND_HEIGHT = 256  # rows per 'GS v 0' command, small enough for any printer buffer
+
+@lru_cache(maxsize=None)
+def _load_fonts():
+    """Loads the receipt fonts once per process; every ticket reuses the same objects."""
     try:
-        fonts = {
+        return {
             'sm': ImageFont.truetype(FONT_PATH, 20),
             'md': ImageFont.truetype(FONT_PATH, 26),
             'bg': ImageFont.truetype(FONT_PATH, 34),
@@ -19,19 +23,75 @@ def _get_draw_obj():
         }
     except OSError:
         default = ImageFont.load_default()
-        fonts = {'sm': default, 'md': default, 'bg': default, 'xl': default}
-    return img, draw, fonts
+        return {'sm': default, 'md': default, 'bg': default, 'xl': default}
+
+class _ReceiptCanvas:
+    """
+    Stands in for both the image and the ImageDraw while a receipt is laid out.
+    Drawing calls are only recorded; render() allocates a 1-bit image of exactly
+    the height the receipt needs and replays them onto it.
+    """
+    _measure = ImageDraw.Draw(Image.new('1', (1, 1)))
+
+    def __init__(self):
+        self.ops = []
+
+    def text(self, xy, text, fill=0, font=None):
+        self.ops.append(('text', xy, text, font))
+
+    def line(self, xy, fill=0, width=1):
+        self.ops.append(('line', xy, width))
+
+    def textbbox(self, xy, text, font=None):
+        return self._measure.textbbox(xy, text, font=font)
+
+    def render(self, height):
+        # Inverted 1-bit canvas (set bit = black) is exactly the printer's raster format.
+        img = Image.new('1', (PRINTER_WIDTH, height), 0)
+        draw = ImageDraw.Draw(img)
+        for op in self.ops:
+            if op[0] == 'text':
+                _, xy, text, font = op
+                draw.text(xy, text, fill=1, font=font)
+            else:
+                _, xy, width = op
+                draw.line(xy, fill=1, width=width)
+        return img
+
+def _get_draw_obj():
+    canvas = _ReceiptCanvas()
+    return canvas, canvas, _load_fonts()
 
 def _draw_line(draw, y, width=2):
     draw.line((0, y, PRINTER_WIDTH, y), fill=0, width=width)
     return y + 15
 
-def _finalize_image(img, y_pos):
-    img = img.crop((0, 0, PRINTER_WIDTH, y_pos + 40))
+def _raster_to_escpos(img):
+    """
+    Packs a 1-bit image whose set bits are black dots into a ready-to-send ESC/POS stream:
+    init, 'GS v 0' raster bands, feed and cut.
+    """
+    width_bytes = (img.width + 7) // 8
+    rows = img.tobytes()
+
+    out = bytearray(ESC_INIT)
+    for top in range(0, img.height, RASTER_BAND_HEIGHT):
+        band_height = min(RASTER_BAND_HEIGHT, img.height - top)
+        out += b'\x1dv0\x00'
+        out += width_bytes.to_bytes(2, 'little') + band_height.to_bytes(2, 'little')
+        out += rows[top * width_bytes:(top + band_height) * width_bytes]
+    out += FEED_AND_CUT
+    return bytes(out)
+
+def image_to_escpos(img):
+    """Converts an ordinary (white background) image into a ready-to-send ESC/POS stream."""
     img = img.convert('1')
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
+    # In mode '1' a set bit is white, the printer wants set bit = black.
+    img = ImageOps.invert(img.convert('L')).convert('1', dither=Image.NONE)
+    return _raster_to_escpos(img)
+
+def _finalize_image(canvas, y_pos):
+    return _raster_to_escpos(canvas.render(y_pos + 40))
 
 def _format_qty(qty):
     """Formats quantity: 1.0 -> 1, 1.50 -> 1.5, 1.05 -> 1.05"""
@@ -60,6 +120,31 @@ def _draw_columns(draw, y, name, qty, price, fonts):
     
     return y + 50
 
+def group_order_items(order):
+    """Sums quantity and price of the order's lines per dish name: {name: {'qty', 'total'}}."""
+    grouped_items = {}
+    for item in order.order_items.select_related('menu_item'):
+        n = item.menu_item.name
+        if n in grouped_items:
+            grouped_items[n]['qty'] += item.quantity
+            grouped_items[n]['total'] += item.line_total
+        else:
+            grouped_items[n] = {'qty': item.quantity, 'total': item.line_total}
+    return grouped_items
+
+def order_labels(order):
+    """(waiter name, 'table, location') for ticket headers; the order may be gone already."""
+    waiter = order.user.name if order and order.user else "N/A"
+    table = f"{order.table.name}, {order.table.location}" if order and order.table else "N/A"
+    return waiter, table
+
+def receipts_for(printer):
+    """Returns the module that renders receipts for this printer's render mode."""
+    if printer.render_mode == 'text':
+        from . import text_receipts
+        return text_receipts
+    return sys.modules[__name__]
+
 # --- INDIVIDUAL RECEIPT FUNCTIONS ---
 
 def cashier_receipt(order_id):
@@ -88,16 +173,7 @@ def cashier_receipt(order_id):
     y += 30
 
     # Grouping and Drawing Items
-    grouped_items = {}
-    for item in order.order_items.all():
-        n = item.menu_item.name
-        if n in grouped_items:
-            grouped_items[n]['qty'] += item.quantity
-            grouped_items[n]['total'] += (item.quantity * item.menu_item.price)
-        else:
-            grouped_items[n] = {'qty': item.quantity, 'total': item.quantity * item.menu_item.price}
-
-    for name, data in grouped_items.items():
+    for name, data in group_order_items(order).items():
         y = _draw_columns(draw, y, name, data['qty'], data['total'], fonts)
         draw.line((10, y, PRINTER_WIDTH-10, y), fill=0, width=1)
         y += 10
@@ -106,7 +182,7 @@ def cashier_receipt(order_id):
     y = _draw_line(draw, y)
     draw.text((10,y), f"Jami: {order.subamount}", fill=0, font=fonts['md'])
     y += 40
-    draw.text((10,y), f"xizmat haqi: {order.table.commission}% = {order.amount - order.subamount}", fill=0, font=fonts['md'])
+    draw.text((10,y), f"xizmat haqi: {order.commission_rate}% = {order.amount - order.subamount}", fill=0, font=fonts['md'])
     y += 40
     y  = _draw_line(draw, y)
     total_str = f"TO'LOV: {order.amount} UZS"
@@ -115,17 +191,18 @@ def cashier_receipt(order_id):
 
     return _finalize_image(img, y)
 
-def orderitem_receipt(order_items):
-    if not order_items: return ""
-    order = order_items[0].order
+def orderitem_receipt(order, lines, printed_at):
+    """Kitchen ticket. `lines` is a list of (name, quantity)."""
+    if not lines: return b""
+    waiter, table = order_labels(order)
     img, draw, fonts = _get_draw_obj()
     y = 20
 
-    draw.text((10, y), f"Ofitsant: {order.user.name}", fill=0, font=fonts['bg'])
+    draw.text((10, y), f"Ofitsant: {waiter}", fill=0, font=fonts['bg'])
     y += 50
-    draw.text((10, y), f"Stol: {order.table.name}, {order.table.location}", fill=0, font=fonts['bg'])
+    draw.text((10, y), f"Stol: {table}", fill=0, font=fonts['bg'])
     y += 60
-    draw.text((10, y), f"vaqt: {datetime.now().strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['md'])
+    draw.text((10, y), f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['md'])
     y += 40
     y = _draw_line(draw, y)
 
@@ -133,53 +210,54 @@ def orderitem_receipt(order_items):
     y += 40
     y = _draw_line(draw, y)
 
-    for item in order_items:
-        y = _draw_columns(draw, y, item.menu_item.name, item.quantity, None, fonts)
+    for name, quantity in lines:
+        y = _draw_columns(draw, y, name, quantity, None, fonts)
         draw.line((10, y, PRINTER_WIDTH-10, y), fill=0, width=1)
         y += 10
 
     return _finalize_image(img, y)
 
-def cancelled_orderitem_receipt(order_items):
-    if not order_items: return ""
-    order = order_items[0].order
+def cancelled_orderitem_receipt(order, lines, printed_at):
+    if not lines: return b""
+    waiter, table = order_labels(order)
     img, draw, fonts = _get_draw_obj()
     y = 20
 
     draw.text((10, y), "!!! BEKOR QILINDI !!!", fill=0, font=fonts['xl'])
     y += 70
     y = _draw_line(draw, y)
-    draw.text((10, y), f"Stol: {order.table.name}, {order.table.location}", fill=0, font=fonts['bg'])
+    draw.text((10, y), f"Stol: {table}", fill=0, font=fonts['bg'])
     y += 50
-    draw.text((10,y), f"ofitsant: {order.user.name}", fill=0, font=fonts['bg'])
+    draw.text((10,y), f"ofitsant: {waiter}", fill=0, font=fonts['bg'])
     y += 50
-    draw.text((10,y), f"vaqt: {datetime.now().strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['bg'])
+    draw.text((10,y), f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['bg'])
     y += 40
     y = _draw_line(draw, y)
 
-    for item in order_items:
-        y = _draw_columns(draw, y, item.menu_item.name, item.quantity, None, fonts)
+    for name, quantity in lines:
+        y = _draw_columns(draw, y, name, quantity, None, fonts)
         y += 10
 
     return _finalize_image(img, y)
 
-def reduced_orderitem_receipt(order_item, reduced_quantity):
+def reduced_orderitem_receipt(order, name, reduced_quantity, printed_at):
+    waiter, table = order_labels(order)
     img, draw, fonts = _get_draw_obj()
     y = 20
 
     draw.text((10, y), "bekor qilindi", fill=0, font=fonts['xl'])
     y += 70
     y = _draw_line(draw, y)
-    draw.text((10, y), f"Stol: {order_item.order.table.name}, {order_item.order.table.location}", fill=0, font=fonts['bg'])
+    draw.text((10, y), f"Stol: {table}", fill=0, font=fonts['bg'])
     y += 50
-    draw.text((10,y), f"ofitsant: {order_item.order.user.name}", fill=0, font=fonts['bg'])
+    draw.text((10,y), f"ofitsant: {waiter}", fill=0, font=fonts['bg'])
     y += 50
-    draw.text((10,y), f"vaqt: {datetime.now().strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['bg'])
+    draw.text((10,y), f"vaqt: {printed_at.strftime('%d/%m/%y %H:%M')}", fill=0, font=fonts['bg'])
     y += 40
     y = _draw_line(draw, y)
 
 
     # Handles the negative prefix correctly for formatted quantity
-    y = _draw_columns(draw, y, order_item.menu_item.name, f"-{_format_qty(reduced_quantity)}", None, fonts)
+    y = _draw_columns(draw, y, name, f"-{_format_qty(reduced_quantity)}", None, fonts)
     
-    return _finalize_image(img, y)
\ No newline at end of file
+    return _finalize_image(img, y)
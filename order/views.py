@@ -1,18 +1,22 @@
 import logging
+from . import unit_of_work
+from django.db.models import Count, Min, Q
 from django.http import JsonResponse
 from .models import PrintJob
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import viewsets, permissions, pagination
+from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
 from .models import Order, MenuItem, OrderItem, Reservations, Printer
-from .filters import OrderFilter
+from .filters import OrderFilter, PrintJobFilter
 from .serializers import (
     OrderSerializer,
     MenuItemSerializer,
     OrderItemSerializer,
     ReservationsSerializer,
     PrinterSerializer,
+    PrintJobSerializer,
 )
 from drf_yasg.utils import swagger_auto_schema
 
@@ -85,7 +89,7 @@ def clear_print_queue(request):
     The worker will ignore them.
     """
     # 1. Update pending jobs
-    count = PrintJob.objects.filter(status='pending').update(status='cancelled')
+    count = PrintJob.objects.active().filter(status='pending').update(status='cancelled')
     
     return JsonResponse({
         'status': 'success',
@@ -113,7 +117,9 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         is_many = isinstance(request.data, list)
         serializer = self.get_serializer(data=request.data, many=is_many)
         if serializer.is_valid():
-            self.perform_create(serializer)
+            # One transaction: the unit of work merges the tickets into one per printer
+            with unit_of_work.atomic():
+                self.perform_create(serializer)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
@@ -152,6 +158,71 @@ class ReservationsViewSet(viewsets.ModelViewSet):
         """ Associate the reservation with the logged-in user. """
         serializer.save(user=self.request.user)
 
+@swagger_auto_schema(tags=['PrintJobs'])
+class PrintJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for print history, e.g. ?order=5312 or ?table=7&kind=new.
+    POST /printjobs/<id>/reprint/ queues the same ticket again.
+    GET /printjobs/queue/ shows the unprinted backlog per printer and priority.
+    """
+    queryset = PrintJob.objects.select_related('printer', 'order').order_by('-c_at')
+    serializer_class = PrintJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderPagination
+    filterset_class = PrintJobFilter
+
+    @action(detail=True, methods=['post'])
+    def reprint(self, request, pk=None):
+        job = self.get_object()
+        if job.payload_format == 'ticket' or (job.payload_format == 'escpos' and job.data is not None) \
+                or (job.payload_format == 'png_base64' and job.payload):
+            content = {'payload_format': job.payload_format, 'payload': job.payload, 'data': job.data, 'ticket': job.ticket}
+        elif job.ticket:
+            # Print data stripped by purge_print_jobs: render again from the ticket description
+            content = {'payload_format': 'ticket', 'ticket': job.ticket}
+        else:
+            return Response(
+                {'detail': 'The print data of this job has been purged, it cannot be reprinted.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        copy = PrintJob.objects.create(
+            printer=job.printer,
+            kind=job.kind,
+            order=job.order,
+            order_item=job.order_item,
+            priority=job.priority,
+            status='pending',
+            **content,
+        )
+        return Response(self.get_serializer(copy).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        """Queue depth: pending/printing jobs and the oldest one, per printer and priority."""
+        priorities = dict(PrintJob.PRIORITY_CHOICES)
+        rows = (
+            PrintJob.objects.active()
+            .values('printer', 'printer__name', 'priority')
+            .annotate(
+                pending=Count('id', filter=Q(status='pending')),
+                printing=Count('id', filter=Q(status='printing')),
+                oldest=Min('c_at'),
+            )
+            .order_by('printer', 'priority')
+        )
+        return Response([
+            {
+                'printer': row['printer'],
+                'printer_name': row['printer__name'],
+                'priority': row['priority'],
+                'priority_name': priorities.get(row['priority']),
+                'pending': row['pending'],
+                'printing': row['printing'],
+                'oldest': row['oldest'],
+            }
+            for row in rows
+        ])
+
 @swagger_auto_schema(tags=['Printers'])
 class PrinterViewSet(viewsets.ReadOnlyModelViewSet):
     """ API endpoint for Printers """